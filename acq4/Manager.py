@@ -13,16 +13,18 @@ The class is responsible for:
 """
 
 
-import os, sys, gc
+import os, sys, gc, threading
 
 import six
 import time, atexit, weakref
+import concurrent.futures
 from acq4.util import Qt
 import acq4.util.reload as reload
 
 from .util import DataManager, ptime, configfile
 from .Interfaces import *
 from .util.Mutex import Mutex
+from .util.StorageQueue import StorageQueue
 from .util.debug import *
 from .util import debug
 import getopt, glob
@@ -80,6 +82,8 @@ class Manager(Qt.QObject):
         self.disableAllDevs = False
         self.alreadyQuit = False
         self.taskLock = Mutex(Qt.QMutex.Recursive)
+        self.storageQueue = StorageQueue()  # background storage for task results (see Task.stop)
+        self.configurePool = None  # created by getConfigurePool() when first needed
         
         try:
             if Manager.CREATED:
@@ -454,6 +458,15 @@ class Manager(Qt.QObject):
         with self.lock:
             return list(self.devices.keys())
 
+    def getConfigurePool(self):
+        """Return the thread pool used by Task.configure() to configure devices
+        concurrently. The pool is created the first time it is requested.
+        """
+        with self.lock:
+            if self.configurePool is None:
+                self.configurePool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+            return self.configurePool
+
     def loadModule(self, moduleClassName, name=None, config=None, forceReload=False, importMod=None, execPath=None):
         """Create a new instance of an user interface module. 
 
@@ -810,6 +823,18 @@ class Manager(Qt.QObject):
             lm = len(self.modules)
             ld = len(self.devices)
             with pg.ProgressDialog("Shutting down..", 0, lm+ld, cancelText=None, wait=0) as dlg:
+                print("Writing queued task results..")
+                try:
+                    self.storageQueue.stop()
+                except:
+                    printExc("Error writing queued task results:")
+                try:
+                    if DataManager.DataManager.INSTANCE is not None:
+                        DataManager.getDataManager().compactIndexes()
+                except:
+                    printExc("Error compacting index journals:")
+                if self.configurePool is not None:
+                    self.configurePool.shutdown(wait=False)
                 self.documentation.quit()
                 print("Requesting all modules shut down..")
                 logMsg("Shutting Down.", importance=9)
@@ -864,6 +889,8 @@ class Task:
         self.startedDevs = []
         self.startTime = None
         self.stopTime = None
+        self._doneEvent = threading.Event()  # set by DeviceTasks when they finish (see deviceTaskDone)
+        self.protocolInfo = {}  # extra values to store in result['protocol'] (see stop)
 
         #self.reserved = False
         try:
@@ -902,11 +929,15 @@ class Task:
         elif isinstance(obj, DeviceTask):
             return obj.dev.name()
             
-    def getConfigOrder(self):
-        ## determine the order in which tasks must be configured
-        ## This is determined by tasks having called Task.addConfigDependency()
-        ## when they were initialized.
-            
+    def getConfigDependencies(self):
+        """Return (deps, cost) describing the configuration dependencies between 
+        devices in this task.
+        
+        *deps* maps each device name to the list of device names that must be
+        configured before it. These are determined by tasks having called 
+        Task.addConfigDependency() when they were initialized. *cost* maps each
+        device name to its DeviceTask.getPrepTimeEstimate().
+        """
         # request config order dependencies from devices
         deps = {devName: set() for devName in self.devNames}
         for devName, task in self.tasks.items():
@@ -917,15 +948,31 @@ class Task:
                     deps[t].add(devName)
                 
         # request estimated configure time
-        cost = {devName: self.tasks[devName].getPrepTimeEstimate() for devName in self.devNames}
+        cost = {devName: self.tasks[devName].getPrepTimeEstimate() for devName in self.tasks}
         
         # convert sets to lists
         deps = dict([(k, list(deps[k])) for k in deps.keys()])
+        return deps, cost
+        
+    def getConfigOrder(self):
+        ## determine the order in which tasks must be configured
+        deps, cost = self.getConfigDependencies()
         
         #return sorted order
         order = self.toposort(deps, cost)
         return order
         
+    def getPrepTimeEstimate(self):
+        """Return the estimated time required to prepare all devices for this task.
+        
+        Devices without configuration dependencies between them are prepared
+        concurrently, so this is the largest total of DeviceTask.getPrepTimeEstimate()
+        along any chain of dependent devices rather than the sum over all devices.
+        """
+        deps, cost = self.getConfigDependencies()
+        pathCost = self.criticalPathCost(deps, cost)
+        return max([0] + list(pathCost.values()))
+        
     def getStartOrder(self):
         ## determine the order in which tasks must be started
         ## This is determined by tasks having called Task.addStartDependency()
@@ -986,17 +1033,11 @@ class Task:
                     
                 prof.mark('reserve')
 
-                ## Determine order of device configuration.
-                configOrder = self.getConfigOrder()
-                    
-
                 ## Configure all subtasks. Some devices may need access to other tasks, so we make all available here.
                 ## This is how we allow multiple devices to communicate and decide how to operate together.
                 ## Each task may modify the startOrder list to suit its needs.
                 #print "Configuring subtasks.."
-                for devName in configOrder:
-                    self.tasks[devName].configure()
-                    prof.mark('configure %s' % devName)
+                self.configure(prof)
                     
                 startOrder = self.getStartOrder()
                 #print "done"
@@ -1036,19 +1077,15 @@ class Task:
                 isGuiThread = Qt.QThread.currentThread() == Qt.QCoreApplication.instance().thread()
                 #print "isGuiThread:", isGuiThread
                 while not self.isDone():
-                    now = ptime.time()
-                    elapsed = now - self.startTime
-                    if isGuiThread:
-                        if processEvents and now-lastProcess > 20e-3:  ## only process Qt events every 20ms
+                    if isGuiThread and processEvents:
+                        now = ptime.time()
+                        if now-lastProcess > 20e-3:  ## only process Qt events every 20ms
                             Qt.QApplication.processEvents()
                             lastProcess = ptime.time()
-                        
-                    if elapsed < self.cfg['duration']-10e-3:  ## If the task duration has not elapsed yet, only wake up every 10ms, and attempt to wake up 5ms before the end
-                        sleep = min(10e-3, self.cfg['duration']-elapsed-5e-3)
+                        self.waitForCompletion(maxWait=max(0, 20e-3 - (ptime.time()-lastProcess)))
                     else:
-                        sleep = 1.0e-3  ## afterward, wake up more quickly so we can respond as soon as the task finishes
-                    #print "sleep for", sleep
-                    time.sleep(sleep)
+                        ## sleep until devices notify us that they are done
+                        self.waitForCompletion()
                 #print "all tasks finshed."
                 
                 self.stop()
@@ -1062,6 +1099,94 @@ class Task:
                 prof.finish()
         
         
+    def configure(self, prof=None):
+        """Configure all DeviceTasks, respecting their configuration dependencies.
+        
+        DeviceTasks that do not depend on each other are configured concurrently
+        using the manager's configure pool, starting with those that lead the 
+        chains of dependent devices having the longest total prep time. Set 
+        'parallelConfigure': False in the protocol to configure all devices 
+        sequentially from the calling thread.
+        
+        This is called by execute() after all devices have been reserved.
+        """
+        deps, cost = self.getConfigDependencies()
+        
+        ## Nested tasks (for example, started by a DeviceTask's configure()) are 
+        ## configured sequentially to avoid waiting on the pool from one of its own threads.
+        parallel = self.cfg.get('parallelConfigure', True) and getattr(devices.Device.taskContext, 'task', None) is None
+        if not parallel:
+            for devName in self.toposort(deps, cost):
+                if devName not in self.tasks:
+                    continue
+                self.tasks[devName].configure()
+                if prof is not None:
+                    prof.mark('configure %s' % devName)
+            return
+        
+        pathCost = self.criticalPathCost(deps, cost)
+        waiting = {devName: set(deps[devName]) & set(self.tasks) for devName in self.tasks}
+        running = {}  # future: devName
+        error = None
+        
+        def finished(devName):
+            if prof is not None:
+                prof.mark('configure %s' % devName)
+            for d in waiting.values():
+                d.discard(devName)
+        
+        while len(waiting) > 0 or len(running) > 0:
+            if error is None:
+                ready = [devName for devName in waiting if len(waiting[devName]) == 0]
+                ready.sort(key=lambda devName: pathCost.get(devName, 0), reverse=True)
+                configuredHere = False
+                for devName in ready:
+                    del waiting[devName]
+                    if self.tasks[devName].parallelConfigure and (len(running) > 0 or len(ready) > 1):
+                        running[self.dm.getConfigurePool().submit(self._configureDevice, devName)] = devName
+                    else:
+                        ## configure from this thread if required, or if there is nothing to overlap with
+                        configuredHere = True
+                        try:
+                            self._configureDevice(devName)
+                        except Exception:
+                            error = sys.exc_info()
+                            break
+                        finished(devName)
+                if configuredHere and error is None:
+                    continue  # more devices may be ready now
+            
+            if len(running) == 0:
+                if error is None:
+                    raise Exception("Cannot resolve requested device configure/start order.")
+                break
+            
+            ## Wait for at least one device to finish configuring. After an error, 
+            ## just let the remaining devices finish before re-raising it.
+            done, notDone = concurrent.futures.wait(list(running), return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                devName = running.pop(fut)
+                try:
+                    fut.result()
+                except Exception:
+                    if error is None:
+                        error = sys.exc_info()
+                    continue
+                finished(devName)
+                    
+        if error is not None:
+            six.reraise(*error)
+            
+    def _configureDevice(self, devName):
+        ## Called from configure pool threads (and from the executing thread while they run).
+        ## Setting taskContext allows the DeviceTask to use device reservations that are
+        ## held by the thread executing this task, one thread at a time per device.
+        devices.Device.taskContext.task = self
+        try:
+            self.tasks[devName].configure()
+        finally:
+            devices.Device.taskContext.task = None
+        
     def isDone(self):
         """Return True if all tasks are completed and ready to return results.
 
@@ -1107,6 +1232,44 @@ class Task:
             self._done = d
             return d
         
+    def waitForCompletion(self, maxWait=None):
+        """Sleep until the task may have completed, then return isDone().
+        
+        The requested duration of the task is slept through, after which this 
+        method wakes as soon as the last DeviceTask calls notifyDone(). If any 
+        unfinished DeviceTask does not send notifications, it is polled every 1 ms 
+        instead. No more than *maxWait* seconds are spent waiting.
+        """
+        self._doneEvent.clear()
+        if self.isDone():
+            return True
+        
+        if self.startTime is None:
+            timeout = 1e-3
+        else:
+            remaining = self.cfg['duration'] - (ptime.time() - self.startTime)
+            if remaining > 0 and not self.abortRequested:
+                timeout = remaining
+            elif self._pollingRequired():
+                timeout = 1e-3
+            else:
+                timeout = 0.1  ## still wake up occasionally to check for timeout
+        if maxWait is not None:
+            timeout = min(timeout, maxWait)
+        self._doneEvent.wait(timeout)
+        return self.isDone()
+    
+    def deviceTaskDone(self, devTask):
+        """Called by DeviceTask.notifyDone() to wake up threads waiting for this task."""
+        self._doneEvent.set()
+    
+    def _pollingRequired(self):
+        """Return True if any unfinished DeviceTask will not notify us when it is done."""
+        for t in self.tasks.values():
+            if not t.notifiesDone and not t.isDone():
+                return True
+        return False
+        
     def _tasksDone(self):
         for t in self.tasks:
             if not self.tasks[t].isDone():
@@ -1138,6 +1301,7 @@ class Task:
 
             prof = Profiler("Manager.Task.stop", disabled=True)
             self.abortRequested = abort
+            self._doneEvent.set()  # wake any thread waiting in waitForCompletion
             try:
                 if not self.stopped:
                     ## Stop all device tasks
@@ -1157,6 +1321,7 @@ class Task:
                     #print "Get results.."
                     ## Let each device generate its own output structure.
                     result = {'protocol': {'startTime': self.startTime}}
+                    result['protocol'].update(self.protocolInfo)
                     for devName in self.tasks:
                         try:
                             result[devName] = self.tasks[devName].getResult()
@@ -1170,9 +1335,17 @@ class Task:
                     
                     ## Store data if requested
                     if 'storeData' in self.cfg and self.cfg['storeData'] is True:
-                        self.cfg['storageDir'].setInfo(result['protocol'])
-                        for t in self.tasks:
-                            self.tasks[t].storeResult(self.cfg['storageDir'])
+                        if self.cfg.get('storeAsync', False):
+                            ## results of device tasks that may need their device are
+                            ## stored now, before the devices are released. The rest
+                            ## are written from the manager's storage threads; this
+                            ## blocks only if too many results are already waiting.
+                            asyncDevs = [t for t in self.tasks if self.tasks[t].asyncStorage]
+                            self.storeResult([t for t in self.tasks if t not in asyncDevs])
+                            if len(asyncDevs) > 0:
+                                self.dm.storageQueue.submit(self.cfg['storageDir'], self._storeDeviceResults, (asyncDevs,))
+                        else:
+                            self.storeResult()
                     prof.mark("store data")
             finally:   
                 ## Regardless of any other problems, at least make sure we 
@@ -1194,6 +1367,24 @@ class Task:
             self.stop()
             return self.result
 
+    def storeResult(self, devNames=None):
+        """Write the protocol info and the results of device tasks to cfg['storageDir'].
+        
+        This is called by stop() if cfg['storeData'] is True. If cfg['storeAsync']
+        is also True, then the results of DeviceTasks with asyncStorage = True
+        are written later from one of the manager's storage threads (see 
+        Manager.storageQueue), after the devices have been released.
+        
+        *devNames* may list the devices whose results are written (default is all).
+        """
+        self.cfg['storageDir'].setInfo(self.result['protocol'])
+        self._storeDeviceResults(list(self.tasks) if devNames is None else devNames)
+
+    def _storeDeviceResults(self, devNames):
+        dh = self.cfg['storageDir']
+        for t in devNames:
+            self.tasks[t].storeResult(dh)
+
     def _releaseAll(self):
         with self.taskLock:
             #print self.id,"Task.releaseAll:"
@@ -1239,11 +1430,12 @@ class Task:
             cost = {'a': 0, 'b': 0, 'c': 1, 'e': 1, 'd': 3}
             
             # Then the total cost of following any node is its own cost plus
-            # the cost of all nodes that follow it:
+            # the largest total cost of the nodes that follow it (independent 
+            # branches may be configured concurrently; see criticalPathCost):
             #   A = cost[a]
-            #   B = cost[b] + cost[c] + cost[e] + cost[a]
-            #   C = cost[c] + cost[a]
-            #   D = cost[d] + cost[c] + cost[a]
+            #   B = cost[b] + max(C, E)
+            #   C = cost[c] + A
+            #   D = cost[d] + C
             #   E = cost[e]
             # If we sort independent branches such that the highest cost comes 
             # first, the output is:
@@ -1259,16 +1451,10 @@ class Task:
                 if k2 not in deps:
                     deps[k2] = []
 
-        # Compute total branch cost for each node
+        # Compute critical path cost for each node
         key = None
         if cost is not None:
-            order = Task.toposort(deps)
-            allDeps = {n: set(n) for n in order}
-            for n in order[::-1]:
-                for n2 in deps.get(n, []):
-                    allDeps[n2] |= allDeps.get(n, set())
-                    
-            totalCost = {n: sum([cost.get(x, 0) for x in allDeps[n]]) for n in allDeps}
+            totalCost = Task.criticalPathCost(deps, cost)
             key = lambda x: totalCost.get(x, 0)
 
         # compute weighted order
@@ -1298,6 +1484,28 @@ class Task:
         
         return order
         
+    @staticmethod
+    def criticalPathCost(deps, cost):
+        """Return a dictionary giving, for each node, the total cost of the most 
+        expensive chain of nodes that starts at that node and follows the 
+        dependencies in *deps* (see toposort for the meaning of arguments).
+        
+        If all nodes that do not depend on each other are processed concurrently,
+        then the largest value returned is the total time required to process
+        the entire graph.
+        """
+        order = Task.toposort(deps)
+        followers = {n: [] for n in order}
+        for n, nDeps in deps.items():
+            for n2 in nDeps:
+                followers[n2].append(n)
+        
+        totalCost = {}
+        for n in order[::-1]:
+            totalCost[n] = cost.get(n, 0) + max([0] + [totalCost[n2] for n2 in followers[n]])
+        return totalCost
+        
+        
 
 DOC_ROOT = 'http://acq4.org/documentation/'
 
@@ -4,6 +4,9 @@ import acq4.util.DataManager as DataManager
 import acq4.util.SequenceRunner as SequenceRunner
 from collections import OrderedDict
 import functools
+import os
+import multiprocessing
+import concurrent.futures
 from acq4.util.metaarray import *
 import numpy as np
 
@@ -204,6 +207,140 @@ def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
 
     yield data, None
 
+def loadSequenceArray(*args, **kargs):
+    """Read one file from every protocol directory in a sequence into a single MetaArray.
+    
+    This gives the same result as 
+        buildSequenceArray(seqDir, lambda protoDir: protoDir[fileName].read()[column])
+    but the output array is allocated once and only the requested column is read
+    from each file. Optionally, files may be read concurrently by a pool of worker
+    processes.
+    
+    Arguments:
+        dh:       directory handle for the protocol sequence
+        fileName: name of the MetaArray file to read from each protocol directory.
+                  If None (default), the clamp file is used (see getClampFile).
+        column:   (optional) name of the column to read from the first axis of each file, 
+                  eg. 'primary'
+        workers:  number of worker processes. If 1, files are read in this process.
+                  Larger values start a process pool; each worker imports acq4 and 
+                  every array is copied back to this process, so this only helps for 
+                  long sequences on multi-core machines. By default (None), a pool is 
+                  used only when the sequence is large enough to benefit (see 
+                  chooseSequenceWorkers).
+        truncate: If some files differ in shape, truncate to the smallest shape
+        fill:     Pre-fill the empty array with this value. Any points in the parameter 
+                  space with no data will be left with this value.
+        
+    Example: Return an array of all primary-channel clamp recordings across a sequence 
+        loadSequenceArray(seqDir, column='primary')"""
+    for i,m in loadSequenceArrayIter(*args, **kargs):
+        if m is None:
+            return i
+
+def loadSequenceArrayIter(dh, fileName=None, column=None, workers=None, truncate=False, fill=None):
+    """Iterator for loadSequenceArray that yields progress updates."""
+    params = listSequenceParams(dh)
+    seqShape = tuple([len(p) for p in params.values()])
+    info = [{'name': k, 'values': np.array(v)} for k,v in params.items()]
+    
+    ## find the file and sequence index for each protocol directory
+    files = []
+    for name in dh.subDirs():
+        subd = dh[name]
+        if fileName is None:
+            fh = getClampFile(subd)
+            if fh is None:
+                continue
+        elif subd.exists(fileName):
+            fh = subd[fileName]
+        else:
+            continue
+        dhInfo = subd.info()
+        files.append((tuple([dhInfo[k] for k in params]), fh.name()))
+    if len(files) == 0:
+        yield None, None
+        return
+    
+    ## read the first file here to determine the shape and meta info of the output
+    first = _readSequenceFile(files[0][1], column, meta=True)
+    shape = first.shape
+    data = MetaArray(np.empty(seqShape + shape, first.dtype), info=info + first.infoCopy())
+    if fill is not None:
+        data[:] = fill
+    
+    minShape = list(shape)
+    def store(ind, d):
+        if d.shape != shape and not truncate:
+            raise Exception("Data in %s has shape %s; expected %s. (use truncate=True)" % 
+                            (dict(files)[ind], str(d.shape), str(shape)))
+        sl = tuple([slice(0, min(d.shape[j], shape[j])) for j in range(d.ndim)])
+        for j in range(d.ndim):
+            minShape[j] = min(minShape[j], d.shape[j])
+        data.asarray()[ind + sl] = d[sl]
+    
+    store(files[0][0], first.asarray())
+    yield 1, len(files)
+    
+    if workers is None:
+        nBytes = sum([os.path.getsize(path) for ind, path in files])
+        workers = chooseSequenceWorkers(len(files), nBytes)
+    
+    if workers <= 1:
+        for i, (ind, path) in enumerate(files[1:]):
+            store(ind, _readSequenceFile(path, column))
+            yield i+2, len(files)
+    else:
+        ## Keep only a few files in flight so that memory use is bounded
+        ## regardless of the length of the sequence.
+        maxPending = workers * 2
+        pending = {}
+        todo = list(files[1:])
+        done = 1
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            while len(todo) > 0 or len(pending) > 0:
+                while len(todo) > 0 and len(pending) < maxPending:
+                    ind, path = todo.pop(0)
+                    pending[pool.submit(_readSequenceFile, path, column)] = ind
+                finished, notFinished = concurrent.futures.wait(list(pending), return_when=concurrent.futures.FIRST_COMPLETED)
+                for fut in finished:
+                    store(pending.pop(fut), fut.result())
+                    done += 1
+                yield done, len(files)
+    
+    if truncate and tuple(minShape) != shape:
+        data = data[tuple([slice(None)] * len(seqShape) + [slice(0,m) for m in minShape])]
+    yield data, None
+
+def chooseSequenceWorkers(nFiles, nBytes, cpuCount=None):
+    """Return the number of worker processes that loadSequenceArray should use 
+    to read *nFiles* files totalling *nBytes*.
+    
+    Starting a process pool costs roughly a second (each worker imports acq4), so 
+    files are read in this process unless the sequence has at least 32 files and 
+    64 MB of data. Above that, one worker is used per 16 files, up to the number 
+    of CPUs."""
+    if cpuCount is None:
+        cpuCount = multiprocessing.cpu_count()
+    if nFiles < 32 or nBytes < 64 * 2**20 or cpuCount < 2:
+        return 1
+    return max(2, min(cpuCount, nFiles // 16))
+
+def _readSequenceFile(fileName, column=None, meta=False):
+    ## Read data for loadSequenceArray (this may run in a worker process).
+    ## Returns the array, or a MetaArray if meta is True.
+    ma = MetaArray(file=fileName, readAllData=False)
+    try:
+        if column is not None:
+            data = ma[ma.axisName(0):column]
+        else:
+            data = ma[:]
+    finally:
+        ma.close()
+    if meta:
+        return data
+    return data.asarray()
+
 def getParent(child, parentType):
     """Return the (grand)parent of child that matches parentType"""
     if dirType(child) == parentType:
@@ -0,0 +1,64 @@
+from __future__ import print_function
+import tempfile, shutil, atexit
+import numpy as np
+import acq4.util.DataManager as dm
+from acq4.util.metaarray import MetaArray
+from acq4.analysis.dataModels.PatchEPhys import buildSequenceArray, loadSequenceArray, chooseSequenceWorkers
+
+root = tempfile.mkdtemp()
+def remove_tempdir():
+    shutil.rmtree(root)
+atexit.register(remove_tempdir)
+
+
+def makeSequence(name, amps, reps, nPts=500):
+    params = {('Clamp1', 'amp'): list(range(len(amps))), ('protocol', 'repetitions'): list(range(reps))}
+    seq = dm.getDirHandle(root).mkdir(name, info={'sequenceParams': params})
+    for i, amp in enumerate(amps):
+        for j in range(reps):
+            d = seq.mkdir('%03d_%03d' % (i, j), info={('Clamp1', 'amp'): i, ('protocol', 'repetitions'): j})
+            data = np.empty((2, nPts))
+            data[0] = amp + j + np.random.normal(size=nPts)
+            data[1] = amp
+            info = [{'name': 'Channel', 'cols': [{'name': 'primary'}, {'name': 'command'}]},
+                    {'name': 'Time', 'values': np.arange(nPts) * 1e-4}, {}]
+            d.writeFile(MetaArray(data, info=info), 'Clamp1.ma')
+    return seq
+
+
+def test_loadSequenceArray():
+    seq = makeSequence('seq', amps=[-10, 0, 10], reps=2)
+    ## sequential reference
+    expected = buildSequenceArray(seq, lambda protoDir: protoDir['Clamp1.ma'].read()['Channel':'primary'].asarray())
+    times = seq['000_000']['Clamp1.ma'].read().xvals('Time')
+    for workers in [1, 2]:
+        data = loadSequenceArray(seq, column='primary', workers=workers)
+        assert data.shape == expected.shape == (3, 2, 500)
+        assert np.all(data.asarray() == expected.asarray())
+        assert np.all(data.xvals('Time') == times)
+        assert np.all(data.xvals(0) == expected.xvals(0)) and np.all(data.xvals(1) == expected.xvals(1))
+
+    ## entire file, without a column
+    data = loadSequenceArray(seq)
+    assert data.shape == (3, 2, 2, 500)
+    assert np.all(data['Channel':'command'][:, 0, 0] == [-10, 0, 10])
+
+
+def test_loadSequenceArrayWorkers():
+    ## uneven sequence read through the process pool
+    seq = makeSequence('seqPool', amps=[-10, 0, 10], reps=3)
+    seq['001_002']['Clamp1.ma'].delete()
+    seq['002_001'].writeFile(MetaArray(np.zeros((2, 400)), info=[
+        {'name': 'Channel', 'cols': [{'name': 'primary'}, {'name': 'command'}]}, {'name': 'Time'}, {}]), 'Clamp1.ma')
+    serial = loadSequenceArray(seq, column='primary', workers=1, truncate=True, fill=np.nan)
+    pooled = loadSequenceArray(seq, column='primary', workers=2, truncate=True, fill=np.nan)
+    assert serial.shape == pooled.shape == (3, 3, 400)
+    assert np.all(np.isnan(pooled[1, 2]))
+    assert np.array_equal(serial.asarray(), pooled.asarray(), equal_nan=True)
+
+    ## default worker count depends on the size of the sequence
+    assert chooseSequenceWorkers(6, 10000, cpuCount=8) == 1
+    assert chooseSequenceWorkers(1000, 10 * 2**20, cpuCount=8) == 1
+    assert chooseSequenceWorkers(64, 100 * 2**20, cpuCount=1) == 1
+    assert chooseSequenceWorkers(64, 100 * 2**20, cpuCount=8) == 4
+    assert chooseSequenceWorkers(1000, 1 * 2**30, cpuCount=8) == 8
@@ -8,10 +8,12 @@ from acq4.analysis.AnalysisModule import AnalysisModule
 from acq4.util.pyqtgraph.functions import mkPen
 from acq4.util.flowchart import *
 import os
+import numpy as np
 from collections import OrderedDict
 import acq4.util.debug as debug
 import acq4.util.FileLoader as FileLoader
 import acq4.util.DatabaseGui as DatabaseGui
+import acq4.analysis.dataModels.PatchEPhys as PatchEPhys
 import FeedbackButton
 
 class IVCurve(AnalysisModule):
@@ -58,25 +60,34 @@ class IVCurve(AnalysisModule):
     def loadFileRequested(self, fh):
         """Called by file loader when a file load is requested."""
         ### This should load a whole directory of cciv, plot them, put traces into one array and send that array to the flowchart.
-        if fh.isDir():
-            dirs = [d for d in fh.subDirs()]
-        else:
-            dirs = [fh]
-            
         dataPlot = self.getElement('Data Plot')
         
         ## Attempt to stick all the traces into one big away -- not sure I like this because you lose the metaInfo.
-        a = fh[dirs[0]]['Clamp1.ma'].read()
-        data = np.empty((a.shape[0], a.shape[1], len(dirs)), dtype=np.float)        
+        if fh.isDir() and PatchEPhys.isSequence(fh):
+            ## read the whole sequence at once; this uses worker processes for long sequences
+            seq = PatchEPhys.loadSequenceArray(fh, fileName='Clamp1.ma')
+            nSeqAxes = seq.ndim - 2
+            traceShape = seq.shape[nSeqAxes:]
+            data = seq.asarray().reshape((-1,) + traceShape)
+            data = np.ascontiguousarray(np.moveaxis(data, 0, -1))
+            primary = seq['Channel':'primary'].asarray().reshape(-1, traceShape[1])
+        else:
+            if fh.isDir():
+                dirs = [d for d in fh.subDirs()]
+            else:
+                dirs = [fh]
+            a = fh[dirs[0]]['Clamp1.ma'].read()
+            data = np.empty((a.shape[0], a.shape[1], len(dirs)), dtype=float)
+            primary = []
+            for n, d in enumerate(dirs):
+                trace = fh[d]['Clamp1.ma'].read()
+                data[:,:,n] = trace
+                primary.append(trace['Channel':'primary'])
         
-        n=0
-        for d in dirs:
-            trace = fh[d]['Clamp1.ma'].read()
-            data[:,:,n] = trace
-            color = float(n)/(len(dirs))*0.7
+        for n in range(len(primary)):
+            color = float(n)/(len(primary))*0.7
             pen = mkPen(hsv=[color, 0.8, 0.7])
-            dataPlot.plot(trace['Channel':'primary'], pen=pen)
-            n += 1 
+            dataPlot.plot(primary[n], pen=pen)
     
         self.flowchart.setInput(dataIn=data)
         self.currentFile = fh
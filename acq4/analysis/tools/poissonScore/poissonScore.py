@@ -106,7 +106,6 @@ import scipy.interpolate
 import acq4.pyqtgraph as pg
 import acq4.pyqtgraph.console
 from six.moves import range
-import user
 import acq4.pyqtgraph.multiprocess as mp
 import os
 
@@ -123,6 +122,15 @@ def poissonProcess(rate, tmax=None, n=None):
             break
     return np.array(events)
 
+def countPrecedingEvents(times):
+    """For each event time, return the number of other events that occur at or before
+    that time (equivalent to [(times<=t).sum()-1 for t in times]).
+    
+    Times need not be sorted; the cost is O(n log n).
+    """
+    times = np.asarray(times)
+    return np.searchsorted(np.sort(times), times, side='right') - 1
+
 def poissonProb(n, t, l, clip=False):
     """
     For a poisson process, return the probability of seeing at least *n* events in *t* seconds given
@@ -198,7 +206,7 @@ class PoissonScore:
             #ev = np.concatenate(ev)   ## mix events together
             ev = events['time']
             
-            nVals = np.array([(ev<=t).sum()-1 for t in ev]) ## looks like arange, but consider what happens if two events occur at the same time.
+            nVals = countPrecedingEvents(ev) ## looks like arange, but consider what happens if two events occur at the same time.
             pi = poissonProb(nVals, ev, rate*nSets)  ## note that by using n=0 to len(ev)-1, we correct for the fact that the time window always ends at the last event
             pi = 1.0 / pi
             
@@ -436,12 +444,15 @@ class PoissonScore:
             plt.plot(cls.normalizationTable[0,i], cls.normalizationTable[1,i], pen=(i, 14), symbolPen=(i,14), symbol='o')
     
     @classmethod
-    def poissonScoreBlame(ev, rate):
-        nVals = np.array([(ev<=t).sum()-1 for t in ev]) 
-        pp1 = 1.0 /   (1.0 - cls.poissonProb(nVals, ev, rate, clip=True))
-        pp2 = 1.0 /   (1.0 - cls.poissonProb(nVals-1, ev, rate, clip=True))
+    def poissonScoreBlame(cls, ev, rate):
+        nVals = countPrecedingEvents(ev)
+        pp1 = 1.0 /   (1.0 - poissonProb(nVals, ev, rate, clip=True))
+        pp2 = 1.0 /   (1.0 - poissonProb(nVals-1, ev, rate, clip=True))
         diff = pp1 / pp2
-        blame = np.array([diff[np.argwhere(ev >= ev[i])].max() for i in range(len(ev))])
+        ## for each event, the largest diff of all events at or after its time
+        order = np.argsort(ev, kind='mergesort')
+        maxAfter = np.maximum.accumulate(diff[order][::-1])[::-1]
+        blame = maxAfter[np.searchsorted(ev[order], ev, side='left')]
         return blame
 
     @classmethod
@@ -574,14 +585,13 @@ class PoissonRepeatScore:
         ev = list(map(np.sort, ev))
         pp = np.empty((len(ev), len(ev2)))
         for i, trial in enumerate(ev):
-            nVals = []
-            for j in range(len(ev2)):
-                n = (trial<ev2[j]['time']).sum()
-                if any(trial == ev2[j]['time']) and ev2[j]['trial'] > i:  ## need to correct for the case where two events in separate trials happen to have exactly the same time.
-                    n += 1
-                nVals.append(n)
+            ## number of events in this trial before each event in ev2
+            nVals = np.searchsorted(trial, ev2['time'], side='left')
+            ## need to correct for the case where two events in separate trials happen to have exactly the same time.
+            tie = np.searchsorted(trial, ev2['time'], side='right') > nVals
+            nVals += tie & (ev2['trial'] > i)
             
-            pp[i] = 1.0 / (1.0 - poissonProb(np.array(nVals), ev2['time'], rate[i]))
+            pp[i] = 1.0 / (1.0 - poissonProb(nVals, ev2['time'], rate[i]))
            
             ## apply extra score for uncommonly large amplitudes
             ## (note: by default this has no effect; see amplitudeScore)
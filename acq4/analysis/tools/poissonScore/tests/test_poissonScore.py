@@ -0,0 +1,100 @@
+from __future__ import print_function
+import numpy as np
+from acq4.analysis.tools.poissonScore import PoissonScore, PoissonAmpScore, PoissonRepeatScore, \
+    poissonProb, countPrecedingEvents
+
+
+def loopPoissonScore(ev, rate):
+    ## reference implementation (the original PoissonScore.score, without normalization)
+    nSets = len(ev)
+    events = np.concatenate(ev)
+    if len(events) == 0:
+        return 1.0
+    ev = events['time']
+    nVals = np.array([(ev<=t).sum()-1 for t in ev])
+    return (1.0 / poissonProb(nVals, ev, rate*nSets)).max()
+
+
+def loopPoissonRepeatScore(ev, rate):
+    ## reference implementation (the original PoissonRepeatScore.score, without normalization)
+    ev = [x['time'] for x in ev]
+    ev2 = []
+    for i in range(len(ev)):
+        arr = np.zeros(len(ev[i]), dtype=[('trial', int), ('time', float)])
+        arr['time'] = ev[i]
+        arr['trial'] = i
+        ev2.append(arr)
+    ev2 = np.sort(np.concatenate(ev2), order=['time', 'trial'])
+    if len(ev2) == 0:
+        return 1.0
+    ev = list(map(np.sort, ev))
+    pp = np.empty((len(ev), len(ev2)))
+    for i, trial in enumerate(ev):
+        nVals = []
+        for j in range(len(ev2)):
+            n = (trial<ev2[j]['time']).sum()
+            if any(trial == ev2[j]['time']) and ev2[j]['trial'] > i:
+                n += 1
+            nVals.append(n)
+        pp[i] = 1.0 / (1.0 - poissonProb(np.array(nVals), ev2['time'], rate))
+    return pp.prod(axis=0).max()
+
+
+def loopPoissonScoreBlame(ev, rate):
+    ## reference implementation (the original PoissonScore.poissonScoreBlame)
+    nVals = np.array([(ev<=t).sum()-1 for t in ev])
+    pp1 = 1.0 / (1.0 - poissonProb(nVals, ev, rate, clip=True))
+    pp2 = 1.0 / (1.0 - poissonProb(nVals-1, ev, rate, clip=True))
+    diff = pp1 / pp2
+    return np.array([diff[ev >= ev[i]].max() for i in range(len(ev))])
+
+
+def makeEvents(rng, rate, tMax, reps, evokedTime=None):
+    sets = []
+    for i in range(reps):
+        times = rng.uniform(0, tMax, size=rng.poisson(rate * tMax))
+        if evokedTime is not None:
+            times = np.concatenate([times, evokedTime + rng.normal(scale=2e-3, size=3)])
+        ## round so that some events occur at exactly the same time
+        times = np.round(np.abs(times), 3)
+        ev = np.empty(len(times), dtype=[('time', float), ('amp', float)])
+        ev['time'] = times
+        ev['amp'] = rng.normal(size=len(times))
+        sets.append(ev)
+    return sets
+
+
+def test_countPrecedingEvents():
+    times = np.array([0.3, 0.1, 0.3, 0.0, 0.5, 0.1])
+    assert list(countPrecedingEvents(times)) == [(times<=t).sum()-1 for t in times]
+
+
+def test_poissonScore():
+    rng = np.random.RandomState(0)
+    for rate, tMax, reps in [(10., 0.2, 1), (50., 0.5, 3), (200., 1.0, 2), (1., 0.1, 2)]:
+        for evoked in [None, 0.05]:
+            ev = makeEvents(rng, rate, tMax, reps, evoked)
+            expected = loopPoissonScore(ev, rate)
+            assert np.allclose(PoissonScore.score(ev, rate, tMax=tMax, normalize=False), expected, rtol=1e-12)
+            assert np.allclose(PoissonRepeatScore.score(ev, rate, tMax=tMax, normalize=False),
+                               loopPoissonRepeatScore(ev, rate), rtol=1e-12)
+
+    ## amplitude score is applied to events in their original order
+    ev = makeEvents(rng, 50., 0.5, 3)
+    score = PoissonAmpScore.score(ev, 50., normalize=False, ampMean=0.0, ampStdev=1.0)
+    events = np.concatenate(ev)
+    pi = 1.0 / poissonProb(countPrecedingEvents(events['time']), events['time'], 150.)
+    assert np.allclose(score, (pi * PoissonAmpScore.amplitudeScore(events, ampMean=0.0, ampStdev=1.0)).max())
+
+    assert PoissonScore.score([np.empty(0, dtype=[('time', float)])], 10., normalize=False) == 1.0
+
+
+def test_poissonScoreBlame():
+    rng = np.random.RandomState(1)
+    ## rounding makes some events occur at exactly the same time
+    evs = [np.round(rng.uniform(0, 1, 300), 2), np.round(rng.uniform(0, 1, 20), 2),
+           np.array([0.3, 0.1, 0.3, 0.0, 0.5, 0.1, 0.3]), np.array([0.2])]
+    for ev in evs:
+        for rate in [0.5 * len(ev), 1.0 * len(ev)]:
+            blame = PoissonScore.poissonScoreBlame(ev, rate)
+            assert np.allclose(blame, loopPoissonScoreBlame(ev, rate), rtol=1e-12, equal_nan=True)
@@ -462,6 +462,8 @@ class AxoPatch200Task(DAQGenericTask):
     def storeResult(self, dirHandle):
         #DAQGenericTask.storeResult(self, dirHandle)
         #dirHandle.setInfo(self.ampState)
+        ## (may run on a storage thread; ampState was recorded in configure() and
+        ## getResult() builds a new array, so the device itself is not accessed)
         result = self.getResult()
         result._info[-1]['ClampState'] = self.ampState
         dirHandle.writeFile(result, self.dev.name())
@@ -96,6 +96,9 @@ class Camera(DAQGeneric, OptomechDevice):
             self.objectiveChanged()
             self._lightChanged()
 
+        ## Preallocated arrays for drivers to copy new frames into (see frameBuffer)
+        self.framePool = imaging.FramePool(config.get('framePoolSize', 16))
+        
         self.setupCamera() 
         #print "Camera: setupCamera returned, about to create acqThread"
         self.sensorSize = self.getParam('sensorSize')
@@ -196,12 +199,37 @@ class Camera(DAQGeneric, OptomechDevice):
         """Returns a list of all new frames that have arrived since the last call. The list looks like:
             [{'id': 0, 'data': array, 'time': 1234678.3213}, ...]
         id is a unique integer representing the frame number since the start of the program.
-        data should be a permanent copy of the image (ie, not directly from a circular buffer)
+        data should be a permanent copy of the image (ie, not directly from a circular buffer).
+            Drivers should copy image data into an array returned by frameBuffer() rather than 
+            allocating a new array for every frame.
         time is the time of arrival of the frame. Optionally, 'exposeStartTime' and 'exposeDoneTime' 
             may be specified if they are available.
         """
         raise NotImplementedError("Function must be reimplemented in subclass.")
         
+    def frameBuffer(self, shape, dtype):
+        """Return an array from this camera's frame pool that newFrames() may 
+        copy new image data into. 
+        
+        The array is reused for a later frame only after all references to it
+        have been released. The number of slots in the pool is set by the
+        'framePoolSize' config option (default 16).
+        """
+        return self.framePool.get(shape, dtype)
+    
+    def acquisitionStats(self):
+        """Return a dict of frame counts since acquisition was last started:
+        
+        * frames: the number of frames received from the camera
+        * dropped: the number of frames missing from the sequence of frame IDs
+          reported by the camera
+        * overruns: the number of frames for which no frame pool slot was free, 
+          so that a new array had to be allocated
+        """
+        stats = self.acqThread.stats()
+        stats['overruns'] = self.framePool.stats()['overruns']
+        return stats
+    
     def startCamera(self):
         """Calls the camera driver to start the camera's acquisition."""
         raise NotImplementedError("Function must be reimplemented in subclass.")
@@ -448,8 +476,9 @@ class Frame(imaging.Frame):
     def __init__(self, data, info):
         ## make frame transform to map from image coordinates to sensor coordinates.
         ## (these may differ due to binning and region of interest settings)
-        tr = Camera.makeFrameTransform(info['region'], info['binning'])
-        info['frameTransform'] = tr
+        ## AcquireThread computes this once for all frames with the same region and binning.
+        if 'frameTransform' not in info:
+            info['frameTransform'] = Camera.makeFrameTransform(info['region'], info['binning'])
 
         imaging.Frame.__init__(self, data, info)
     
@@ -469,6 +498,9 @@ class CameraTask(DAQGenericTask):
         
         self.__startOrder = [], []
         self.camCmd = cmd
+        ## newFrame() notifies the parent task when 'minFrames' have been collected;
+        ## without minFrames, the parent task polls isDone() as usual.
+        self.notifiesDone = 'minFrames' in cmd
         self.lock = Mutex()
         self.recordHandle = None
         self.stopAfter = False
@@ -544,14 +576,18 @@ class CameraTask(DAQGenericTask):
             
     def newFrame(self, frame):
         disconnect = False
+        notify = False
         with self.lock:
             if self.recording:
                 self.frames.append(frame)
+                notify = len(self.frames) == self.camCmd.get('minFrames', None)
             if self.stopRecording and frame.info()['time'] > self._stopTime:
                 self.recording = False
                 disconnect = True
         if disconnect:   ## Must be done only after unlocking mutex
             self.dev.acqThread.disconnectCallback(self.newFrame)
+        if notify:
+            self.notifyDone()
 
     def start(self):
         ## arm recording
@@ -758,6 +794,8 @@ class AcquireThread(Thread):
         self.bufferTime = 5.0
         #self.ringSize = 30
         self.tasks = []
+        self.frameCount = 0
+        self.droppedFrames = 0
         
         ## This thread does not run an event loop,
         ## so we may need to deliver frames manually to some places
@@ -775,6 +813,11 @@ class AcquireThread(Thread):
         self.lock.unlock()
         Thread.start(self, *args)
     
+    def stats(self):
+        """Return the number of frames received and dropped since acquisition was last started."""
+        with self.lock:
+            return {'frames': self.frameCount, 'dropped': self.droppedFrames}
+    
     def connectCallback(self, method):
         with self.connectMutex:
             self.connections.add(method)
@@ -821,6 +864,14 @@ class AcquireThread(Thread):
         region = camState['region']
         mode = camState['triggerMode']
         
+        ## region and binning are fixed during acquisition, so this is shared by all frames
+        frameTransform = Camera.makeFrameTransform(region, binning)
+        
+        with self.lock:
+            self.frameCount = 0
+            self.droppedFrames = 0
+        self.dev.framePool.resetStats()
+        
         try:
             #self.dev.setParam('ringSize', self.ringSize, autoRestart=False)
             self.dev.startCamera()
@@ -836,10 +887,14 @@ class AcquireThread(Thread):
                 
                 ## If a new frame is available, process it and inform other threads
                 if len(frames) > 0:
+                    drop = 0
                     if lastFrameId is not None:
                         drop = frames[0]['id'] - lastFrameId - 1
                         if drop > 0:
                             print("WARNING: Camera dropped %d frames" % drop)
+                    with self.lock:
+                        self.frameCount += len(frames)
+                        self.droppedFrames += max(0, drop)
                         
                     ## Build meta-info for this frame(s)
                     info = camState.copy()
@@ -856,7 +911,9 @@ class AcquireThread(Thread):
                             'pixelSize': [ps[0] * binning[0], ps[1] * binning[1]],  ## size of image pixel
                             'objective': ss.get('objective', None),
                             'deviceTransform': transform,
-                            'illumination': ss.get('illumination', None)
+                            'illumination': ss.get('illumination', None),
+                            'frameTransform': frameTransform,
+                            'transform': SRTTransform3D(transform * frameTransform),
                         }
 
                     ## Copy frame info to info array
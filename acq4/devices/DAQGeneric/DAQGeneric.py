@@ -40,10 +40,18 @@ class DataMapping:
         offset = self.offset[chan]
         return (data*scale) - offset
         
-    def mapFromDaq(self, chan, data):
+    def mapFromDaq(self, chan, data, out=None):
+        """Return data recorded from the DAQ, scaled to the channel's units.
+        
+        If *out* is given, the result is written into it rather than a new array.
+        """
         scale = self.scale[chan]
         offset = self.offset[chan]
-        return (data + offset) * scale
+        if out is None:
+            return (data + offset) * scale
+        np.add(data, offset, out=out)
+        np.multiply(out, scale, out=out)
+        return out
             
 
 class ChannelHandle(object):
@@ -264,6 +272,12 @@ class DAQGeneric(Device):
             
 
 class DAQGenericTask(DeviceTask):
+    ## configure() only talks to this device and its DAQs, which serialize access
+    ## through device reservations; it may run alongside other devices' configure()
+    parallelConfigure = True
+    ## results are built from this task's DAQ buffers and the state recorded in configure()
+    asyncStorage = True
+    
     def __init__(self, dev, cmd, parentTask):
         DeviceTask.__init__(self, dev, cmd, parentTask)
         self.daqTasks = {}
@@ -425,30 +439,27 @@ class DAQGenericTask(DeviceTask):
         ## Access data recorded from DAQ task
         ## create MetaArray and fill with MC state info
         
-        ## Collect data and info for each channel in the command
-        result = {}
+        ## Collect data and info for each channel in the command.
+        ## The DAQ task returns views of its own buffers; these are scaled
+        ## directly into the rows of a single preallocated array.
+        result = OrderedDict()
         for ch in self.bufferedChannels:
             result[ch] = self.daqTasks[ch].getData(self.dev._DGConfig[ch]['channel'])
-            result[ch]['data'] = self.mapping.mapFromDaq(ch, result[ch]['data']) ## scale/offset/invert
             result[ch]['units'] = self.getChanUnits(ch)
         
         if len(result) > 0:
             meta = result[list(result.keys())[0]]['info']
             rate = meta['rate']
             nPts = meta['numPts']
-            ## Create an array of time values
-            timeVals = np.linspace(0, float(nPts-1) / float(rate), nPts)
             
-            ## Concatenate all channels together into a single array, generate MetaArray info
-            chanList = [np.atleast_2d(result[x]['data']) for x in result]
+            dtype = np.result_type(*[np.result_type(result[ch]['data'], self.mapping.offset[ch], self.mapping.scale[ch]) for ch in result])
+            arr = np.empty((len(result), nPts), dtype=dtype)
+            for i, ch in enumerate(result):
+                data = result[ch]['data']
+                if data.shape != (nPts,):
+                    raise Exception("DAQ returned %s samples for channel %s; expected %d." % (str(data.shape), ch, nPts))
+                result[ch]['data'] = self.mapping.mapFromDaq(ch, data, out=arr[i]) ## scale/offset/invert
             cols = [(x, result[x]['units']) for x in result]
-            # print cols
-            try:
-                arr = np.concatenate(chanList)
-            except:
-                print(chanList)
-                print([a.shape for a in chanList])
-                raise
             
             daqState = OrderedDict()
             for ch in self.dev._DGConfig:
@@ -462,13 +473,13 @@ class DAQGenericTask(DeviceTask):
                     
                     daqState[ch]['holding'] = self.holdingVals[ch]
             
-            info = [axis(name='Channel', cols=cols), axis(name='Time', units='s', values=timeVals)] + [{'DAQ': daqState}]
-            
+            ## Time values are computed from the sample rate only when requested
+            info = [axis(name='Channel', cols=cols), axis(name='Time', units='s', start=0.0, rate=float(rate))] + [{'DAQ': daqState}]
             
-            protInfo = self._DAQCmd.copy()  ## copy everything but the command arrays and low-level configuration info
-            for ch in protInfo:
-                protInfo[ch].pop('command', None)
-                protInfo[ch].pop('lowLevelConf', None)
+            ## everything but the command arrays and low-level configuration info
+            protInfo = OrderedDict()
+            for ch, cmd in self._DAQCmd.items():
+                protInfo[ch] = dict([(k, v) for k, v in cmd.items() if k not in ('command', 'lowLevelConf')])
             info[-1]['Protocol'] = protInfo
                 
             marr = MetaArray(arr, info=info)
@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
-import time, traceback, sys, weakref
+import time, traceback, sys, weakref, threading
 from acq4.util import Qt
 from acq4.util.Mutex import Mutex
 from acq4.util.debug import *
 from acq4.Interfaces import InterfaceMixin
 
 
+## Manager.Task may configure its DeviceTasks from worker threads. Those threads
+## set taskContext.task so that they can use the device reservations that are
+## held by the thread executing the task (see Device.reserve).
+taskContext = threading.local()
+
+
 class Device(Qt.QObject, InterfaceMixin):
     """Abstract class defining the standard interface for Device subclasses."""
     def __init__(self, deviceManager, config, name):
@@ -19,6 +25,9 @@ class Device(Qt.QObject, InterfaceMixin):
         # don't have a good solution for this problem at present..
         self._lock_ = Mutex(Qt.QMutex.Recursive)
         self._lock_tb_ = None
+        # Threads configuring devices on behalf of a task that holds the reservation
+        # (see taskContext) still take this lock, so that they access the device one at a time.
+        self._taskLock_ = threading.RLock()
         self.dm = deviceManager
         self.dm.declareInterface(name, ['device'], self)
         self._name = name
@@ -77,6 +86,8 @@ class Device(Qt.QObject, InterfaceMixin):
 
     def reserve(self, block=True, timeout=20):
         #print "Device %s attempting lock.." % self.name()
+        if self._reservedByCurrentTask():
+            return self._reserveForTask(block, timeout)
         if block:
             l = self._lock_.tryLock(int(timeout*1000))
             if not l:
@@ -97,12 +108,33 @@ class Device(Qt.QObject, InterfaceMixin):
         return True
         
     def release(self):
+        if self._reservedByCurrentTask():
+            self._taskLock_.release()
+            return
         try:
             self._lock_.unlock()
             self._lock_tb_ = None
         except:
             printExc("WARNING: Failed to release device lock for %s" % self.name())
             
+    def _reservedByCurrentTask(self):
+        """Return True if this thread is working on behalf of a task that has
+        already reserved this device from another thread.
+        """
+        task = getattr(taskContext, 'task', None)
+        return task is not None and self.name() in task.lockedDevs
+
+    def _reserveForTask(self, block, timeout):
+        ## (threading.RLock.acquire has no timeout argument in python 2)
+        if not block:
+            return self._taskLock_.acquire(False)
+        stop = time.time() + timeout
+        while not self._taskLock_.acquire(False):
+            if time.time() > stop:
+                raise Exception("Timed out waiting for device lock for %s" % self.name())
+            time.sleep(1e-3)
+        return True
+            
     def getTriggerChannel(self, daq):
         """Return the name of the channel on daq that this device raises when it starts.
         Allows the DAQ to trigger off of this device."""
@@ -120,6 +152,25 @@ class DeviceTask(object):
     
     DeviceTask instances are usually created by calling Device.createTask().
     """
+    
+    ## Subclasses that call notifyDone() when they finish should set this to
+    ## True. The parent task then sleeps until it is notified rather than 
+    ## polling isDone() on this DeviceTask.
+    notifiesDone = False
+
+    ## Whether configure() may be called from a worker thread, concurrently
+    ## with other DeviceTasks that it has no configuration dependency on.
+    ## Only subclasses whose configure() is known to be thread-safe should 
+    ## enable this.
+    parallelConfigure = False
+
+    ## Whether storeResult() may be called from a storage thread after the
+    ## device has been released (see Manager.Task.storeResult). This is only
+    ## safe if storeResult() uses nothing but data owned by this DeviceTask
+    ## (not the current state of the device, which may already be in use by
+    ## the next task).
+    asyncStorage = False
+
     def __init__(self, dev, cmd, parentTask):
         """
         Initialization is provided 3 arguments: *dev* is the Device for which
@@ -173,9 +224,12 @@ class DeviceTask(object):
         parameters needed.
         
         The parent Task will call this method on each DeviceTask in an order
-        determined by the configuration dependencies declared in 
-        DeviceTask.__init__. 
-        
+        determined by the configuration dependencies declared in
+        DeviceTask.__init__. DeviceTasks that do not depend on each other may
+        be configured concurrently from worker threads if they set
+        parallelConfigure = True. Devices reserved by the task are still
+        accessed by one configuring thread at a time.
+
         This method is responsible for indicating to the parent Task any 
         start-order dependencies. For example:
         
@@ -226,6 +280,17 @@ class DeviceTask(object):
         """
         return True
     
+    def notifyDone(self):
+        """
+        Inform the parent task that this DeviceTask has (probably) completed.
+        
+        This may be called from any thread. The parent task will wake and check
+        isDone() on all of its DeviceTasks.
+        """
+        task = self.parentTask()
+        if task is not None:
+            task.deviceTaskDone(self)
+    
     def stop(self, abort=False):
         """
         Stop this DeviceTask. If abort is True, then the task should stop as
@@ -262,6 +327,9 @@ class DeviceTask(object):
           `dirHandle.setInfo(...)`. As in the case of files, only a single key
           should be added to the directory meta-info, and it should begin with
           the name of the device.
+          
+        If asyncStorage is True, this method may be called from another thread
+        after the device has been released.
         """
         result = self.getResult()
         if result is None:
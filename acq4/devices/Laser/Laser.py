@@ -698,6 +698,11 @@ class LaserTask(DAQGenericTask):
     }
     
     """
+    ## configure() may run power measurement tasks of its own; keep it on the executing thread
+    parallelConfigure = False
+    ## getResult() updates the device's lastResult
+    asyncStorage = False
+    
     def __init__(self, dev, cmd, parentTask):
         self.cmd = cmd
         self.dev = dev ## this happens in DAQGeneric initialization, but we need it here too since it is used in making the waveforms that go into DaqGeneric.__init__
@@ -3,7 +3,7 @@ from __future__ import print_function
 from acq4.util.debug import *
     
 from acq4.devices.Device import *
-import time, traceback, sys
+import time, traceback, sys, threading
 from .taskGUI import *
 #from numpy import byte
 import numpy
@@ -12,6 +12,8 @@ import scipy.signal, scipy.ndimage
 import acq4.util.advancedTypes as advancedTypes
 from acq4.util.debug import *
 import acq4.util.Mutex as Mutex
+from acq4.drivers.nidaq.base import NIDAQError
+from collections import OrderedDict
 
 class NiDAQ(Device):
     """
@@ -127,19 +129,20 @@ class NiDAQ(Device):
     @staticmethod
     def downsample(data, ds, method, **kargs):
         if method == 'subsample':
-            data = data[::ds].copy()
+            data = data[..., ::ds].copy()
         
         elif method == 'mean':
             # decimate by averaging points together (does not remove HF noise, just folds it down.)
-            if res['info']['type'] in ['di', 'do']:
-                data = NiDAQ.meanResample(data, ds, binary=True)
-            else:
-                data = NiDAQ.meanResample(data, ds)
+            data = NiDAQ.meanResample(data, ds, binary=kargs.get('binary', False))
             
         elif method == 'fourier':            
             # Decimate using fourier resampling -- causes ringing artifacts, very slow to compute (possibly uses butterworth filter?)
-            newLen = int(data.shape[0] / ds)
-            data = scipy.signal.resample(data, newLen, window=8) # Use a kaiser window with beta=8
+            newLen = int(data.shape[-1] / ds)
+            data = scipy.signal.resample(data, newLen, window=8, axis=-1) # Use a kaiser window with beta=8
+        
+        elif method == 'polyphase':
+            # Anti-aliasing FIR filter and decimation in a single polyphase pass
+            data = NiDAQ.decimate(data, ds)
         
         elif method == 'bessel_mean':
             # Lowpass, then average. Bessel filter has less efficient lowpass characteristics and filters some of the passband as well.
@@ -160,19 +163,43 @@ class NiDAQ(Device):
         
     @staticmethod
     def meanResample(data, ds, binary=False):
-        """Resample data by taking mean of ds samples at a time"""
-        newLen = int(data.shape[0] / ds) * ds
-        data = data[:newLen]
-        data.shape = (data.shape[0]/ds, ds)
+        """Resample data by taking mean of ds samples at a time.
+        
+        2D data (one channel per row) is resampled along the last axis.
+        """
+        newLen = data.shape[-1] // ds
+        data = data[..., :newLen*ds].reshape(data.shape[:-1] + (newLen, ds))
         if binary:
-            data = data.mean(axis=1).round().astype(numpy.byte)
+            data = data.mean(axis=-1).round().astype(numpy.byte)
         else:
-            data = data.mean(axis=1)
+            data = data.mean(axis=-1)
         return data
     
     @staticmethod
-    def lowpass(data, cutoff, order=4, bidir=True, filter='bessel', stopCutoff=None, gpass=2., gstop=20., samplerate=None):
-        """Bi-directional bessel/butterworth lowpass filter"""
+    def decimate(data, ds):
+        """Downsample data by an integer factor *ds* using a polyphase FIR
+        filter (zero phase, with anti-aliasing). 2D data is decimated along the
+        last axis.
+        """
+        return scipy.signal.resample_poly(data, 1, ds, axis=-1)
+    
+    ## second-order sections of recently used lowpass filters
+    _filterCache = OrderedDict()
+    _filterCacheSize = 32
+    
+    @staticmethod
+    def lowpassFilter(cutoff, order=4, filter='bessel', stopCutoff=None, gpass=2., gstop=20., samplerate=None):
+        """Return the second-order sections (see scipy.signal.sosfilt) of a
+        bessel/butterworth lowpass filter.
+        
+        Filters are cached, so repeated calls with the same arguments do not
+        redesign the filter.
+        """
+        key = (filter, cutoff, order, stopCutoff, gpass, gstop, samplerate)
+        cache = NiDAQ._filterCache
+        if key in cache:
+            return cache[key]
+        
         if samplerate is not None:
             cutoff /= 0.5*samplerate
             if stopCutoff is not None:
@@ -187,48 +214,76 @@ class NiDAQ(Device):
                 #return 105. / (w**8 + 10*w**6 + 135*w**4 + 1575*w**2 + 11025.)**0.5
             #v = fsolve(lambda x: m(x)-limit, 1.0)
             #Wn = cutoff / (sampr*v)
-            b,a = scipy.signal.bessel(order, cutoff, btype='low') 
+            sos = scipy.signal.bessel(order, cutoff, btype='low', output='sos') 
         elif filter == 'butterworth':
             if stopCutoff is None:
                 stopCutoff = cutoff * 2.0
             ord, Wn = scipy.signal.buttord(cutoff, stopCutoff, gpass, gstop)
             #print "butterworth ord %f   Wn %f   c %f   sc %f" % (ord, Wn, cutoff, stopCutoff)
-            b,a = scipy.signal.butter(ord, Wn, btype='low') 
+            sos = scipy.signal.butter(ord, Wn, btype='low', output='sos') 
         else:
             raise Exception('Unknown filter type "%s"' % filter)
-            
-        padded = numpy.hstack([data[:100], data, data[-100:]])   ## can we intelligently decide how many samples to pad with?
-
+        
+        cache[key] = sos
+        while len(cache) > NiDAQ._filterCacheSize:
+            cache.popitem(last=False)
+        return sos
+    
+    @staticmethod
+    def lowpass(data, cutoff, order=4, bidir=True, filter='bessel', stopCutoff=None, gpass=2., gstop=20., samplerate=None):
+        """Bi-directional bessel/butterworth lowpass filter
+        
+        2D data (one channel per row) is filtered along the last axis, all
+        channels at once. If *bidir* is True, the filter is applied forward and
+        backward (zero phase); otherwise it is applied causally, starting from
+        the steady state for the first sample.
+        """
+        sos = NiDAQ.lowpassFilter(cutoff, order=order, filter=filter, stopCutoff=stopCutoff, gpass=gpass, gstop=gstop, samplerate=samplerate)
+        if data.shape[-1] < 2:
+            return data.astype(float)
+        
         if bidir:
-            data = scipy.signal.lfilter(b, a, scipy.signal.lfilter(b, a, padded)[::-1])[::-1][100:-100]  ## filter twice; once forward, once reversed. (This eliminates phase changes)
+            ## filter twice; once forward, once reversed. (This eliminates phase changes)
+            return scipy.signal.sosfiltfilt(sos, data, axis=-1, padlen=min(100, data.shape[-1]-1))
         else:
-            data = scipy.signal.lfilter(b, a, padded)[100:-100]
-        return data
+            zi = scipy.signal.sosfilt_zi(sos)
+            zi = zi.reshape((zi.shape[0],) + (1,)*(data.ndim-1) + (2,)) * data[..., :1]
+            return scipy.signal.sosfilt(sos, data, axis=-1, zi=zi)[0]
 
     @staticmethod
     def denoise(data, radius=2, threshold=4):
         """Very simple noise removal function. Compares a point to surrounding points,
-        replaces with nearby values if the difference is too large."""
+        replaces with nearby values if the difference is too large.
+        
+        2D data (one channel per row) is processed along the last axis.
+        """
         
         r2 = radius * 2
-        d2 = data[radius:] - data[:-radius] #a derivative
-        stdev = d2.std()
+        d2 = data[..., radius:] - data[..., :-radius] #a derivative
+        stdev = d2.std(axis=-1)[..., numpy.newaxis]
         mask1 = d2 > stdev*threshold #where derivative is large and positive
         mask2 = d2 < -stdev*threshold #where derivative is large and negative
-        maskpos = mask1[:-radius] * mask2[radius:] #both need to be true
-        maskneg = mask1[radius:] * mask2[:-radius]
-        mask = maskpos + maskneg
-        d5 = numpy.where(mask, data[:-r2], data[radius:-radius]) #where both are true replace the value with the value from 2 points before
-        d6 = numpy.empty(data.shape, dtype=data.dtype) #add points back to the ends
-        d6[radius:-radius] = d5
-        d6[:radius] = data[:radius]
-        d6[-radius:] = data[-radius:]
+        mask = mask1[..., :-radius] & mask2[..., radius:] #both need to be true
+        mask |= mask1[..., radius:] & mask2[..., :-radius]
+        d6 = data.copy() 
+        d6[..., radius:-radius] = numpy.where(mask, data[..., :-r2], data[..., radius:-radius]) #where both are true replace the value with the value from 2 points before
         return d6
 
 class Task(DeviceTask):
+    
+    notifiesDone = True
+    ## configure() runs after the DAQGeneric tasks that use this DAQ (see
+    ## DAQGenericTask.getConfigOrder) and touches only this task's SuperTask
+    parallelConfigure = True
+    
+    ## Extra time (seconds) allowed beyond the expected task duration before
+    ## the waiter thread gives up (see start())
+    waitMargin = 10.0
+    
     def __init__(self, dev, cmd, parentTask):
         DeviceTask.__init__(self, dev, cmd, parentTask)
         self.cmd = cmd
+        self._stopped = False
         
         ## get DAQ device
         #daq = self.devm.getDevice(...)
@@ -297,7 +352,30 @@ class Task(DeviceTask):
         
     def start(self):
         if self.st.hasTasks():
+            self._stopped = False
             self.st.start()
+            ## Let the driver block until the hardware is finished, then wake the parent task.
+            ## The wait is bounded so that a task that never finishes (eg. the trigger never 
+            ## arrives) does not leave the thread running forever; the parent task keeps 
+            ## polling isDone() in that case.
+            duration = self.cmd['numPts'] / float(self.cmd['rate'])
+            timeout = duration + max(duration, self.waitMargin)
+            waiter = threading.Thread(target=self._waitForDone, args=(timeout,), name="NiDAQ task waiter")
+            waiter.daemon = True
+            waiter.start()
+            
+    def _waitForDone(self, timeout):
+        try:
+            if not self.st.wait(timeout) and not self._stopped:
+                print("NiDAQ task did not finish within %0.1f seconds." % timeout)
+                return
+        except NIDAQError:
+            ## stopping the task early interrupts the wait; that is not an error.
+            if not self._stopped:
+                printExc("Error waiting for NiDAQ task to finish:")
+            return
+        if not self._stopped:
+            self.notifyDone()
         
     def isDone(self):
         if self.st.hasTasks():
@@ -308,6 +386,8 @@ class Task(DeviceTask):
         
     def stop(self, wait=False, abort=False):
         if self.st.hasTasks():
+            ## tell the waiter thread that the parent task no longer needs to hear from it
+            self._stopped = True
             #print "stopping ST..."
             self.st.stop(wait=wait, abort=abort)
             #print "   ST stopped"
@@ -328,10 +408,30 @@ class Task(DeviceTask):
         """
         #prof = Profiler("    NiDAQ.getData")
         res = self.st.getResult(channel)
-        data = res['data']
+        chInfo = self.st.channelInfo[channel]
+        data, info = self.getProcessedData(chInfo['task'])
+        res['data'] = data[chInfo['index']]
+        res['info'].update(info)
+        res['info']['numPts'] = res['data'].shape[0]
+        return res
+        
+    def getProcessedData(self, key):
+        """Return the filtered / downsampled / denoised data for all channels
+        of one of the SuperTask's tasks (an array with one row per channel),
+        and a dict of info describing the processing.
+        
+        Processing is done once per task, for all of its channels together.
+        """
+        if not hasattr(self, '_processed'):
+            self._processed = {}
+        if key not in self._processed:
+            data = self.st.getResult()[key]['data']
+            self._processed[key] = self.processData(data, key[1], self.st.rate)
+        return self._processed[key]
+        
+    def processData(self, data, typ, rate):
+        info = OrderedDict()
         
-            
-            
         if 'downsample' in self.cmd:
             ds = self.cmd['downsample']
         else:
@@ -340,8 +440,6 @@ class Task(DeviceTask):
         if 'filterMethod' in self.cmd:
             method = self.cmd['filterMethod']
             
-            fScale = 0.5 * res['info']['rate'] / ds
-            
             if method == 'None':
                 pass
             #elif method == 'gaussian':
@@ -349,18 +447,18 @@ class Task(DeviceTask):
                 
                 #data = scipy.ndimage.gaussian_filter(data, width)
                 
-                #res['info']['filterMethod'] = method
-                #res['info']['filterWidth'] = width
+                #info['filterMethod'] = method
+                #info['filterWidth'] = width
             elif method == 'Bessel':
                 cutoff = self.cmd['besselCutoff']
                 order = self.cmd['besselOrder']
                 bidir = self.cmd.get('besselBidirectional', True)
-                data = NiDAQ.lowpass(data, filter='bessel', bidir=bidir, cutoff=cutoff, order=order, samplerate=res['info']['rate'])
+                data = NiDAQ.lowpass(data, filter='bessel', bidir=bidir, cutoff=cutoff, order=order, samplerate=rate)
                 
-                res['info']['filterMethod'] = method
-                res['info']['filterCutoff'] = cutoff
-                res['info']['filterOrder'] = order
-                res['info']['filterBidirectional'] = bidir
+                info['filterMethod'] = method
+                info['filterCutoff'] = cutoff
+                info['filterOrder'] = order
+                info['filterBidirectional'] = bidir
             elif method == 'Butterworth':
                 passF = self.cmd['butterworthPassband']
                 stopF = self.cmd['butterworthStopband']
@@ -368,14 +466,14 @@ class Task(DeviceTask):
                 stopDB = self.cmd['butterworthStopDB']
                 bidir = self.cmd.get('butterworthBidirectional', True)
                 
-                data = NiDAQ.lowpass(data, filter='butterworth', bidir=bidir, cutoff=passF, stopCutoff=stopF, gpass=passDB, gstop=stopDB, samplerate=res['info']['rate'])
+                data = NiDAQ.lowpass(data, filter='butterworth', bidir=bidir, cutoff=passF, stopCutoff=stopF, gpass=passDB, gstop=stopDB, samplerate=rate)
                 
-                res['info']['filterMethod'] = method
-                res['info']['filterPassband'] = passF
-                res['info']['filterStopband'] = stopF
-                res['info']['filterPassbandDB'] = passDB
-                res['info']['filterStopbandDB'] = stopDB
-                res['info']['filterBidirectional'] = bidir
+                info['filterMethod'] = method
+                info['filterPassband'] = passF
+                info['filterStopband'] = stopF
+                info['filterPassbandDB'] = passDB
+                info['filterStopbandDB'] = stopDB
+                info['filterBidirectional'] = bidir
                 
             else:
                 printExc("Unknown filter method '%s'" % str(method))
@@ -383,20 +481,19 @@ class Task(DeviceTask):
         
         if ds > 1:
         
-            if res['info']['type'] in ['di', 'do']:
-                res['data'] = (res['data'] > 0).astype(numpy.byte)
+            if typ in ['di', 'do']:
                 dsMethod = 'subsample'
-                data = data[::ds]
-                res['info']['downsampling'] = ds
-                res['info']['downsampleMethod'] = 'subsample'
-                res['info']['rate'] = res['info']['rate'] / ds
-            elif res['info']['type'] in ['ai', 'ao']:
-                data = NiDAQ.meanResample(data, ds)
-                res['info']['downsampling'] = ds
-                res['info']['downsampleMethod'] = 'mean'
-                res['info']['rate'] = res['info']['rate'] / ds
+            elif typ in ['ai', 'ao']:
+                ## 'mean' (default) or 'polyphase'
+                dsMethod = self.cmd.get('downsampleMethod', 'mean')
             else:
                 dsMethod = None
+            
+            if dsMethod is not None:
+                data = NiDAQ.downsample(data, ds, dsMethod)
+                info['downsampling'] = ds
+                info['downsampleMethod'] = dsMethod
+                info['rate'] = rate / ds
 
         if 'denoiseMethod' in self.cmd:
             method = self.cmd['denoiseMethod']
@@ -406,18 +503,14 @@ class Task(DeviceTask):
                 width = self.cmd['denoiseWidth']
                 thresh = self.cmd['denoiseThreshold']
                 
-                res['info']['denoiseMethod'] = method
-                res['info']['denoiseWidth'] = width
-                res['info']['denoiseThreshold'] = thresh
+                info['denoiseMethod'] = method
+                info['denoiseWidth'] = width
+                info['denoiseThreshold'] = thresh
                 data = NiDAQ.denoise(data, width, thresh)
             else:
                 printExc("Unknown denoise method '%s'" % str(method))
 
-                
-        res['data'] = data
-        res['info']['numPts'] = data.shape[0]
-                
-        return res
+        return data, info
         
     def devName(self):
         return self.dev.name()
@@ -136,7 +136,8 @@ class PVCam(Camera):
             frame = {}
             frame['time'] = self.lastFrameTime + (dt * (i+1))
             frame['id'] = self.frameId
-            frame['data'] = self.acqBuffer[fInd].copy()
+            frame['data'] = self.frameBuffer(self.acqBuffer.shape[1:], self.acqBuffer.dtype)
+            frame['data'][...] = self.acqBuffer[fInd]
             #print frame['data']
             frames.append(frame)
             self.frameId += 1
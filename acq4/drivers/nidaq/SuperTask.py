@@ -1,15 +1,36 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import six
-import time
+import time, threading
 from numpy import *
 import acq4.util.ptime as ptime  ## platform-independent precision timing
+import acq4.util.debug as debug
 from collections import OrderedDict
 from .base import NIDAQError
 
 
 class SuperTask:
-    """Class for creating and encapsulating multiple synchronous tasks. Holds and assembles arrays for writing to each task as well as per-channel meta data."""
+    """Class for creating and encapsulating multiple synchronous tasks. Holds and assembles arrays for writing to each task as well as per-channel meta data.
+    
+    By default, tasks acquire / generate a finite number of samples (see run()).
+    Tasks may also stream continuously::
+    
+        st.configureClocks(rate, nPts=bufferSize, continuous=True)
+        st.subscribe(callback)           # callback(chunk) is called from the streaming thread
+        st.startStream(chunkSize)
+        ...
+        st.getStreamData(chan, n)        # most recent n samples of an input channel
+        st.stop()
+    
+    While streaming, input is read in chunks of *chunkSize* samples into a ring
+    buffer of *bufferSize* samples per channel, and output waveforms are
+    written a few chunks ahead of the input. Waveforms set with setWaveform()
+    are repeated; setWaveformGenerator() may be used to generate output on the
+    fly instead.
+    """
+    
+    ## number of chunks written to output tasks ahead of the current input position
+    outputLead = 2
     
     def __init__(self, daq):
         self.daq = daq
@@ -20,6 +41,11 @@ class SuperTask:
         self.devs = daq.listDevices()
         self.triggerChannel = None
         self.result = None
+        self.continuous = False
+        self.subscribers = []
+        self.streamThread = None
+        self.streamBuffers = None
+        self.streamError = None
         
     def absChanName(self, chan):
         parts = chan.lstrip('/').split('/')
@@ -163,14 +189,21 @@ class SuperTask:
     def hasTasks(self):
         return len(self.tasks) > 0
         
-    def configureClocks(self, rate, nPts):
-        """Configure sample clock and triggering for all tasks"""
+    def configureClocks(self, rate, nPts, continuous=False):
+        """Configure sample clock and triggering for all tasks
+        
+        If *continuous* is True, the tasks acquire and generate samples until
+        they are stopped (see startStream()), and *nPts* is the size of the
+        buffer (per channel) that holds the most recent input samples.
+        """
         clkSource = None
         if len(self.tasks) == 0:
             raise Exception("No tasks to configure.")
         keys = list(self.tasks.keys())
         self.numPts = nPts
         self.rate = rate
+        self.continuous = continuous
+        sampleMode = self.daq.Val_ContSamps if continuous else self.daq.Val_FiniteSamps
         
         ## Make sure we're only using 1 DAQ device (not sure how to tie 2 together yet)
         ndevs = len(set([k[0] for k in keys]))
@@ -215,10 +248,14 @@ class SuperTask:
             if k[1] != clkSource:
                 #print "%s CfgSampClkTiming(%s, %f, Val_Rising, Val_FiniteSamps, %d)" % (str(k), clk, rate, nPts)
 
-                self.tasks[k].CfgSampClkTiming(clk, rate, self.daq.Val_Rising, self.daq.Val_FiniteSamps, nPts)
+                self.tasks[k].CfgSampClkTiming(clk, rate, self.daq.Val_Rising, sampleMode, nPts)
             else:
                 #print "%s CfgSampClkTiming('', %f, Val_Rising, Val_FiniteSamps, %d)" % (str(k), rate, nPts)
-                self.tasks[k].CfgSampClkTiming("", rate, self.daq.Val_Rising, self.daq.Val_FiniteSamps, nPts)
+                self.tasks[k].CfgSampClkTiming("", rate, self.daq.Val_Rising, sampleMode, nPts)
+            
+            if continuous and self.tasks[k].isOutputTask():
+                ## output is written on the fly; the driver must not repeat old samples
+                self.tasks[k].SetWriteRegenMode(self.daq.Val_DoNotAllowRegen)
 
         
     def setTrigger(self, trig):
@@ -267,11 +304,25 @@ class SuperTask:
             
             
     def isDone(self):
+        if self.isStreaming():
+            return False
         for t in self.tasks:
             if not self.tasks[t].isDone():
                 #print "Task", t, "not done yet.."
                 return False
         return True
+    
+    def wait(self, timeout=None):
+        """Block until all tasks are done, without polling.
+        
+        Return False if *timeout* seconds elapsed before all tasks completed.
+        """
+        stop = None if timeout is None else ptime.time() + timeout
+        for t in self.tasks:
+            remaining = None if stop is None else maximum(0, stop - ptime.time())
+            if not self.tasks[t].waitUntilDone(remaining):
+                return False
+        return True
         
     def read(self):
         data = {}
@@ -285,12 +336,12 @@ class SuperTask:
         #print "ST stopping, wait=",wait, " abort:", abort
         ## need to be very careful about stopping and unreserving all hardware, even if there is a failure at some point.
         try:
-            if wait:
-                while not self.isDone():
-                    #print "Sleeping..", time.time()
-                    time.sleep(10e-6)
+            if self.streamThread is not None:
+                self._stopStream()
+            elif wait:
+                self.wait()
                     
-            if not abort and self.isDone():
+            if not abort and not self.continuous and self.isDone():
                 # data must be read before stopping the task,
                 # but should only be read if we know the task is complete.
                 self.getResult()
@@ -306,6 +357,142 @@ class SuperTask:
                     self.tasks[t].TaskControl(self.daq.Val_Task_Unreserve)
         #print "ST stop complete."
 
+    def setWaveformGenerator(self, chan, generator):
+        """Set a function that generates output for *chan* while streaming.
+        
+        *generator(start, n)* must return an array of *n* samples beginning at
+        sample index *start* (counted from the start of the stream).
+        """
+        chan = self.absChanName(chan)
+        if chan not in self.channelInfo:
+            raise Exception('Must create channel (%s) before setting waveform.' % chan)
+        self.channelInfo[chan]['generator'] = generator
+        
+    def subscribe(self, callback):
+        """Register *callback* to receive chunks of streamed input.
+        
+        The callback is invoked from the streaming thread as callback(chunk),
+        where chunk is a dict with keys 'start' (index of the first sample),
+        'startTime', 'numPts', and 'data' (a dict of {channel: array}).
+        Callbacks should return quickly; slow callbacks delay reading and
+        writing the next chunk.
+        """
+        self.subscribers.append(callback)
+        
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+        
+    def isStreaming(self):
+        return self.streamThread is not None and self.streamThread.is_alive()
+        
+    def startStream(self, chunkSize):
+        """Start continuous acquisition / generation (see configureClocks()).
+        
+        Input is read and delivered to subscribers in chunks of *chunkSize* samples.
+        """
+        if not self.continuous:
+            raise Exception("Clocks must be configured with continuous=True before streaming.")
+        if chunkSize > self.numPts:
+            raise ValueError("Chunk size (%d) may not exceed the buffer size (%d)." % (chunkSize, self.numPts))
+        ## output is written up to outputLead chunks ahead of the chunk being read
+        hasOutput = any([task.isOutputTask() for task in self.tasks.values()])
+        if hasOutput and (self.outputLead + 1) * chunkSize > self.numPts:
+            raise ValueError("Buffer size (%d) must be at least %d times the chunk size (%d) when streaming output." % 
+                             (self.numPts, self.outputLead + 1, chunkSize))
+        self.chunkSize = chunkSize
+        self.streamError = None
+        self._stopRequested = False
+        self.streamBuffers = OrderedDict()
+        for k, task in self.tasks.items():
+            if task.isInputTask():
+                self.streamBuffers[k] = RingBuffer(len(self.taskInfo[k]['chans']), self.numPts)
+        
+        ## pre-fill output buffers before the clock starts
+        self.writePos = 0
+        self._writeStream(self.outputLead * chunkSize)
+        for k in self.tasks:
+            self.taskInfo[k]['dataWritten'] = True
+        
+        self.start()
+        self.streamThread = threading.Thread(target=self._streamLoop, name="SuperTask stream")
+        self.streamThread.daemon = True
+        self.streamThread.start()
+        
+    def getStreamData(self, chan, n=None):
+        """Return the most recent *n* samples (default: all buffered samples)
+        acquired from input channel *chan* while streaming.
+        """
+        chan = self.absChanName(chan)
+        info = self.channelInfo[chan]
+        return self.streamBuffers[info['task']].read(n)[info['index']]
+        
+    def _stopStream(self):
+        self._stopRequested = True
+        self.streamThread.join()
+        self.streamThread = None
+        
+    def _streamLoop(self):
+        chunk = self.chunkSize
+        readPos = 0
+        inputKeys = list(self.streamBuffers.keys())
+        try:
+            while not self._stopRequested:
+                self._writeStream(readPos + (self.outputLead+1) * chunk - self.writePos)
+                
+                if len(inputKeys) == 0:
+                    ## output only; pace output by the clock
+                    wait = self.startTime + (readPos + chunk) / float(self.rate) - ptime.time()
+                    if wait > 0:
+                        time.sleep(wait)
+                    readPos += chunk
+                    continue
+                
+                data = OrderedDict()
+                for k in inputKeys:
+                    buf, nPts = self.tasks[k].read(chunk, fromStart=False)
+                    self.streamBuffers[k].write(buf)
+                    for i, ch in enumerate(self.taskInfo[k]['chans']):
+                        data[ch] = buf[i]
+                
+                chunkInfo = {
+                    'start': readPos,
+                    'startTime': self.startTime + readPos / float(self.rate),
+                    'numPts': chunk,
+                    'data': data,
+                }
+                readPos += chunk
+                for sub in self.subscribers[:]:
+                    try:
+                        sub(chunkInfo)
+                    except Exception:
+                        debug.printExc("Error in DAQ stream subscriber:")
+        except Exception as exc:
+            if not self._stopRequested:
+                self.streamError = exc
+                debug.printExc("Error while streaming DAQ data:")
+        
+    def _writeStream(self, n):
+        ## generate and write the next *n* samples for all output tasks
+        if n <= 0:
+            return
+        for k, task in self.tasks.items():
+            if not task.isOutputTask():
+                continue
+            chans = self.taskInfo[k]['chans']
+            waves = [self._generate(ch, self.writePos, n) for ch in chans]
+            task.write(ascontiguousarray(waves, dtype=waves[0].dtype))
+        self.writePos += n
+        
+    def _generate(self, chan, start, n):
+        info = self.channelInfo[chan]
+        if 'generator' in info:
+            return asarray(info['generator'](start, n))
+        if 'data' not in info:
+            raise Exception("No data specified for DAQ channel %s" % chan)
+        ## repeat the waveform
+        wave = asarray(info['data'])
+        return wave.take(arange(start, start+n) % len(wave))
+        
     def getResult(self, channel=None):
         #print "getresult"
         if self.result is None:
@@ -355,8 +542,47 @@ class SuperTask:
         self.start()
         #print "wait/stop..", time.time()
         #self.stop(wait=True)
-        while not self.isDone():
-            time.sleep(10e-6)
+        self.wait()
         #print "get samples.."
         r = self.getResult()
         return r
+
+
+class RingBuffer(object):
+    """Fixed-size buffer holding the most recent samples of a multichannel stream.
+    """
+    def __init__(self, nChannels, size, dtype=float64):
+        self.data = None
+        self.nChannels = nChannels
+        self.size = size
+        self.dtype = dtype
+        self.count = 0  ## total number of samples written
+        self.lock = threading.Lock()
+        
+    def write(self, data):
+        """Append an array of shape (nChannels, n) to the buffer."""
+        with self.lock:
+            if self.data is None:
+                self.data = empty((self.nChannels, self.size), dtype=data.dtype)
+            n = data.shape[1]
+            if n >= self.size:
+                data = data[:, -self.size:]
+                self.count += n - self.size
+                n = self.size
+            i = self.count % self.size
+            first = n if n < self.size - i else self.size - i
+            self.data[:, i:i+first] = data[:, :first]
+            self.data[:, :n-first] = data[:, first:]
+            self.count += n
+        
+    def read(self, n=None):
+        """Return a copy of the most recent *n* samples (or all buffered samples)."""
+        with self.lock:
+            avail = self.count if self.count < self.size else self.size
+            if n is None or n > avail:
+                n = avail
+            if self.data is None:
+                return empty((self.nChannels, 0), dtype=self.dtype)
+            end = self.count % self.size
+            ind = arange(end - n, end) % self.size
+            return self.data.take(ind, axis=1)
@@ -155,16 +155,36 @@ class MockNIDAQ:
             return
         now = time.time()
         start, dur = self.clocks[clock]
+        if dur == np.inf:
+            ## continuous task; stops immediately
+            del self.clocks[clock]
+            return
         diff = (start+dur)-now
         if diff > 0:
             time.sleep(diff)
 
+    def clockStartTime(self, clock):
+        return self.clocks[clock][0]
+
     def checkClock(self, clock):
+        if clock not in self.clocks:
+            return True
         now = time.time()
         start, dur = self.clocks[clock]
         diff = (start+dur)-now
         return diff <= 0
 
+    def waitClock(self, clock, timeout=None):
+        """Sleep until *clock* has finished; return False if *timeout* elapsed first."""
+        start, dur = self.clocks[clock]
+        diff = (start+dur) - time.time()
+        if timeout is not None and diff > timeout:
+            time.sleep(timeout)
+            return False
+        if diff > 0:
+            time.sleep(diff)
+        return True
+
 
 class Task:
     def __init__(self, nd):
@@ -175,6 +195,8 @@ class Task:
         self.nativeClock = None
         self.data = None
         self.mode = None
+        self.continuous = False
+        self.readPos = 0
         
     #def __getattr__(self, attr):
         #return lambda *args: self
@@ -210,6 +232,7 @@ class Task:
         self.clock = clock 
         self.rate = rate 
         self.nPts = nPts
+        self.continuous = (c == self.nd.lib.Val_ContSamps)
         #print self.chans, self.clock
         
     def GetSampClkMaxRate(self):
@@ -218,8 +241,14 @@ class Task:
     def device(self):
         return '/'+self.chans[0].split('/')[1]
         
+    def SetWriteRegenMode(self, mode):
+        pass
+
     def write(self, data):
         self.data = data
+        if self.continuous:
+            ## streaming output is discarded
+            return data.shape[-1]
         
         ## Send data off to callbacks if they were specified
         #print "write:", self.chOpts
@@ -229,7 +258,10 @@ class Task:
         
         return len(data)
         
-    def read(self):
+    def read(self, samples=None, timeout=10., dtype=None, fromStart=True):
+        if self.continuous:
+            return self.readStream(samples, timeout)
+
         dur = self.nPts / self.rate
         tVals = np.linspace(0, dur, self.nPts)
         if 'd' in self.mode:
@@ -244,10 +276,43 @@ class Task:
                 data[i] = 0
         return (data, self.nPts)
 
+    def readStream(self, samples, timeout):
+        """Return the next *samples* samples of synthetic data for a continuous
+        task, waiting until they would have been acquired.
+        
+        Analog channels return a sine wave (1 Hz for the first channel, 2 Hz for the
+        second, ...) plus noise; digital channels return a square wave.
+        """
+        clock = self.nativeClock if self.clock is None else self.clock
+        end = self.nd.clockStartTime(clock) + (self.readPos + samples) / float(self.rate)
+        wait = end - time.time()
+        if wait > timeout:
+            raise Exception("Timed out waiting for %d samples" % samples)
+        if wait > 0:
+            time.sleep(wait)
+
+        t = (self.readPos + np.arange(samples)) / float(self.rate)
+        if 'd' in self.mode:
+            data = np.empty((len(self.chans), samples), dtype=np.uint32)
+        else:
+            data = np.empty((len(self.chans), samples))
+        for i in range(len(self.chans)):
+            phase = 2 * np.pi * (i+1) * t
+            if 'd' in self.mode:
+                data[i] = np.sin(phase) > 0
+            else:
+                data[i] = np.sin(phase) + np.random.normal(scale=0.05, size=samples)
+        self.readPos += samples
+        return (data, samples)
+
     def start(self):
+        self.readPos = 0
         ## only start clock if it matches the native clock for this channel
         if self.clock is None or self.clock == self.nativeClock:
-            dur = self.nPts / self.rate
+            if self.continuous:
+                dur = np.inf
+            else:
+                dur = self.nPts / self.rate
             self.nd.startClock(self.nativeClock, dur)
         
         
@@ -262,6 +327,12 @@ class Task:
             return self.nd.checkClock(self.nativeClock)
         else:
             return self.nd.checkClock(self.clock)
+
+    def waitUntilDone(self, timeout=None):
+        if self.clock is None:
+            return self.nd.waitClock(self.nativeClock, timeout)
+        else:
+            return self.nd.waitClock(self.clock, timeout)
         
 
     def GetTaskNumChans(self):
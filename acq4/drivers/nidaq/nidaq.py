@@ -271,7 +271,25 @@ class Task:
     def isDone(self):
         return self.IsTaskDone()
 
-    def read(self, samples=None, timeout=10., dtype=None):
+    def waitUntilDone(self, timeout=None):
+        """Block until the task is done. Return False if *timeout* seconds elapsed first."""
+        if timeout is None:
+            timeout = self.nidaq.Val_WaitInfinitely
+        try:
+            self.WaitUntilTaskDone(timeout)
+        except NIDAQError as exc:
+            if exc.errCode == -200560:  # wait completed before the task finished
+                return False
+            raise
+        return True
+
+    def read(self, samples=None, timeout=10., dtype=None, fromStart=True):
+        """Read samples from an input task and return (data, samplesRead).
+        
+        By default, reading begins at the first sample acquired by the task. If
+        *fromStart* is False, reading continues from the end of the previous
+        read (used for continuous acquisition).
+        """
         #reqSamps = samples
         #if samples is None:
         #    samples = self.GetSampQuantSampPerChan()
@@ -319,7 +337,10 @@ class Task:
             
         fName += dtypes[np.dtype(dtype).descr[0][1]]
         
-        self.SetReadRelativeTo(LIB.Val_FirstSample)
+        if fromStart:
+            self.SetReadRelativeTo(LIB.Val_FirstSample)
+        else:
+            self.SetReadRelativeTo(LIB.Val_CurrReadPos)
         self.SetReadOffset(0)
         
         ## buf.ctypes is a c_void_p, but the function requires a specific pointer type so we are forced to recast the pointer:
@@ -0,0 +1,67 @@
+from __future__ import print_function
+import time
+import pytest
+import numpy as np
+from acq4.drivers.nidaq.SuperTask import RingBuffer
+
+
+def test_ring_buffer():
+    buf = RingBuffer(2, 10)
+    assert buf.read().shape == (2, 0)
+
+    data = np.arange(14).reshape(2, 7)
+    buf.write(data)
+    assert np.all(buf.read() == data)
+    assert np.all(buf.read(3) == data[:, -3:])
+
+    # wrap around the end of the buffer
+    buf.write(data + 100)
+    out = buf.read()
+    assert out.shape == (2, 10)
+    assert np.all(out[:, -7:] == data + 100)
+    assert np.all(out[:, :3] == data[:, -3:])
+
+    # write more than the buffer size at once
+    big = np.arange(50).reshape(2, 25)
+    buf.write(big)
+    assert np.all(buf.read() == big[:, -10:])
+    assert buf.count == 39
+
+
+def test_mock_stream():
+    from acq4.drivers.nidaq.mock import NIDAQ
+    st = NIDAQ.createSuperTask()
+    st.addChannel('/Dev1/ai0', 'ai')
+    st.addChannel('/Dev1/ao0', 'ao')
+    st.setWaveform('/Dev1/ao0', np.zeros(100))
+    st.configureClocks(rate=10000, nPts=2000, continuous=True)
+
+    chunks = []
+    st.subscribe(chunks.append)
+    st.startStream(500)
+    try:
+        time.sleep(0.3)
+        assert st.isStreaming()
+        assert not st.isDone()
+    finally:
+        st.stop()
+    assert not st.isStreaming()
+    assert st.streamError is None
+
+    assert len(chunks) >= 3
+    assert [c['start'] for c in chunks] == list(range(0, 500 * len(chunks), 500))
+    assert chunks[0]['data']['/Dev1/ai0'].shape == (500,)
+    assert st.getStreamData('/Dev1/ai0').shape == (min(2000, 500 * len(chunks)),)
+
+
+def test_stream_buffer_size():
+    from acq4.drivers.nidaq.mock import NIDAQ
+    st = NIDAQ.createSuperTask()
+    st.addChannel('/Dev1/ai0', 'ai')
+    st.addChannel('/Dev1/ao0', 'ao')
+    st.setWaveform('/Dev1/ao0', np.zeros(100))
+    st.configureClocks(rate=10000, nPts=1000, continuous=True)
+    ## output is written (outputLead+1) chunks ahead; the buffer must hold them
+    with pytest.raises(ValueError):
+        st.startStream(500)
+    assert not st.isStreaming()
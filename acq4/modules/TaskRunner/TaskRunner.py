@@ -650,6 +650,7 @@ class TaskRunner(Module):
         #prof.mark('protocol state')
         store = (dh is not None)
         prot['protocol']['storeData'] = store
+        prot['protocol']['storeAsync'] = store  ## write results in the background while the next run starts
         if store:
             if params != {}:
                 name = '_'.join(['%03d'%i for i in list(params.values())])
@@ -918,6 +919,99 @@ class Task:
             
         
         
+class SequencePlan(object):
+    """Flattened list of (params, cmd) pairs, one for each run of a task sequence,
+    in the order they will be executed.
+    
+    *task* is either a single command structure (if *paramSpace* is None) or 
+    the MetaArray of command structures generated by TaskRunner.runSequence(). 
+    Selecting each command from the MetaArray and iterating over the parameter 
+    space is done once here, so that TaskThread does not repeat this work 
+    between runs.
+    """
+    def __init__(self, task, paramSpace=None):
+        self.points = []
+        if paramSpace is None:
+            self.points.append(({}, task))
+        else:
+            self._task = task
+            try:
+                runSequence(self._addPoint, paramSpace, list(paramSpace.keys()), dtype=object)
+            finally:
+                self._task = None
+        
+    def _addPoint(self, params):
+        self.points.append((params, self.selectCommand(self._task, params)))
+        
+    @staticmethod
+    def selectCommand(task, params):
+        """Return the command in *task* for a single point in the parameter space."""
+        cmd = task
+        for p in params:
+            cmd = cmd[p: params[p]]
+        return cmd
+        
+    def __len__(self):
+        return len(self.points)
+    
+    def __iter__(self):
+        return iter(self.points)
+
+
+class SweepScheduler(object):
+    """Plans the start time of each run in a task sequence.
+    
+    Runs are planned *cycleTime* apart on a monotonic clock, and wait() sleeps 
+    until the planned time. Because each start is planned from the previous 
+    planned start rather than from the time the previous run actually began, 
+    setup and storage costs do not accumulate as drift. A run that starts more 
+    than *lateTolerance* seconds late re-anchors the plan, so the following 
+    runs are not started back-to-back in order to catch up.
+    
+    The planned time is when the devices should start. wait() returns 
+    *leadTime* seconds earlier, leaving time to create and configure the task.
+    """
+    ## The final part of each wait is spent polling the clock because 
+    ## time.sleep() may overshoot by about a millisecond.
+    spinTime = 2e-3
+    lateTolerance = 10e-3
+    
+    def __init__(self):
+        self.restart()
+        
+    def restart(self):
+        """Start the next run immediately and plan the following runs from there."""
+        self.plannedStart = None
+        
+    def wait(self, cycleTime, checkAbort=None, leadTime=0):
+        """Sleep until *leadTime* seconds before the next run is planned to start. 
+        
+        Return the planned start time (in ptime.time() units), or None if 
+        *checkAbort*() returned True while waiting.
+        """
+        if self.plannedStart is None:
+            planned = ptime.monotonic() + leadTime
+        else:
+            planned = self.plannedStart + cycleTime
+        wake = planned - leadTime
+            
+        while True:
+            if checkAbort is not None and checkAbort():
+                return None
+            remaining = wake - ptime.monotonic()
+            if remaining <= 0:
+                break
+            if remaining > self.spinTime:
+                ## sleep in short intervals so that abort requests are handled promptly
+                time.sleep(min(remaining - self.spinTime, 20e-3))
+        
+        now = ptime.monotonic()
+        if now - wake > self.lateTolerance:
+            planned = now + leadTime
+        self.plannedStart = planned
+        return ptime.time() + (planned - now)
+    
+
 class TaskThread(Thread):
     
     sigPaused = Qt.Signal()
@@ -935,6 +1029,8 @@ class TaskThread(Thread):
         self.paused = False
         self._currentTask = None
         self._systrace = None
+        self.scheduler = SweepScheduler()
+        self._setupTime = 0  # time from waking until the devices started, measured on the previous run
                 
     def startTask(self, task, paramSpace=None):
         with self.lock:
@@ -943,7 +1039,7 @@ class TaskThread(Thread):
                 raise Exception("Already running another task")
             self.task = task
             self.paramSpace = paramSpace
-            self.lastRunTime = None
+            self.scheduler.restart()
             self.start() ### causes self.run() to be called from new thread
             logMsg("Task started.", importance=1)
     
@@ -961,46 +1057,49 @@ class TaskThread(Thread):
                 self.stopThread = False
                 self.abortThread = False
             
-            if self.paramSpace is None:
+            ## Select the command for every run up front rather than between runs
+            plan = SequencePlan(self.task, self.paramSpace)
+            
+            # good time to collect garbage
+            gc.collect()
+            
+            for params, cmd in plan:
                 try:
-                    self.runOnce()
+                    self.runOnce(params, cmd)
                 except Exception as e:
-                    if e.args[0] != 'stop':
-                        raise
-            else:
-                runSequence(self.runOnce, self.paramSpace, list(self.paramSpace.keys()))
+                    if len(e.args) > 0 and e.args[0] == 'stop':
+                        break
+                    raise
             
         except:
             self.task = None  ## free up this memory
             self.paramSpace = None
             printExc("Error in task thread, exiting.")
             self.sigExitFromError.emit()
+        finally:
+            ## don't report the task as finished until all of its results are on disk
+            try:
+                self.dm.storageQueue.flush()
+            except:
+                printExc("Error storing task results:")
+                self.sigExitFromError.emit()
                     
-    def runOnce(self, params=None):
-        # good time to collect garbage
-        gc.collect()
+    def runOnce(self, params=None, cmd=None):
+        """Execute a single run of the task. 
         
+        *cmd* is the command to execute for *params*, usually taken from a 
+        SequencePlan. If it is None, then it is selected from self.task.
+        """
         prof = Profiler("TaskRunner.TaskThread.runOnce", disabled=True, delayed=False)
         startTime = ptime.time()
         if params is None:
             params = {}
         
         ## Select correct command to execute
-        cmd = self.task
-        if params is not None:
-            for p in params:
-                cmd = cmd[p: params[p]]
+        if cmd is None:
+            cmd = SequencePlan.selectCommand(self.task, params)
         prof.mark('select command')        
                 
-        ## Wait before starting if we've already run too recently
-        while (self.lastRunTime is not None) and (ptime.time() < self.lastRunTime + cmd['protocol']['cycleTime']):
-            with self.lock:
-                if self.abortThread or self.stopThread:
-                    #print "Task run aborted by user"
-                    return
-            time.sleep(1e-3)
-        prof.mark('sleep')
-        
         emitSig = True
         while True:
             with self.lock:
@@ -1013,6 +1112,9 @@ class TaskThread(Thread):
                 emitSig = False
                 self.sigPaused.emit()
             time.sleep(10e-3)
+        if not emitSig:
+            ## we were paused; start as soon as possible and plan the following runs from there
+            self.scheduler.restart()
         
         prof.mark('pause')
         
@@ -1024,17 +1126,29 @@ class TaskThread(Thread):
             print("===========================")
             raise Exception("TaskRunner.runOnce failed to generate a proper command structure. Object type was '%s', should have been 'dict'." % type(cmd))
         
+        ## Wait until the task must be created so that its devices start at the 
+        ## planned time. (Devices record their state when the task is created, 
+        ## so it is not created any earlier than needed.)
+        plannedStart = self.scheduler.wait(cmd['protocol']['cycleTime'], self.checkAbort, leadTime=self._setupTime)
+        if plannedStart is None:
+            #print "Task run aborted by user"
+            return
+        wakeTime = ptime.time()
+        prof.mark('sleep')
+        
         task = self.dm.createTask(cmd)
         prof.mark('create task')
         
-        self.lastRunTime = ptime.time()
-        
         try:
             with self.lock:
                 self._currentTask = task
             task.execute(block=False)
-            # record estimated end time
-            endTime = time.time() + cmd['protocol']['duration']
+            ## planned and actual start times are stored with the results
+            task.protocolInfo['plannedStartTime'] = plannedStart
+            task.protocolInfo['startLatency'] = task.startTime - plannedStart
+            ## lead time for the next run: the measured setup time, but at least 
+            ## the devices' own estimate of their preparation time
+            self._setupTime = max(task.startTime - wakeTime, task.getPrepTimeEstimate())
             self.sigTaskStarted.emit(params)
             prof.mark('execute')
         except:
@@ -1063,9 +1177,8 @@ class TaskThread(Thread):
                         # NO -- task.stop() is not thread-safe.
                         task.stop(abort=True)
                         return
-                # adjust sleep time based on estimated time remaining in the task.
-                sleep = np.clip((endTime - time.time()) * 0.5, 1e-3, 20e-3)
-                time.sleep(sleep)
+                # sleep until the task signals completion, waking periodically to check for abort requests
+                task.waitForCompletion(maxWait=20e-3)
                 
             result = task.getResult()
         except:
@@ -1091,6 +1204,10 @@ class TaskThread(Thread):
         prof.mark('yield')
         prof.finish()
         
+    def checkAbort(self):
+        with self.lock:
+            return self.abortThread or self.stopThread
+        
     def checkStop(self):
         with self.lock:
             if self.stopThread:
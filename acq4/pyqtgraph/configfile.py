@@ -9,7 +9,7 @@ file format. Data structures may be nested and contain any data type as long
 as it can be converted to/from a string using repr and eval.
 """
 
-import re, os, sys, datetime
+import re, os, sys, datetime, ast
 import numpy
 from .pgcollections import OrderedDict
 from . import units
@@ -101,7 +101,7 @@ def parseString(lines, start=0):
     data = OrderedDict()
     if isinstance(lines, basestring):
         lines = lines.split('\n')
-        lines = [l for l in lines if re.search(r'\S', l) and not re.match(r'\s*#', l)]  ## remove empty lines
+        lines = [l for l in lines if l.strip() != '' and not l.lstrip().startswith('#')]  ## remove empty lines
         
     indent = measureIndent(lines[start])
     ln = start - 1
@@ -116,11 +116,12 @@ def parseString(lines, start=0):
             l = lines[ln]
             
             ## Skip blank lines or lines starting with #
-            if re.match(r'\s*#', l) or not re.search(r'\S', l):
+            stripped = l.lstrip()
+            if stripped == '' or stripped[0] == '#':
                 continue
             
             ## Measure line indentation, make sure it is correct for this level
-            lineInd = measureIndent(l)
+            lineInd = len(l) - len(stripped)
             if lineInd < indent:
                 ln -= 1
                 break
@@ -136,34 +137,18 @@ def parseString(lines, start=0):
             k = k.strip()
             v = v.strip()
             
-            ## set up local variables to use for eval
-            local = units.allUnits.copy()
-            local['OrderedDict'] = OrderedDict
-            local['readConfigFile'] = readConfigFile
-            local['Point'] = Point
-            local['QtCore'] = QtCore
-            local['ColorMap'] = ColorMap
-            local['datetime'] = datetime
-            # Needed for reconstructing numpy arrays
-            local['array'] = numpy.array
-            for dtype in ['int8', 'uint8', 
-                          'int16', 'uint16', 'float16',
-                          'int32', 'uint32', 'float32',
-                          'int64', 'uint64', 'float64']:
-                local[dtype] = getattr(numpy, dtype)
-                
             if len(k) < 1:
                 raise ParseError('Missing name preceding colon', ln+1, l)
             if k[0] == '(' and k[-1] == ')':  ## If the key looks like a tuple, try evaluating it.
                 try:
-                    k1 = eval(k, local)
+                    k1 = evalValue(k)
                     if type(k1) is tuple:
                         k = k1
                 except:
                     pass
-            if re.search(r'\S', v) and v[0] != '#':  ## eval the value
+            if v != '' and v[0] != '#':  ## eval the value
                 try:
-                    val = eval(v, local)
+                    val = evalValue(v)
                 except:
                     ex = sys.exc_info()[1]
                     raise ParseError("Error evaluating expression '%s': [%s: %s]" % (v, ex.__class__.__name__, str(ex)), (ln+1), l)
@@ -183,6 +168,174 @@ def parseString(lines, start=0):
         raise ParseError("%s: %s" % (ex.__class__.__name__, str(ex)), ln+1, l)
     #print "Returning shallower..", ln+1
     return (ln, data)
+
+
+_EVAL_NAMESPACE = None
+
+def evalNamespace():
+    """Return the dict of names available to expressions in config files.
+    
+    This contains all unit names (mV, kHz, ...) plus the functions and types
+    needed to reconstruct the values written by genString. The dict is built
+    only once; callers must not modify it.
+    """
+    global _EVAL_NAMESPACE
+    if _EVAL_NAMESPACE is None:
+        local = units.allUnits.copy()
+        local['OrderedDict'] = OrderedDict
+        local['readConfigFile'] = readConfigFile
+        local['Point'] = Point
+        local['QtCore'] = QtCore
+        local['ColorMap'] = ColorMap
+        local['datetime'] = datetime
+        # Needed for reconstructing numpy arrays
+        local['array'] = numpy.array
+        for dtype in ['int8', 'uint8', 
+                      'int16', 'uint16', 'float16',
+                      'int32', 'uint32', 'float32',
+                      'int64', 'uint64', 'float64']:
+            local[dtype] = getattr(numpy, dtype)
+        _EVAL_NAMESPACE = local
+    return _EVAL_NAMESPACE
+
+
+class _NotLiteral(Exception):
+    """Raised when an expression cannot be handled by the literal parser."""
+
+
+def evalValue(v):
+    """Evaluate a single value string from a config file.
+    
+    Numbers, strings, unit expressions (eg. 10*mV), containers and array(...) 
+    calls are converted without using eval(). Anything else falls back to
+    eval() in the namespace given by evalNamespace().
+    """
+    c = v[0]
+    if c.isdigit() or (c in '-.' and len(v) > 1):
+        ## fast path for plain numbers, which make up most of a typical .index file
+        try:
+            return int(v)
+        except ValueError:
+            pass
+        try:
+            return float(v)
+        except ValueError:
+            pass
+    elif c in '\'"' and len(v) > 1 and v[-1] == c and '\\' not in v and c not in v[1:-1]:
+        ## fast path for simple quoted strings
+        return v[1:-1]
+    elif c in '[(':
+        ## fast path for flat lists / tuples of numbers
+        try:
+            return _parseNumberSequence(v)
+        except ValueError:
+            pass
+    
+    try:
+        return parseLiteral(v)
+    except _NotLiteral:
+        return eval(v, evalNamespace())
+
+
+def _parseNumberSequence(v):
+    """Parse strings like '[1, 2.5, -3]' or '(1, 2)'; raise ValueError for anything else."""
+    c = v[0]
+    if v[-1] != {'[': ']', '(': ')'}[c]:
+        raise ValueError(v)
+    inner = v[1:-1]
+    items = inner.split(',')
+    if items[-1].strip() == '':
+        items.pop()
+    elif c == '(' and len(items) == 1:
+        raise ValueError(v)  # "(1)" is not a tuple
+    vals = []
+    for item in items:
+        item = item.strip()
+        try:
+            vals.append(int(item))
+        except ValueError:
+            vals.append(float(item))
+    if c == '(':
+        return tuple(vals)
+    return vals
+
+
+def parseLiteral(v):
+    """Evaluate an expression string using a restricted, eval-free interpreter.
+    
+    Raises _NotLiteral if the expression uses anything other than literals, 
+    containers, arithmetic, names from evalNamespace() and calls to callables
+    from evalNamespace().
+    """
+    try:
+        node = ast.parse(v, mode='eval').body
+    except SyntaxError:
+        raise _NotLiteral(v)
+    return _evalNode(node, evalNamespace())
+
+
+_BINOPS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.Pow: lambda a, b: a ** b,
+}
+
+_CONSTANT_NODES = tuple(getattr(ast, n) for n in ('Constant', 'Num', 'Str', 'Bytes', 'NameConstant') 
+                        if hasattr(ast, n))
+
+def _evalNode(node, ns):
+    typ = type(node)
+    if typ in _CONSTANT_NODES:
+        if hasattr(node, 'value'):
+            return node.value
+        elif hasattr(node, 'n'):
+            return node.n
+        return node.s
+    elif typ is ast.Name:
+        name = node.id
+        if name in ns:
+            return ns[name]
+        elif name in ('True', 'False', 'None'):  # python 2
+            return {'True': True, 'False': False, 'None': None}[name]
+        raise _NotLiteral(name)
+    elif typ is ast.List:
+        return [_evalNode(n, ns) for n in node.elts]
+    elif typ is ast.Tuple:
+        return tuple([_evalNode(n, ns) for n in node.elts])
+    elif typ is ast.Set:
+        return set([_evalNode(n, ns) for n in node.elts])
+    elif typ is ast.Dict:
+        if None in node.keys:  # {**x}
+            raise _NotLiteral()
+        return dict([(_evalNode(k, ns), _evalNode(val, ns)) for k, val in zip(node.keys, node.values)])
+    elif typ is ast.UnaryOp:
+        operand = _evalNode(node.operand, ns)
+        if type(node.op) is ast.USub:
+            return -operand
+        elif type(node.op) is ast.UAdd:
+            return +operand
+        raise _NotLiteral()
+    elif typ is ast.BinOp:
+        op = _BINOPS.get(type(node.op))
+        if op is None:
+            raise _NotLiteral()
+        return op(_evalNode(node.left, ns), _evalNode(node.right, ns))
+    elif typ is ast.Call:
+        if type(node.func) is not ast.Name or node.func.id not in ns:
+            raise _NotLiteral()
+        if getattr(node, 'starargs', None) is not None or getattr(node, 'kwargs', None) is not None:
+            raise _NotLiteral()
+        args = [_evalNode(n, ns) for n in node.args]
+        kwds = {}
+        for kw in node.keywords:
+            if kw.arg is None:  # **kwargs
+                raise _NotLiteral()
+            kwds[kw.arg] = _evalNode(kw.value, ns)
+        return ns[node.func.id](*args, **kwds)
+    raise _NotLiteral()
+
     
 def measureIndent(s):
     n = 0
@@ -21,21 +21,28 @@ from ..python2_3 import basestring
 ## This can be overridden by setting USE_HDF5 = False
 USE_HDF5 = True
 try:
-    import h5py.highlevel
+    import h5py
     HAVE_HDF5 = True
 except:
     USE_HDF5 = False
     HAVE_HDF5 = False
 
 
-def axis(name=None, cols=None, values=None, units=None):
-    """Convenience function for generating axis descriptions when defining MetaArrays"""
+def axis(name=None, cols=None, values=None, units=None, start=None, rate=None):
+    """Convenience function for generating axis descriptions when defining MetaArrays
+
+    For regularly sampled axes, *start* and *rate* may be given instead of
+    *values*; the values are then computed only when they are requested.
+    """
     ax = {}
     cNameOrder = ['name', 'units', 'title']
     if name is not None:
         ax['name'] = name
     if values is not None:
         ax['values'] = values
+    elif rate is not None:
+        ax['start'] = 0.0 if start is None else start
+        ax['rate'] = rate
     if units is not None:
         ax['units'] = units
     if cols is not None:
@@ -101,6 +108,11 @@ class MetaArray(object):
             array['rainfall', 'lon':5, 'lat':10]
         Notice that in the second example, there is no need for an extra (4th) axis description
         since the actual values are described (name and units) in the column info for the first axis.
+
+    The values of a regularly sampled axis may be described by 'start' and
+    'rate' instead of a 'values' array, eg. {'name': 'Time', 'start': 0.0, 'rate': 10e3}.
+    axisValues() computes the values on request; infoCopy() and the file
+    writers store them as an ordinary 'values' array.
     """
   
     version = '2'
@@ -127,6 +139,7 @@ class MetaArray(object):
         object.__init__(self)
         #self._infoOwned = False
         self._isHDF = False
+        self._lazyValues = {}  ## axis values that are still stored in an open HDF5 file
         
         if file is not None:
             self._data = None
@@ -137,6 +150,7 @@ class MetaArray(object):
             self._info = info
             if (hasattr(data, 'implements') and data.implements('MetaArray')):
                 self._info = data._info
+                self._lazyValues = data._lazyValues.copy()
                 self._data = data.asarray()
             elif isinstance(data, tuple):  ## create empty array with specified shape
                 self._data = np.empty(data, dtype=dtype)
@@ -223,7 +237,10 @@ class MetaArray(object):
         nInd = self._interpretIndexes(ind)
         
         #a = np.ndarray.__getitem__(self, nInd)
-        a = self._data[nInd]
+        if isinstance(self._data, np.ndarray):
+            a = self._data[nInd]
+        else:
+            a = self._readSubset(nInd)
         if len(nInd) == self.ndim:
             if np.all([not isinstance(ind, slice) for ind in nInd]):  ## no slices; we have requested a single value from the array
                 return a
@@ -283,6 +300,59 @@ class MetaArray(object):
             #a._info.remove(None)
         return MetaArray(a, info=info)
   
+    def _readSubset(self, nInd):
+        """Read the part of an HDF5-backed array selected by nInd.
+        
+        h5py only supports simple selections, so boolean masks and index lists
+        are converted to slices where possible. Otherwise the smallest block
+        containing all selected elements is read and indexed in memory.
+        """
+        fileInd = []
+        memInd = []
+        for i, ind in enumerate(nInd):
+            n = self.shape[i]
+            if isinstance(ind, slice) and ind.step is not None and ind.step < 0:
+                ind = np.arange(*ind.indices(n))
+            elif isinstance(ind, np.ndarray) and ind.dtype == bool:
+                ind = np.nonzero(ind)[0]
+            
+            if isinstance(ind, (list, np.ndarray)):
+                ind = np.asarray(ind, dtype=int)
+                ind = np.where(ind < 0, ind + n, ind)
+                if len(ind) == 0:
+                    fileInd.append(slice(0, 0))
+                    memInd.append(slice(None))
+                elif np.all(np.diff(ind) == 1):
+                    fileInd.append(slice(ind[0], ind[-1] + 1))
+                    memInd.append(slice(None))
+                else:
+                    start = ind.min()
+                    fileInd.append(slice(start, ind.max() + 1))
+                    memInd.append(ind - start)
+            else:
+                fileInd.append(ind)
+                if isinstance(ind, slice):
+                    memInd.append(slice(None))
+        
+        a = self._data[tuple(fileInd)]
+        if any([not isinstance(ind, slice) for ind in memInd]):
+            a = a[tuple(memInd)]
+        return a
+
+    def close(self):
+        """Close the HDF5 file backing this array, if any. Axis values that
+        have not been read yet are loaded first.
+        """
+        f = getattr(self, '_openFile', None)
+        if f is None:
+            return
+        for ax in list(self._lazyValues.keys()):
+            self._loadAxisValues(ax)
+        if not isinstance(self._data, np.ndarray):
+            self._data = None
+        self._openFile = None
+        f.close()
+
     @property
     def ndim(self):
         return len(self.shape)  ## hdf5 objects do not have ndim property.
@@ -372,8 +442,12 @@ class MetaArray(object):
     def axisValues(self, axis):
         """Return the list of values for an axis"""
         ax = self._interpretAxis(axis)
+        if ax in self._lazyValues:
+            self._loadAxisValues(ax)
         if 'values' in self._info[ax]:
             return self._info[ax]['values']
+        elif self._axisIsRegular(ax):
+            return self._regularValues(ax)
         else:
             raise Exception('Array axis %s (%d) has no associated values.' % (str(axis), ax))
   
@@ -383,7 +457,35 @@ class MetaArray(object):
         
     def axisHasValues(self, axis):
         ax = self._interpretAxis(axis)
-        return 'values' in self._info[ax]
+        return 'values' in self._info[ax] or ax in self._lazyValues or self._axisIsRegular(ax)
+
+    def _loadAxisValues(self, ax):
+        ## read axis values from the HDF5 file and keep them in the meta info
+        self._info[ax]['values'] = self._lazyValues.pop(ax)[:]
+
+    def _axisIsRegular(self, ax):
+        ## True if axis values are described by start / rate rather than an array
+        info = self._info[ax]
+        return ax < self.ndim and 'values' not in info and 'rate' in info and 'start' in info
+
+    def _regularValues(self, ax):
+        info = self._info[ax]
+        return np.arange(self.shape[ax], dtype=float) / info['rate'] + info['start']
+
+    def _explicitInfo(self):
+        ## Return info list in which regular axes are given explicit values
+        ## (axis dicts are copied only where needed)
+        for ax in list(self._lazyValues.keys()):
+            self._loadAxisValues(ax)
+        info = list(self._info)
+        for i in range(len(info)):
+            if self._axisIsRegular(i):
+                ax = info[i].copy()
+                ax['values'] = self._regularValues(i)
+                del ax['start']
+                del ax['rate']
+                info[i] = ax
+        return info
         
     def axisHasColumns(self, axis):
         ax = self._interpretAxis(axis)
@@ -474,9 +576,9 @@ class MetaArray(object):
     def infoCopy(self, axis=None):
         """Return a deep copy of the axis meta info for this object"""
         if axis is None:
-            return copy.deepcopy(self._info)
+            return copy.deepcopy(self._explicitInfo())
         else:
-            return copy.deepcopy(self._info[self._interpretAxis(axis)])
+            return copy.deepcopy(self._explicitInfo()[self._interpretAxis(axis)])
   
     def copy(self):
         return MetaArray(self._data.copy(), info=self.infoCopy())
@@ -541,7 +643,7 @@ class MetaArray(object):
                     index = self._getIndex(axis, ind.stop)
                     
                 ## x[Axis:min:max]
-                elif (isinstance(ind.stop, float) or isinstance(ind.step, float)) and ('values' in self._info[axis]):
+                elif (isinstance(ind.stop, float) or isinstance(ind.step, float)) and self.axisHasValues(axis):
                     #print "    axis value range"
                     if ind.stop is None:
                         mask = self.xvals(axis) < ind.step
@@ -551,6 +653,15 @@ class MetaArray(object):
                         mask = (self.xvals(axis) >= ind.stop) * (self.xvals(axis) < ind.step)
                     ##print "mask:", mask
                     index = mask
+                    ## for HDF5-backed arrays a contiguous range (eg. from sorted axis
+                    ## values) is converted to a slice so only that block is read.
+                    ## In-memory arrays keep the mask, so the result is still a copy.
+                    if not isinstance(self._data, np.ndarray):
+                        sel = np.nonzero(mask)[0]
+                        if len(sel) == 0:
+                            index = slice(0, 0)
+                        elif sel[-1] - sel[0] + 1 == len(sel):
+                            index = slice(sel[0], sel[-1] + 1)
                     
                 ## x[Axis:columnIndex]
                 elif isinstance(ind.stop, int) or isinstance(ind.step, int):
@@ -610,11 +721,41 @@ class MetaArray(object):
         raise Exception("Axis %d has no column named %s.\n  info=%s" % (axis, name, self._info))
   
     def _axisCopy(self, i):
-        return copy.deepcopy(self._info[i])
+        ## (axis values are not copied here; callers slice them as needed)
+        ax = self._info[i]
+        ret = copy.deepcopy(dict([(k, v) for k, v in ax.items() if k != 'values']))
+        if 'values' in ax:
+            ret['values'] = ax['values']
+        return ret
   
     def _axisSlice(self, i, cols):
         #print "axisSlice", i, cols
-        if 'cols' in self._info[i] or 'values' in self._info[i]:
+        if i in self._lazyValues:
+            if isinstance(cols, slice) and (cols.step is None or cols.step > 0):
+                ## read only the requested values from the file
+                ax = self._axisCopy(i)
+                ax['values'] = self._lazyValues[i][cols]
+                if 'cols' in ax:
+                    ax['cols'] = list(np.array(ax['cols'])[cols])
+                return ax
+            self._loadAxisValues(i)
+        if self._axisIsRegular(i):
+            ax = self._axisCopy(i)
+            if isinstance(cols, slice):
+                ## the slice of a regular axis is still regular
+                start, stop, step = cols.indices(self.shape[i])
+                ax['start'] = ax['start'] + start / float(ax['rate'])
+                ax['rate'] = ax['rate'] / float(step)
+            else:
+                ax['values'] = self._regularValues(i)[cols]
+                del ax['start']
+                del ax['rate']
+            if 'cols' in ax:
+                sl = np.array(ax['cols'])[cols]
+                if isinstance(sl, np.ndarray):
+                    sl = list(sl)
+                ax['cols'] = sl
+        elif 'cols' in self._info[i] or 'values' in self._info[i]:
             ax = self._axisCopy(i)
             if 'cols' in ax:
                 #print "  slicing columns..", array(ax['cols']), cols
@@ -624,7 +765,7 @@ class MetaArray(object):
                 ax['cols'] = sl
                 #print "  result:", ax['cols']
             if 'values' in ax:
-                ax['values'] = np.array(ax['values'])[cols]
+                ax['values'] = np.array(self._info[i]['values'][cols])
         else:
             ax = self._info[i]
         #print "     ", ax
@@ -647,8 +788,9 @@ class MetaArray(object):
             if len(axs) > maxl:
                 maxl = len(axs)
         
-        for i in range(min(self.ndim, len(self._info) - 1)):
-            ax = self._info[i]
+        info = self._explicitInfo()
+        for i in range(min(self.ndim, len(info) - 1)):
+            ax = info[i]
             axs = titles[i]
             axs += '%s[%d] :' % (' ' * (maxl - len(axs) + 5 - len(str(self.shape[i]))), self.shape[i])
             if 'values' in ax:
@@ -711,6 +853,8 @@ class MetaArray(object):
             order = args
         
         order = [self._interpretAxis(ax) for ax in order]
+        for ax in list(self._lazyValues.keys()):
+            self._loadAxisValues(ax)
         infoOrder = order  + list(range(len(order), len(self._info)))
         info = [self._info[i] for i in infoOrder]
         order = order + list(range(len(order), self.ndim))
@@ -735,13 +879,16 @@ class MetaArray(object):
                           and the file is closed (this is the default for files < 500MB). Otherwise, the file will
                           be left open and data will be read only as requested (this is 
                           the default for files >= 500MB).
+            *mmap* (bool) if True, then the data is memory-mapped with numpy.memmap rather than read. Pages
+                          are loaded from disk only as they are accessed. The data set must be stored
+                          contiguously and uncompressed (see write(mappable=True)).
         
         
         """
         ## decide which read function to use
         with open(filename, 'rb') as fd:
             magic = fd.read(8)
-            if magic == '\x89HDF\r\n\x1a\n':
+            if magic == b'\x89HDF\r\n\x1a\n':
                 fd.close()
                 self._readHDF5(filename, **kwargs)
                 self._isHDF = True
@@ -907,12 +1054,14 @@ class MetaArray(object):
         #raise Exception()  ## stress-testing
         #return subarr
 
-    def _readHDF5(self, fileName, readAllData=None, writable=False, **kargs):
+    def _readHDF5(self, fileName, readAllData=None, writable=False, mmap=False, **kargs):
         if 'close' in kargs and readAllData is None: ## for backward compatibility
             readAllData = kargs['close']
        
         if readAllData is True and writable is True:
             raise Exception("Incompatible arguments: readAllData=True and writable=True")
+        if readAllData is True and mmap is True:
+            raise Exception("Incompatible arguments: readAllData=True and mmap=True")
         
         if not HAVE_HDF5:
             try:
@@ -937,13 +1086,28 @@ class MetaArray(object):
         ver = f.attrs['MetaArray']
         if ver > MetaArray.version:
             print("Warning: This file was written with MetaArray version %s, but you are using version %s. (Will attempt to read anyway)" % (str(ver), str(MetaArray.version)))
-        meta = MetaArray.readHDF5Meta(f['info'])
-        self._info = meta
-        
-        if writable or not readAllData:  ## read all data, convert to ndarray, close file
+        if mmap:
+            ## map the data directly from the file; the HDF5 file is only
+            ## needed to read the meta info.
+            try:
+                self._data = MetaArray.mapHDF5Array(f['data'], writable=writable)
+                self._info = MetaArray.readHDF5Meta(f['info'])
+            finally:
+                f.close()
+        elif writable or not readAllData:
+            ## leave data and axis values in the file; these are read only as
+            ## they are requested
+            ndim = len(f['data'].shape)
+            lazy = set(['/info/%d/values' % i for i in range(ndim)])
+            meta = MetaArray.readHDF5Meta(f['info'], lazy=lazy)
+            for i in range(ndim):
+                if isinstance(meta[i].get('values', None), h5py.Dataset):
+                    self._lazyValues[i] = meta[i].pop('values')
+            self._info = meta
             self._data = f['data']
             self._openFile = f
-        else:
+        else:  ## read all data, convert to ndarray, close file
+            self._info = MetaArray.readHDF5Meta(f['info'])
             self._data = f['data'][:]
             f.close()
             
@@ -985,7 +1149,12 @@ class MetaArray(object):
 
 
     @staticmethod
-    def readHDF5Meta(root, mmap=False):
+    def readHDF5Meta(root, mmap=False, lazy=None):
+        """Read meta info stored in an HDF5 group.
+        
+        Datasets whose names are listed in *lazy* are not read; the h5py
+        Dataset is returned in their place.
+        """
         data = {}
         
         ## Pull list of values from attributes and child objects
@@ -999,10 +1168,12 @@ class MetaArray(object):
             data[k] = val
         for k in root:
             obj = root[k]
-            if isinstance(obj, h5py.highlevel.Group):
-                val = MetaArray.readHDF5Meta(obj)
-            elif isinstance(obj, h5py.highlevel.Dataset):
-                if mmap:
+            if isinstance(obj, h5py.Group):
+                val = MetaArray.readHDF5Meta(obj, mmap=mmap, lazy=lazy)
+            elif isinstance(obj, h5py.Dataset):
+                if lazy is not None and obj.name in lazy:
+                    val = obj
+                elif mmap:
                     val = MetaArray.mapHDF5Array(obj)
                 else:
                     val = obj[:]
@@ -1033,6 +1204,9 @@ class MetaArray(object):
             appendKeys: a list of keys (other than "values") for metadata to append to on the appendable axis.
             compression: None, 'gzip' (good compression), 'lzf' (fast compression), etc.
             chunks: bool or tuple specifying chunk shape
+            mappable: if True, the data is stored contiguously and uncompressed so that it can be
+                      read back with MetaArray(file=fileName, mmap=True). Not compatible
+                      with appendAxis.
         """
         
         if USE_HDF5 and HAVE_HDF5:
@@ -1048,7 +1222,7 @@ class MetaArray(object):
             raise Exception("The file %s was created with a different version of MetaArray. Will not modify." % fileName)
         del f['info']
         
-        self.writeHDF5Meta(f, 'info', self._info)
+        self.writeHDF5Meta(f, 'info', self._explicitInfo())
         f.close()
 
 
@@ -1092,6 +1266,8 @@ class MetaArray(object):
         
         ## If mappable is in options, it disables chunking/compression
         if opts.get('mappable', False):
+            if appAxis is not None:
+                raise Exception("Mappable arrays can not be appended to (appendAxis must be None).")
             dsOpts = {
                 'chunks': None,
                 'compression': None
@@ -1130,7 +1306,7 @@ class MetaArray(object):
             for key in axKeys:
                 if key in axInfo:
                     v = axInfo[key]
-                    v2 = self._info[ax][key]
+                    v2 = self._explicitInfo()[ax][key]
                     shape = list(v.shape)
                     shape[0] += v2.shape[0]
                     v.resize(shape)
@@ -1151,7 +1327,7 @@ class MetaArray(object):
                 dsOpts['chunks'] = True
                 if 'maxshape' in dsOpts:
                     del dsOpts['maxshape']
-            self.writeHDF5Meta(f, 'info', self._info, **dsOpts)
+            self.writeHDF5Meta(f, 'info', self._explicitInfo(), **dsOpts)
             f.close()
 
     def writeHDF5Meta(self, root, name, data, **dsOpts):
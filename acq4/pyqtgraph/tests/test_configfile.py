@@ -0,0 +1,40 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+import pyqtgraph as pg
+from pyqtgraph import configfile
+from pyqtgraph.pgcollections import OrderedDict
+
+
+def test_literal_parser():
+    # values must parse identically with and without eval
+    exprs = ['1', '-2.5e-3', "'str'", '"it\'s"', "u'x'", 'None', 'True', '[]', '()', '(1,)', '(1)',
+             '[1, 2.5, -3]', '[1, [2, (3, 4)]]', "{'a': 1, 'b': [2]}", '{1, 2}', '10*mV', '-65 * mV',
+             '2.5*kHz', '1/3.', "OrderedDict([('z', 1)])", "'a\\nb'", '(1, 2)*2', '[1] + [2]']
+    ns = configfile.evalNamespace()
+    for expr in exprs:
+        val = configfile.evalValue(expr)
+        expect = eval(expr, ns)
+        assert type(val) is type(expect), expr
+        assert val == expect, expr
+
+    arr = configfile.evalValue('array([1, 2, 3], dtype=int8)')
+    assert arr.dtype == np.int8
+    assert_array_equal(arr, [1, 2, 3])
+
+    # expressions outside the literal subset fall back to eval
+    assert configfile.evalValue('datetime.datetime(2010, 1, 2)').day == 2
+    assert configfile.evalValue('QtCore.Qt.Horizontal') == pg.QtCore.Qt.Horizontal
+
+
+def test_parse_roundtrip():
+    data = OrderedDict([
+        ('.', {'__timestamp__': 1400000000.123}),
+        ('000.ma', OrderedDict([('__object_type__', 'MetaArray'), ('params', (0, 1)), ('pos', [1e-6, 0.0])])),
+        ((1, 2), 'tuple key'),
+        ('empty', {}),
+    ])
+    s = configfile.genString(data) + "# comment\n\nunits: 10*mV  # trailing comment\n"
+    parsed = configfile.parseString(s)[1]
+    for k in data:
+        assert parsed[k] == data[k]
+    assert parsed['units'] == 10e-3
@@ -0,0 +1,155 @@
+from __future__ import print_function
+import threading, time
+import concurrent.futures
+import pytest
+from acq4.Manager import Task
+from acq4.devices.Device import DeviceTask
+from acq4.util.StorageQueue import StorageQueue
+
+
+class FakeDevice(object):
+    def __init__(self, name, **opts):
+        self._name = name
+        self.opts = opts
+    def name(self):
+        return self._name
+    def createTask(self, cmd, parentTask):
+        return FakeDeviceTask(self, cmd, parentTask, **self.opts)
+    def release(self):
+        self.opts['log'][self._name + '.release'] = time.time()
+
+
+class FakeDeviceTask(DeviceTask):
+    def __init__(self, dev, cmd, parentTask, before=(), after=(), prepTime=0, parallel=True, asyncStorage=False, log=None):
+        DeviceTask.__init__(self, dev, cmd, parentTask)
+        self.before = list(before)
+        self.after = list(after)
+        self.prepTime = prepTime
+        self.parallelConfigure = parallel
+        self.asyncStorage = asyncStorage
+        self.log = log
+    def getConfigOrder(self):
+        return self.before, self.after
+    def getPrepTimeEstimate(self):
+        return self.prepTime
+    def configure(self):
+        start = time.time()
+        time.sleep(0.05)
+        self.log[self.dev.name()] = (start, time.time(), threading.current_thread())
+    def isDone(self):
+        return True
+    def getResult(self):
+        return self.dev.name()
+    def storeResult(self, dirHandle):
+        time.sleep(0.05)
+        self.log[self.dev.name() + '.store'] = (time.time(), threading.current_thread())
+
+
+class FakeManager(object):
+    def __init__(self, devs):
+        self.devices = dict([(d.name(), d) for d in devs])
+        self.configurePool = None
+        self.storageQueue = StorageQueue()
+    def getDevice(self, name):
+        return self.devices[name]
+    def getConfigurePool(self):
+        if self.configurePool is None:
+            self.configurePool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        return self.configurePool
+
+
+def makeTask(log, protocol=None, **devOpts):
+    devs = [FakeDevice(name, log=log, **opts) for name, opts in devOpts.items()]
+    cmd = dict([(name, {}) for name in devOpts])
+    cmd['protocol'] = protocol or {}
+    return Task(FakeManager(devs), cmd)
+
+
+def test_criticalPathCost():
+    ## example from Task.toposort
+    deps = {'a': ['b', 'c'], 'c': ['b', 'd'], 'e': ['b']}
+    cost = {'a': 0, 'b': 0, 'c': 1, 'e': 1, 'd': 3}
+    assert Task.criticalPathCost(deps, cost) == {'a': 0, 'b': 1, 'c': 1, 'd': 4, 'e': 1}
+    assert Task.toposort(deps, cost=cost) == ['d', 'b', 'c', 'e', 'a']
+
+
+def test_getPrepTimeEstimate():
+    log = {}
+    ## clamp -> daq is one chain (0.3 s); the camera is prepared concurrently
+    task = makeTask(log, clamp=dict(after=['daq'], prepTime=0.1), daq=dict(prepTime=0.2), cam=dict(prepTime=0.25))
+    assert task.getPrepTimeEstimate() == pytest.approx(0.3)
+    assert makeTask(log).getPrepTimeEstimate() == 0
+
+
+def test_configure_order():
+    log = {}
+    main = threading.current_thread()
+    task = makeTask(log,
+                    clamp1=dict(after=['daq']), clamp2=dict(after=['daq']),
+                    daq=dict(), cam=dict(prepTime=1.0), laser=dict(parallel=False, before=['cam']))
+    start = time.time()
+    task.configure()
+    elapsed = time.time() - start
+    assert sorted(log) == ['cam', 'clamp1', 'clamp2', 'daq', 'laser']
+    
+    ## dependencies are configured first
+    for first, second in [('clamp1', 'daq'), ('clamp2', 'daq'), ('cam', 'laser')]:
+        assert log[first][1] <= log[second][0]
+    ## independent devices overlap, and tasks that do not allow it stay on the calling thread
+    assert elapsed < 0.2
+    assert log['laser'][2] is main
+    assert task.dm.configurePool is not None
+    
+    ## protocols may request sequential configuration
+    log.clear()
+    task = makeTask(log, {'parallelConfigure': False}, clamp=dict(after=['daq']), daq=dict(), cam=dict())
+    task.configure()
+    assert all([log[name][2] is main for name in log])
+    assert log['clamp'][1] <= log['daq'][0]
+    assert task.dm.configurePool is None
+
+
+def test_configure_error():
+    class Failure(Exception):
+        pass
+    log = {}
+    task = makeTask(log, clamp=dict(after=['daq']), daq=dict(), cam=dict())
+    def fail():
+        raise Failure()
+    task.tasks['clamp'].configure = fail
+    with pytest.raises(Failure):
+        task.configure()
+    ## devices depending on the failed device are not configured
+    assert 'daq' not in log
+
+
+class FakeDirHandle(object):
+    def __init__(self):
+        self.info = {}
+    def name(self):
+        return 'storage'
+    def setInfo(self, info):
+        self.info.update(info)
+
+
+def test_async_storage():
+    log = {}
+    main = threading.current_thread()
+    dh = FakeDirHandle()
+    task = makeTask(log, {'storeData': True, 'storeAsync': True, 'storageDir': dh},
+                    cam=dict(asyncStorage=True), laser=dict())
+    task.lockedDevs = list(task.tasks)
+    task.startedDevs = []
+    task.stopped = True
+    task.startTime = 0
+    task.stop()
+    assert task.result['cam'] == 'cam'
+    assert 'startTime' in dh.info
+    
+    ## tasks that may need their device are stored before it is released;
+    ## the others are written from a storage thread
+    assert log['laser.store'][1] is main
+    assert log['laser.store'][0] <= log['laser.release']
+    task.dm.storageQueue.flush()
+    assert log['cam.store'][1] is not main
+    task.dm.storageQueue.stop()
@@ -15,7 +15,7 @@ if __name__ == '__main__':
     path = os.path.dirname(os.path.abspath(__file__))
     sys.path.append(os.path.join(path, '..', '..'))
 
-import threading, os, re, sys, shutil
+import threading, os, re, sys, shutil, struct, pickle, bisect
 from acq4.util.functions import strncmp
 from acq4.util.configfile import *
 import time
@@ -64,6 +64,13 @@ def cleanup():
     getDataManager().cleanup()
 
 
+## Matches dates like 2010.06.25 in file names
+_dateRegex = re.compile(r'(20\d\d\.\d\d?\.\d\d?)')
+
+## Header written at the start of every .index.journal sidecar file
+INDEX_JOURNAL_MAGIC = b'ACQ4IJ01'
+
+
 class DataManager(Qt.QObject):
     """Class for creating and caching DirHandle objects to make sure there is only one manager object per file/directory. 
     This class is (supposedly) thread-safe.
@@ -104,14 +111,36 @@ class DataManager(Qt.QObject):
             return self.getFileHandle(fileName)
         
     def cleanup(self):
-        """Attempt to free memory by allowing python to collect any unused handles."""
+        """Attempt to free memory by allowing python to collect any unused handles.
+        
+        Any journaled index changes are folded back into their `.index` files first,
+        so the handles may be discarded without leaving a stale index behind.
+        """
         import gc
+        self.compactIndexes()
         with self.lock:
             tmp = weakref.WeakValueDictionary(self.cache)
             self.cache = None
             gc.collect()
             self.cache = dict(tmp)
 
+    def compactIndexes(self):
+        """Fold the index journal of every cached directory back into its `.index` file.
+        
+        This keeps `.index` files readable by tools that do not know about journals
+        (older versions of acq4, or plain readConfigFile). It is called by cleanup()
+        and when the Manager quits.
+        """
+        with self.lock:
+            handles = list(self.cache.values())
+        for handle in handles:
+            if not isinstance(handle, DirHandle) or handle._journalOffset == 0:
+                continue
+            try:
+                handle.compactIndex()
+            except:
+                printExc("Error compacting index journal for %s:" % handle.name())
+
     def _addHandle(self, fileName, handle):
         """Cache a handle and watch it for changes"""
         self._setCache(fileName, handle)
@@ -429,11 +458,27 @@ class FileHandle(Qt.QObject):
 
 
 class DirHandle(FileHandle):
+    """Handle to a directory and its meta-information.
+
+    Meta info is stored in two files: the human-readable `.index` (configfile
+    format) and an append-only binary journal `.index.journal`. Updates to
+    entries that already exist in the index are appended to the journal rather
+    than rewriting the whole `.index` file. When the journal grows larger than
+    the index, it is compacted back into `.index` (see compactIndex()).
+    """
+
+    ## Minimum number of journal records before automatic compaction is considered
+    journalCompactThreshold = 1000
+
     def __init__(self, path, manager, create=False):
         FileHandle.__init__(self, path, manager)
         self._index = None
+        self._indexMTime = None
+        self._journalOffset = 0   # number of bytes of the journal already applied to self._index
+        self._journalCount = 0
         self.lsCache = {}  # sortMode: [files...]
-        self.cTimeCache = {}
+        self.cTimeCache = {}  # fileName: creation time; persists across child changes
+        self._dateSorted = []  # [(ctime, fileName), ...] kept sorted
         self._indexFileExists = False
         
         if not os.path.isdir(self.path):
@@ -448,6 +493,10 @@ class DirHandle(FileHandle):
         """Return the name of the index file for this directory. NOT the same as indexFile()"""
         return os.path.join(self.path, '.index')
     
+    def _journalFile(self):
+        """Return the name of the append-only journal that accompanies the index file."""
+        return os.path.join(self.path, '.index.journal')
+    
     def _logFile(self):
         return os.path.join(self.path, '.log')
     
@@ -603,17 +652,15 @@ class DirHandle(FileHandle):
         except:
             printExc("Error while listing files in %s:" % self.name())
             files = []
-        for i in ['.index', '.log']:
+        for i in ['.index', '.index.journal', '.log']:
             if i in files:
                 files.remove(i)
         
         if sortMode == 'date':
-            ## Sort files by creation time
-            with BusyCursor():
-                for f in files:
-                    if f not in self.cTimeCache:
-                        self.cTimeCache[f] = self._getFileCTime(f)
-            files.sort(key=lambda f: (self.cTimeCache[f], f))  ## sort by time first, then name.
+            ## Sort files by creation time. Sort keys are cached and the sorted list
+            ## is updated incrementally, so only new or changed children are examined.
+            self._updateDateSortCache(files)
+            files = [f for t, f in self._dateSorted]
         elif sortMode == 'alpha':
             ## show directories first when sorting alphabetically.
             files.sort(lambda a,b: 2*cmp(os.path.isdir(os.path.join(self.name(),b)), os.path.isdir(os.path.join(self.name(),a))) + cmp(a,b))
@@ -624,9 +671,47 @@ class DirHandle(FileHandle):
             
         self.lsCache[sortMode] = files
     
-    def _getFileCTime(self, fileName):
+    def _updateDateSortCache(self, files):
+        """Bring self._dateSorted up to date with the list of files currently in the directory."""
+        fileSet = set(files)
+        stale = [f for f in self.cTimeCache if f not in fileSet]
+        missing = [f for f in files if f not in self.cTimeCache]
+        
+        for f in stale:
+            self._removeSortKey(f)
+        
+        if len(missing) > 0:
+            index = self._readIndex(unmanagedOk=True) if self.isManaged() else None
+            with BusyCursor():
+                for f in missing:
+                    self._insertSortKey(f, self._getFileCTime(f, index=index))
+    
+    def _insertSortKey(self, fileName, t):
+        self.cTimeCache[fileName] = t
+        bisect.insort(self._dateSorted, (t, fileName))  ## sort by time first, then name.
+        
+    def _removeSortKey(self, fileName):
+        t = self.cTimeCache.pop(fileName)
+        key = (t, fileName)
+        i = bisect.bisect_left(self._dateSorted, key)
+        if i < len(self._dateSorted) and self._dateSorted[i] == key:
+            del self._dateSorted[i]
+        else:
+            self._dateSorted.remove(key)
+    
+    def _updateSortKey(self, fileName, t):
+        """Update the cached creation time for a child whose __timestamp__ has changed."""
+        with self.lock:
+            if self.cTimeCache.get(fileName, t) == t:
+                return
+            self._removeSortKey(fileName)
+            self._insertSortKey(fileName, t)
+            self.lsCache.pop('date', None)
+    
+    def _getFileCTime(self, fileName, index=None):
         if self.isManaged():
-            index = self._readIndex()
+            if index is None:
+                index = self._readIndex()
             try:
                 t = index[fileName]['__timestamp__']
                 return t
@@ -635,12 +720,12 @@ class DirHandle(FileHandle):
             
             ## try getting time directly from file
             try:
-                t = self[fileName].info()['__timestamp__']
+                return self[fileName].info()['__timestamp__']
             except:
                 pass
                     
         ## if the file has an obvious date in it, use that
-        m = re.search(r'(20\d\d\.\d\d?\.\d\d?)', fileName)
+        m = _dateRegex.search(fileName)
         if m is not None:
             return time.mktime(time.strptime(m.groups()[0], "%Y.%m.%d"))
         
@@ -772,12 +857,7 @@ class DirHandle(FileHandle):
                 return
             index = self._readIndex(lock=False)
             if fileName in index:
-                try:
-                    del index[fileName]
-                except:
-                    print(type(index))
-                    raise
-                self._writeIndex(index, lock=False)
+                self._journalAppend('forget', fileName)
                 self.emitChanged('meta', fileName)
         
     def isManaged(self, fileName=None):
@@ -818,25 +898,25 @@ class DirHandle(FileHandle):
             if not self.isManaged():
                 self.createIndex()
             index = self._readIndex(lock=False)
-            append = False
-            if fileName not in index:
+            if fileName not in index and self._journalOffset == 0:
+                ## New entries are appended to the text index as long as there is no
+                ## pending journal (journal records must always be replayed last).
                 index[fileName] = {}
-                append = True
-                
-            for k in info:
-                index[fileName][k] = info[k]
-                
-            if append:
+                for k in info:
+                    index[fileName][k] = info[k]
                 self._appendIndex({fileName: info})
-                
             else:
-                self._writeIndex(index, lock=False)
+                self._journalAppend('set', fileName, info)
+            if '__timestamp__' in info and fileName != '.':
+                self._updateSortKey(fileName, info['__timestamp__'])
             self.emitChanged('meta', fileName)
         
     def _readIndex(self, lock=True, unmanagedOk=False):
         with self.lock:
             indexFile = self._indexFile()
-            if self._index is None or os.path.getmtime(indexFile) != self._indexMTime:
+            journalSize = self._journalSize()
+            if (self._index is None or os.path.getmtime(indexFile) != self._indexMTime or
+                    journalSize < self._journalOffset):
                 if not os.path.isfile(indexFile):
                     if unmanagedOk:
                         return None
@@ -848,15 +928,114 @@ class DirHandle(FileHandle):
                 except:
                     print("***************Error while reading index file %s!*******************" % indexFile)
                     raise
+                self._journalOffset = 0
+                self._journalCount = 0
+            if journalSize > self._journalOffset:
+                self._replayJournal()
             return self._index
         
     def _writeIndex(self, newIndex, lock=True):
         with self.lock:
             writeConfigFile(newIndex, self._indexFile())
+            ## the full index now supersedes any journaled changes
+            if os.path.exists(self._journalFile()):
+                os.remove(self._journalFile())
+            self._journalOffset = 0
+            self._journalCount = 0
             self._index = newIndex
             self._indexMTime = os.path.getmtime(self._indexFile())
             self._indexFileExists = True
 
+    def _journalSize(self):
+        try:
+            return os.path.getsize(self._journalFile())
+        except OSError:
+            return 0
+
+    def _replayJournal(self):
+        """Apply all journal records beyond self._journalOffset to the cached index.
+        
+        An incomplete record at the end of the journal (eg. from an interrupted write)
+        is ignored until it has been completed.
+        """
+        journalFile = self._journalFile()
+        with open(journalFile, 'rb') as fd:
+            offset = self._journalOffset
+            if offset == 0:
+                magic = fd.read(len(INDEX_JOURNAL_MAGIC))
+                if magic != INDEX_JOURNAL_MAGIC:
+                    raise Exception("File %s is not a valid index journal." % journalFile)
+                offset = len(magic)
+            else:
+                fd.seek(offset)
+            
+            while True:
+                head = fd.read(4)
+                if len(head) < 4:
+                    break
+                size = struct.unpack('<I', head)[0]
+                payload = fd.read(size)
+                if len(payload) < size:
+                    break
+                try:
+                    op, fileName, info = pickle.loads(payload)
+                except:
+                    print("***************Error while reading index journal %s at offset %d!*******************" % (journalFile, offset))
+                    raise
+                self._applyJournalRecord(op, fileName, info)
+                self._journalCount += 1
+                offset += 4 + size
+        self._journalOffset = offset
+
+    def _applyJournalRecord(self, op, fileName, info):
+        if op == 'set':
+            if fileName not in self._index:
+                self._index[fileName] = {}
+            for k in info:
+                self._index[fileName][k] = info[k]
+        elif op == 'forget':
+            self._index.pop(fileName, None)
+        else:
+            raise Exception("Unknown index journal operation '%s'" % op)
+
+    def _journalAppend(self, op, fileName, info=None):
+        """Record a single change to the index in the journal and apply it to the cached index.
+        The index must have been read (and the journal replayed) before calling this method.
+        """
+        with self.lock:
+            payload = pickle.dumps((op, fileName, None if info is None else dict(info)), protocol=2)
+            journalFile = self._journalFile()
+            with open(journalFile, 'ab') as fd:
+                fd.seek(0, 2)
+                if fd.tell() == 0:
+                    fd.write(INDEX_JOURNAL_MAGIC)
+                start = fd.tell()
+                fd.write(struct.pack('<I', len(payload)))
+                fd.write(payload)
+                end = fd.tell()
+            
+            if start == max(self._journalOffset, len(INDEX_JOURNAL_MAGIC)):
+                ## nobody else wrote to the journal since we last read it; apply the record
+                ## directly rather than reading it back.
+                self._applyJournalRecord(op, fileName, info)
+                self._journalCount += 1
+                self._journalOffset = end
+            else:
+                self._readIndex(lock=False)
+            
+            if self._journalCount > max(self.journalCompactThreshold, len(self._index)):
+                self.compactIndex()
+
+    def compactIndex(self):
+        """Fold all journaled changes back into the text `.index` file and remove the journal."""
+        with self.lock:
+            if not self.isManaged():
+                return
+            index = self._readIndex(lock=False)
+            if self._journalOffset == 0:
+                return
+            self._writeIndex(index, lock=False)
+
     def _appendIndex(self, info):
         with self.lock:
             indexFile = self._indexFile()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+StorageQueue.py -  Background (write-behind) storage of task results
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Writing large results (camera stacks, long DAQ recordings) to disk can take
+longer than the gap between two task runs. StorageQueue moves this work onto
+background threads so that acquisition can continue while previous results
+are still being written.
+"""
+
+import sys, threading, time
+import six
+from six.moves import queue
+from .debug import printExc
+
+
+class StorageQueue(object):
+    """Bounded queue of storage jobs that are executed on background threads.
+
+    Each job is a callable associated with a DirHandle. Jobs submitted for the
+    same directory are always executed in the order they were submitted (they
+    are routed to the same worker thread). When a worker's queue is full,
+    submit() blocks until space becomes available; this keeps the amount of
+    unwritten data in memory bounded.
+
+    If a job raises an exception, it is re-raised from the next call to
+    submit(), flush() or stop() so that failed writes are not lost silently.
+    submit() queues its own job before raising, so no result is dropped
+    because of an earlier failure.
+
+    Example::
+
+        sq = StorageQueue(maxSize=4)
+        sq.submit(dirHandle, task.storeResult)
+        ...
+        sq.flush()  # wait until everything is on disk
+    """
+    def __init__(self, maxSize=4, nThreads=1):
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._error = None
+        self._queues = []
+        self._threads = []
+        for i in range(nThreads):
+            q = queue.Queue(maxsize=maxSize)
+            thread = threading.Thread(target=self._run, args=(q,), name="StorageQueue-%d" % i)
+            thread.daemon = True
+            self._queues.append(q)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, dirHandle, fn, args=(), kwds=None, timeout=None):
+        """Queue fn(*args, **kwds) to be called on a storage thread.
+
+        If the queue for *dirHandle* is full, block until space is available
+        (or raise queue.Full after *timeout* seconds). If an earlier job failed,
+        its exception is raised after this job has been queued.
+        """
+        if self._threads is None:
+            raise Exception("StorageQueue has been stopped.")
+        if kwds is None:
+            kwds = {}
+        q = self._queues[hash(dirHandle.name()) % len(self._queues)]
+        with self._cond:
+            self._pending += 1
+        try:
+            q.put((dirHandle, fn, args, kwds), block=True, timeout=timeout)
+        except:
+            self._jobDone()
+            raise
+        self._raiseError()
+
+    def pending(self):
+        """Return the number of jobs that have been submitted but not yet completed."""
+        with self._cond:
+            return self._pending
+
+    def flush(self, timeout=None):
+        """Block until all submitted jobs have completed.
+
+        Return False if *timeout* elapsed before all jobs completed. If any job
+        failed, its exception is raised here.
+        """
+        stop = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._pending > 0:
+                if stop is None:
+                    self._cond.wait()
+                else:
+                    remaining = stop - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            done = self._pending == 0
+        self._raiseError()
+        return done
+
+    def stop(self, timeout=None):
+        """Write all pending results, then stop the storage threads."""
+        if self._threads is None:
+            return
+        try:
+            self.flush(timeout=timeout)
+        finally:
+            for q in self._queues:
+                q.put(None)
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = None
+
+    def _raiseError(self):
+        ## re-raise the first exception from a failed job (once)
+        with self._cond:
+            error = self._error
+            self._error = None
+        if error is not None:
+            six.reraise(*error)
+
+    def _jobDone(self):
+        with self._cond:
+            self._pending -= 1
+            if self._pending == 0:
+                self._cond.notify_all()
+
+    def _run(self, q):
+        while True:
+            job = q.get()
+            if job is None:
+                break
+            dirHandle, fn, args, kwds = job
+            try:
+                fn(*args, **kwds)
+            except:
+                printExc("Error while storing data in %s:" % dirHandle.name())
+                with self._cond:
+                    if self._error is None:
+                        self._error = sys.exc_info()
+            finally:
+                job = None
+                self._jobDone()
@@ -31,7 +31,7 @@ class AnalysisDatabase(SqliteDatabase):
     Version = '1'
 
 
-    def __init__(self, dbFile, dataModel, baseDir=None):
+    def __init__(self, dbFile, dataModel, baseDir=None, walMode=False):
         create = False
         self.tableConfigCache = None
         self.columnConfigCache = advancedTypes.CaselessDict()
@@ -47,7 +47,7 @@ class AnalysisDatabase(SqliteDatabase):
         
         if not create:
             ## load DB and check version before initializing
-            db = SqliteDatabase(dbFile)
+            db = SqliteDatabase(dbFile, walMode=walMode)
             if not db.hasTable('DbParameters'):
                 raise Exception("Invalid analysis database -- no DbParameters table.")
             recs = db.select('DbParameters', ['Value'], where={'Param': 'DB Version'})
@@ -60,7 +60,7 @@ class AnalysisDatabase(SqliteDatabase):
             if version != AnalysisDatabase.Version:
                 self._convertDB(dbFile, version)
         
-        SqliteDatabase.__init__(self, dbFile)
+        SqliteDatabase.__init__(self, dbFile, walMode=walMode)
         self.file = dbFile
         
         if create:
@@ -375,6 +375,10 @@ class AnalysisDatabase(SqliteDatabase):
                         if (colType == 'file' or colType.startswith('directory')):
                             if (colName in config and config[colName].get('Type',None) == colType):
                                 continue
+                        ## arrays are pickled into blob columns of tables created before
+                        ## 'array blob' existed, so these tables stay readable by older versions
+                        if colType.lower() == 'array blob' and specType.lower() == 'blob':
+                            continue
                         raise Exception("Table has different data structure: Column '%s' type is %s, should be %s" % (colName, specType, colType))
 
             if create is True and indexes is not None:
@@ -654,7 +658,12 @@ class AnalysisDatabase(SqliteDatabase):
         return res[0]['Owner']
 
     def describeData(self, data):
-        """Given a dict or record array, return a table description suitable for creating / checking tables."""
+        """Given a dict or record array, return a table description suitable for creating / checking tables.
+        
+        Columns holding numpy arrays (sub-array fields, or object fields containing
+        only arrays) are described as 'array blob', which stores them in binary
+        format (see SqliteDatabase).
+        """
         columns = collections.OrderedDict()
         if isinstance(data, list):  ## list of dicts is ok
             data = data[0]
@@ -673,16 +682,25 @@ class AnalysisDatabase(SqliteDatabase):
                     if typ == 'O': ## check to see if this is a pointer to a string
                         allStr = 0
                         allHandle = 0
+                        allArray = 0
                         for i in range(len(data)):
                             val = data[i][name]
                             if val is None or isinstance(val, six.string_types):
                                 allStr += 1
                             elif val is None or isinstance(val, DataManager.FileHandle):
                                 allHandle += 1
+                            elif isinstance(val, np.ndarray):
+                                allArray += 1
                         if allStr == len(data):
                             typ = 'text'
                         elif allHandle == len(data):
                             typ = 'file'
+                        elif allArray > 0 and allArray + allStr == len(data):  ## (allStr counts None values)
+                            typ = 'array blob'
+                        else:
+                            typ = 'blob'
+                    elif data.dtype[i].subdtype is not None:  ## sub-array field; one array per record
+                        typ = 'array blob'
                     else:
                         typ = 'blob'
                 columns[name] = typ
@@ -696,6 +714,8 @@ class AnalysisDatabase(SqliteDatabase):
                     typ = 'text'
                 elif isinstance(v, DataManager.FileHandle):
                     typ = 'file'
+                elif isinstance(v, np.ndarray):
+                    typ = 'array blob'
                 else:
                     typ = 'blob'
                 columns[name] = typ
@@ -707,7 +727,9 @@ class AnalysisDatabase(SqliteDatabase):
         """Extends select to convert directory/file columns back into Dir/FileHandles. If the file doesn't exist, you will still get a handle, but it may not be the correct type."""
         prof = debug.Profiler("AnalysisDatabase.select()", disabled=True)
         
-        data = SqliteDatabase.select(self, table, columns, where=where, sql=sql, distinct=distinct, limit=limit, offset=offset, toDict=True, toArray=False)
+        data = SqliteDatabase.select(self, table, columns, where=where, sql=sql, distinct=distinct, limit=limit, offset=offset, toDict=True, toArray=toArray)
+        if data is None:  ## empty array result
+            return None
         data = TableData(data)
         prof.mark("got data from SQliteDatabase")
         
@@ -719,11 +741,11 @@ class AnalysisDatabase(SqliteDatabase):
                 continue
             
             if conf.get('Type', '').startswith('directory'):
-                rids = set([d[column] for d in data])
+                rids = set(data[column])
                 linkTable = conf['Link']
                 handles = dict([(rid, self.getDir(linkTable, rid)) for rid in rids if rid is not None])
                 handles[None] = None
-                data[column] = list(map(handles.get, data[column]))
+                data[column] = self._handleColumn(list(map(handles.get, data[column])), toArray)
                     
             elif conf.get('Type', None) == 'file':
                 def getHandle(name):
@@ -736,17 +758,35 @@ class AnalysisDatabase(SqliteDatabase):
                             sep = '/'
                         name = name.replace(sep, os.sep) ## make sure file handles have an operating-system-appropriate separator (/ for Unix, \ for Windows)
                         return self.baseDir()[name]
-                data[column] = list(map(getHandle, data[column]))
+                data[column] = self._handleColumn(list(map(getHandle, data[column])), toArray)
                 
         prof.mark("converted file/dir handles")
                 
         ret = data.originalData()
-        if toArray:
-            ret = data.toArray()
-            prof.mark("converted data to array")
         prof.finish()
         return ret
     
+    def _handleColumn(self, handles, toArray):
+        ## return a list of handles as a column for list or array results
+        if not toArray:
+            return handles
+        ## (assigned one at a time so that numpy does not try to treat handles as sequences)
+        col = np.empty(len(handles), dtype=object)
+        for i, h in enumerate(handles):
+            col[i] = h
+        return col
+    
+    def _resultSchema(self, table):
+        ## directory/file columns are returned as object arrays since they will hold handles
+        schema = SqliteDatabase._resultSchema(self, table)
+        if schema is None:
+            return None
+        config = self.getColumnConfig(table)
+        for column, conf in config.items():
+            if column in schema and (conf.get('Type', '').startswith('directory') or conf.get('Type', None) == 'file'):
+                schema[column] = 'object'
+        return schema
+    
     def _prepareData(self, table, data, ignoreUnknownColumns=False, batch=False):
         """
         Extends SqliteDatabase._prepareData():
@@ -756,12 +796,30 @@ class AnalysisDatabase(SqliteDatabase):
         """
         #if batch is False:
             #raise Exception("AnalysisDatabase only implements batch mode.")
+        data = self._convertHandles(table, data)
+        return SqliteDatabase._prepareData(self, table, data, ignoreUnknownColumns, batch)
+        
+    def _prepareColumns(self, table, data, ignoreUnknownColumns=False):
+        """
+        Extends SqliteDatabase._prepareColumns() to convert Dir/FileHandles
+        (see _prepareData).
+        """
+        data = self._convertHandles(table, data)
+        return SqliteDatabase._prepareColumns(self, table, data, ignoreUnknownColumns)
+        
+    def _convertHandles(self, table, data):
+        ## Return a copy of data with Dir/FileHandles converted to their stored values
 
         #links = self.listTableLinks(table)
         config = self.getColumnConfig(table)
         
-        data = TableData(data).copy()  ## have to copy here since we might be changing some values
+        data = TableData(data)
         dataCols = set(data.columnNames())
+        handleCols = [k for k, conf in config.items() if k in dataCols and 
+                      (conf.get('Type', '').startswith('directory') or conf.get('Type', None) == 'file')]
+        if len(handleCols) == 0:
+            return data
+        data = data.copy()  ## have to copy here since we might be changing some values
         for colName, colConf in config.items():
             if colName not in dataCols:
                 continue
@@ -799,9 +857,7 @@ class AnalysisDatabase(SqliteDatabase):
                             raise
                 data[colName] = files
 
-        newData = SqliteDatabase._prepareData(self, table, data, ignoreUnknownColumns, batch)
-        
-        return newData
+        return data
         
         
         
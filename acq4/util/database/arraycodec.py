@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Binary encoding of numpy arrays for storage in BLOB columns.
+
+Arrays are stored as a short header (dtype, shape and flags) followed by the
+raw array data, optionally compressed with zlib. Unlike pickled arrays, the
+encoded data does not depend on the Python or numpy version, and encoding or
+decoding an uncompressed array costs little more than copying its data.
+
+Objects that are not plain numpy arrays (or arrays with object dtype) are
+pickled as before. Data written by older versions (pickled arrays) can still
+be decoded since the header can not be mistaken for a pickle.
+"""
+from __future__ import print_function
+import ast, pickle, struct, zlib
+import numpy as np
+
+## leading bytes of every encoded array. No pickle begins with a null byte.
+MAGIC = b'\x00NDA'
+VERSION = 1
+FLAG_ZLIB = 1
+
+## magic, version, flags, ndim, length of dtype string
+_header = struct.Struct('<4sBBBH')
+
+## cache of dtypes decoded from their string representation, and of
+## (dtype, shape, size) decoded from recently seen headers
+_dtypeCache = {}
+_headerCache = {}
+
+
+def canEncodeArray(obj):
+    """Return True if *obj* can be stored with encodeArray()."""
+    return type(obj) is np.ndarray and not obj.dtype.hasobject
+
+
+def encodeArray(arr, compress=False):
+    """Return bytes containing the dtype, shape and data of *arr*.
+
+    If *compress* is True, the data is compressed with zlib.
+    """
+    arr = _contiguous(arr)
+    return arrayHeader(arr.dtype, arr.shape, compress) + _encodeData(arr, compress)
+
+
+def encodeRows(arr, compress=False):
+    """Return a list containing encoded bytes for each row arr[i].
+
+    This is equivalent to [encodeArray(row) for row in arr], but the header is
+    only generated once.
+    """
+    arr = _contiguous(arr)
+    header = arrayHeader(arr.dtype, arr.shape[1:], compress)
+    return [header + _encodeData(row, compress) for row in arr]
+
+
+def arrayHeader(dtype, shape, compress=False):
+    """Return the header for an encoded array of the given dtype and shape."""
+    dtype = np.dtype(dtype)
+    if dtype.names is None and dtype.subdtype is None:
+        dtstr = dtype.str
+    else:
+        dtstr = repr(np.lib.format.dtype_to_descr(dtype))
+    dtstr = dtstr.encode('ascii')
+    flags = FLAG_ZLIB if compress else 0
+    return (_header.pack(MAGIC, VERSION, flags, len(shape), len(dtstr)) + dtstr +
+            struct.pack('<%dQ' % len(shape), *shape))
+
+
+def _contiguous(arr):
+    ## (np.ascontiguousarray converts 0-d arrays to 1-d)
+    if not arr.flags.c_contiguous:
+        arr = arr.copy(order='C')
+    return arr
+
+
+def _encodeData(arr, compress):
+    data = arr.tobytes()
+    if compress:
+        ## fast compression; waveform data compresses poorly at any level
+        data = zlib.compress(data, 1)
+    return data
+
+
+def isEncodedArray(data):
+    """Return True if *data* (bytes) was generated by encodeArray()."""
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decodeArray(data):
+    """Return the array encoded in *data* (bytes or buffer).
+    """
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    magic, version, flags, ndim, dtlen = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Data does not contain an encoded array.")
+    if version > VERSION:
+        raise ValueError("Array was encoded with a newer version (%d) of this format." % version)
+    offset = _header.size + dtlen + 8 * ndim
+    
+    ## arrays in the same column usually share the same header
+    header = data[:offset]
+    info = _headerCache.get(header, None)
+    if info is None:
+        dtype = _decodeDType(header[_header.size:_header.size+dtlen])
+        shape = struct.unpack_from('<%dQ' % ndim, header, _header.size+dtlen)
+        count = int(np.prod(shape)) if ndim > 0 else 1
+        info = (dtype, shape, count)
+        if len(_headerCache) < 1000:
+            _headerCache[header] = info
+    dtype, shape, count = info
+
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(data[offset:])
+        offset = 0
+    ## copy so that the array is writable and does not keep the query results alive
+    arr = np.frombuffer(data, dtype=dtype, count=count, offset=offset).copy()
+    return arr.reshape(shape)
+
+
+def _decodeDType(dtstr):
+    dtype = _dtypeCache.get(dtstr, None)
+    if dtype is None:
+        s = dtstr.decode('ascii')
+        if s.startswith('['):
+            descr = ast.literal_eval(s)
+            ## (descr_to_dtype is not available in older numpy versions)
+            dtype = getattr(np.lib.format, 'descr_to_dtype', np.dtype)(descr)
+        else:
+            dtype = np.dtype(s)
+        _dtypeCache[dtstr] = dtype
+    return dtype
+
+
+def encodeBlob(obj, compress=False):
+    """Return bytes representing *obj* for storage in a BLOB column.
+
+    Plain numpy arrays are stored with encodeArray(); all other objects are
+    pickled (and are not compressed).
+    """
+    if canEncodeArray(obj):
+        return encodeArray(obj, compress)
+    return pickle.dumps(obj)
+
+
+def decodeBlob(data):
+    """Return the object stored in *data* by encodeBlob() (or pickled by older versions).
+    """
+    if isEncodedArray(data):
+        return decodeArray(data)
+    return pickle.loads(bytes(data))
@@ -1,53 +1,142 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import numpy as np
-import pickle, re, os
+import pickle, re, os, threading, contextlib
 import acq4.Manager
 import collections
 import acq4.util.functions as functions
 import acq4.util.advancedTypes as advancedTypes
 import acq4.util.debug as debug
 from acq4.util import Qt
+from .arraycodec import encodeBlob, decodeBlob, encodeRows, canEncodeArray
 import six
 from six.moves import range
 import sqlite3
 
+if six.PY3:
+    ## BLOB values are bound as memoryview and returned as bytes
+    buffer = memoryview
+    blobTypes = (bytes, memoryview)
+else:
+    blobTypes = (buffer,)
+
 class SqliteDatabase:
     """Encapsulates an SQLITE database to add more features.
     Arbitrary SQL may be executed by calling the db object directly, eg: db('select * from table')
     Using the select() and insert() methods will do automatic type conversions and allows
     any picklable objects to be directly stored in BLOB type columns. (it is not necessarily
     safe to store pickled objects in TEXT columns)
+    Columns of type 'array blob' store numpy arrays in a binary format (dtype, shape and
+    raw data; see arraycodec) rather than pickled, and columns of type 'compressed blob'
+    store them compressed with zlib. Other objects in these columns are still pickled.
+    Versions of acq4 older than the binary format can not read arrays stored this way,
+    so plain 'blob' columns always use pickle.
+    
+    Each thread uses its own connection to the database file (see the db attribute), so
+    that the database may be read from worker threads while another thread is writing.
+    With walMode=True, file databases are switched to write-ahead-log mode, in which
+    readers never wait for writers. This setting is stored in the file, and WAL does not
+    work on network file systems, so it is disabled by default.
+    In-memory databases use a single connection that is shared by all threads; they
+    execute queries (and transactions) from one thread at a time.
     
     NOTE: Data types in SQLITE work differently than in most other DBs--each value may take any type
     regardless of the type specified by its column.
     """
-    def __init__(self, fileName=':memory:'):
+    
+    ## seconds to wait for another connection to release its lock before raising
+    ## "database is locked"
+    timeout = 30.0
+    
+    def __init__(self, fileName=':memory:', walMode=False):
         ## decide on an appropriate name for this connection.
         ## For file connections, the name should always be the name of the file
         ## to avoid opening more than one connection to the same file.
         if fileName != ':memory:':
             fileName = os.path.abspath(fileName)
         self._connectionName = fileName
-        self.db = sqlite3.connect(self._connectionName)
-        self.db.row_factory = sqlite3.Row
-        self.db.isolation_level = None
+        ## WAL requires shared memory, so it must be disabled for files on network drives
+        self._walMode = walMode and fileName != ':memory:'
+        self._poolLock = threading.Lock()
+        ## held while the shared connection to :memory: is in use (see _sharedConnection)
+        self._sharedLock = threading.RLock() if fileName == ':memory:' else None
+        self._connections = {}  ## {thread id: connection}
+        self._local = threading.local()
+        self._closed = False
         self.tables = None
-        self._transactions = []
         self._readTableList()
         
+    @property
+    def db(self):
+        """The sqlite3 connection used by the calling thread (or None if the database is closed).
+        """
+        conn = getattr(self._local, 'connection', None)
+        if conn is None and not self._closed:
+            conn = self._connect()
+        return conn
+        
+    @property
+    def _transactions(self):
+        ## stack of active transactions for the calling thread's connection
+        trans = getattr(self._local, 'transactions', None)
+        if trans is None:
+            trans = self._local.transactions = []
+        return trans
+        
+    def _connect(self):
+        ## open a new connection for the calling thread
+        with self._poolLock:
+            ident = threading.current_thread().ident
+            if self._connectionName == ':memory:' and len(self._connections) > 0:
+                ## every connection to :memory: would open a separate database
+                conn = list(self._connections.values())[0]
+            else:
+                ## statements are compiled once per connection and cached by their SQL string
+                conn = sqlite3.connect(self._connectionName, timeout=self.timeout, check_same_thread=False, cached_statements=256)
+                conn.row_factory = sqlite3.Row
+                conn.isolation_level = None  ## transactions are started explicitly (see transaction())
+                if self._walMode:
+                    try:
+                        conn.execute('PRAGMA journal_mode=WAL')
+                        conn.execute('PRAGMA synchronous=NORMAL')
+                    except sqlite3.OperationalError:
+                        debug.printExc("Could not enable write-ahead-log for %s:" % self._connectionName)
+                
+                ## close connections of threads that have exited
+                alive = set([t.ident for t in threading.enumerate()])
+                for tid in list(self._connections.keys()):
+                    if tid not in alive or tid == ident:
+                        self._connections.pop(tid).close()
+                self._connections[ident] = conn
+            self._local.connection = conn
+        return conn
+        
+    @contextlib.contextmanager
+    def _sharedConnection(self):
+        ## Serialize use of the connection for in-memory databases, which is shared by all threads.
+        if self._sharedLock is None:
+            yield
+        else:
+            with self._sharedLock:
+                yield
+        
     def close(self):
-        if self.db is None:
-            return
-        self.db.close()
-        self.db = None
+        """Close all connections to the database."""
+        with self._poolLock:
+            if self._closed:
+                return
+            self._closed = True
+            for conn in self._connections.values():
+                conn.close()
+            self._connections = {}
+        self._local = threading.local()
         
         ## no need to remove the connection entirely.
         #import gc
         #gc.collect()  ## try to convince python to clean up the db immediately so we can remove the connection
         #Qt.QSqlDatabase.removeDatabase(self._connectionName)
 
-    def exe(self, cmd, data=None, batch=False, toDict=True, toArray=False):
+    def exe(self, cmd, data=None, batch=False, toDict=True, toArray=False, params=None):
         """Execute an SQL query. If data is provided, it should be a list of dicts and each will 
         be bound to the query and executed sequentially. Returns the query object.
         Arguments:
@@ -59,12 +148,23 @@ class SqliteDatabase:
                       In this case, data must be provided as a dict-of-lists or record array.
             toDict  - If True, return a list-of-dicts representation of the query results
             toArray - If True, return a record array representation of the query results
+            params  - Optional sequence or dict of values to bind to the placeholders in
+                      cmd (for a single execution, when no data is given). Binding values
+                      rather than formatting them into the command allows the compiled
+                      statement to be reused.
         """
+        with self._sharedConnection():
+            return self._exe(cmd, data, batch, toDict, toArray, params)
+            
+    def _exe(self, cmd, data, batch, toDict, toArray, params):
         p = debug.Profiler('SqliteDatabase.exe', disabled=True)
         p.mark('Command: %s' % cmd)
         
         if data is None:
-            cur = self.db.execute(cmd)
+            if params is None:
+                cur = self.db.execute(cmd)
+            else:
+                cur = self.db.execute(cmd, params)
             p.mark("Executed with no data")
         else:
             data = TableData(data)
@@ -109,7 +209,8 @@ class SqliteDatabase:
         offset         (int) Omit a certain number of results from the beginning of the list
         sql            Optional string to be appended to the SQL query (will be inserted before limit/offset arguments)
         toDict         If True, return a list-of-dicts (this is the default)
-        toArray        if True, return a numpy record array
+        toArray        if True, return a numpy record array. The dtype of each column
+                       is determined by its type in the table schema.
         ============== ================================================================
         """
         p = debug.Profiler("SqliteDatabase.select", disabled=True)
@@ -126,14 +227,26 @@ class SqliteDatabase:
                 columns = ','.join(qf)
             #columns = quoteList(columns)
             
-        whereStr = self._buildWhereClause(where, table)
+        whereStr, params = self._buildWhereClause(where, table)
         distinct = "distinct" if (distinct is True) else ""
-        limit = ("limit %d" % limit) if (limit is not None) else ""
-        offset = ("offset %d" % offset) if (offset is not None) else ""
+        limitStr = offsetStr = ""
+        if limit is not None:
+            limitStr = "limit :_limit"
+            params['_limit'] = limit
+        if offset is not None:
+            offsetStr = "offset :_offset"
+            params['_offset'] = offset
         
-        cmd = "SELECT %s %s FROM %s %s %s %s %s" % (distinct, columns, table, whereStr, sql, limit, offset)
+        cmd = "SELECT %s %s FROM %s %s %s %s %s" % (distinct, columns, table, whereStr, sql, limitStr, offsetStr)
         p.mark("generated command")
-        q = self.exe(cmd, toDict=toDict, toArray=toArray)
+        if toArray:
+            ## use the table schema to determine the dtype of array columns
+            schema = self._resultSchema(table)
+            with self._sharedConnection():
+                cur = self.exe(cmd, toDict=False, params=params)
+                q = self._queryToArray(cur, schema)
+        else:
+            q = self.exe(cmd, toDict=toDict, params=params)
         p.finish()
         return q
         
@@ -201,30 +314,31 @@ class SqliteDatabase:
         ret = []
 
         with self.transaction():
-            ## Rememember that _prepareData may change the number of columns!
-            records = TableData(self._prepareData(table, records, ignoreUnknownColumns=ignoreExtraColumns, batch=True))
+            ## Data is converted one column at a time, then bound to a single
+            ## prepared statement for all records.
+            ## Rememember that _prepareColumns may change the number of columns!
+            columns = self._prepareColumns(table, records, ignoreUnknownColumns=ignoreExtraColumns)
             p.mark("prepared data")
 
-            columns = list(records.keys())
             insert = "INSERT"
             if replaceOnConflict:
                 insert += " OR REPLACE"
             #print "Insert:", columns
-            cmd = "%s INTO %s (%s) VALUES (%s)" % (insert, table, quoteList(columns), ','.join([':'+f for f in columns]))
+            cmd = "%s INTO %s (%s) VALUES (%s)" % (insert, table, quoteList(list(columns.keys())), ','.join(['?'] * len(columns)))
+            rows = list(zip(*columns.values()))
+            p.mark("built rows")
 
-            numRecs = len(records)
+            numRecs = len(rows)
             if chunkAll: ## insert all records in one go.
-                self.exe(cmd, records, batch=True)
+                self.db.executemany(cmd, rows)
                 yield (numRecs, numRecs)
                 return
 
             chunkSize = int(chunkSize) ## just make sure
             offset = 0
-            i = 0
-            while offset < len(records):
-                #print len(columns), len(records[0]), len(self.tableSchema(table))
-                chunk = records[offset:offset+chunkSize]
-                self.exe(cmd, chunk, batch=True)
+            while offset < numRecs:
+                chunk = rows[offset:offset+chunkSize]
+                self.db.executemany(cmd, chunk)
                 offset += len(chunk)
                 yield (offset, numRecs)
             p.mark("Transaction done")
@@ -233,9 +347,9 @@ class SqliteDatabase:
 
     def delete(self, table, where):
         with self.transaction():
-            whereStr = self._buildWhereClause(where, table)
+            whereStr, params = self._buildWhereClause(where, table)
             cmd = "DELETE FROM %s %s" % (table, whereStr)
-            return self(cmd)
+            return self(cmd, params=params)
 
     def update(self, table, vals, where=None, rowid=None, sql=''):
         """Update records in the DB.
@@ -250,10 +364,12 @@ class SqliteDatabase:
             where = {'rowid': rowid}
         
         with self.transaction():
-            whereStr = self._buildWhereClause(where, table)
+            whereStr, params = self._buildWhereClause(where, table)
             setStr = ', '.join(['"%s"=:%s' % (k, k) for k in vals])
             cmd = "UPDATE %s SET %s %s %s" % (table, setStr, whereStr, sql)
             data = self._prepareData(table, [vals], batch=True)
+            for k, v in params.items():
+                data[k] = [v]
             return self(cmd, data, batch=True)
 
     def transaction(self, name=None):
@@ -267,6 +383,11 @@ class SqliteDatabase:
         If an exception is raised while the transaction is active, all changes will be rolled back.
         Note that wrapping multiple database operations in a transaction can *greatly* increase
         performance.
+        
+        Transactions belong to the calling thread's connection. Only one thread may write
+        at a time; entering the outermost transaction waits (up to *timeout* seconds) until
+        other threads have committed their transactions. Readers in other threads see the
+        database as it was before the transaction until it is committed.
         """
         return Transaction(self, name)
         
@@ -343,26 +464,39 @@ class SqliteDatabase:
             self._readTableList()
         return self.tables[table].copy()  ## this is a case-insensitive operation
     
+    def _resultSchema(self, table):
+        ## return the {column: type} dict used to determine the dtype of results
+        ## selected from table, or None if table is not a known table or view
+        ## (eg. a join)
+        if not self.hasTable(table):
+            return None
+        return self.tableSchema(table)
+    
     def tableLength(self, table):
         return self('select count(*) from "%s"' % table)[0]['count(*)']
     
     def _buildWhereClause(self, where, table):
+        ## Return the WHERE clause and a dict of the values to bind to its placeholders.
+        ## (the same command is generated for different values, so its compiled
+        ## statement is reused)
         if where is None or len(where) == 0:
-            return ''
+            return '', {}
             
         where = self._prepareData(table, where)[0]
         conds = []
-        for k,v in where.items():
-            if isinstance(v, six.string_types):
-                conds.append('"%s"=\'%s\'' % (k, v))
+        params = {}
+        for i, (k,v) in enumerate(where.items()):
+            if v is None:
+                conds.append('"%s" IS NULL' % k)
             else:
-                conds.append('"%s"=%s' % (k,v))
+                conds.append('"%s"=:_where%d' % (k, i))
+                params['_where%d' % i] = v
         whereStr = "WHERE " + " AND ".join(conds)
-        return whereStr
+        return whereStr, params
     
     def _prepareData(self, table, data, ignoreUnknownColumns=False, batch=False):
         ## Massage data so it is ready for insert into the DB. (internal use only)
-        ##   - data destined for BLOB columns is pickled
+        ##   - data destined for BLOB columns is pickled (or encoded, for arrays in 'array blob' columns)
         ##   - numerical columns convert to int or float
         ##   - text columns convert to unicode
         ## converters may be a dict of {'columnName': function} 
@@ -376,20 +510,7 @@ class SqliteDatabase:
         ## determine the conversion functions to use for each column.
         schema = self.tableSchema(table)
         for k in schema:
-            if k in converters:
-                continue
-            
-            typ = schema[k].lower()
-            if typ == 'blob':
-                converters[k] = lambda obj: buffer(pickle.dumps(obj))
-            elif typ == 'int':
-                converters[k] = int
-            elif typ == 'real':
-                converters[k] = float
-            elif typ == 'text':
-                converters[k] = str
-            else:
-                converters[k] = lambda obj: obj
+            converters[k] = self._converter(schema[k])
                 
         if batch:
             newData = dict([(k,[]) for k in data.columnNames() if not (ignoreUnknownColumns and (k not in schema))])
@@ -424,42 +545,199 @@ class SqliteDatabase:
         #print "new data:", newData
         return newData
 
+    def _converter(self, typ):
+        ## return the function that converts values for storage in a column of type typ
+        typ = typ.lower()
+        if typ == 'blob':
+            return lambda obj: buffer(pickle.dumps(obj))
+        elif typ == 'array blob':
+            return lambda obj: buffer(encodeBlob(obj))
+        elif typ == 'compressed blob':
+            return lambda obj: buffer(encodeBlob(obj, compress=True))
+        elif typ == 'int':
+            return int
+        elif typ == 'real':
+            return float
+        elif typ == 'text':
+            return str
+        else:
+            return lambda obj: obj
+
+    def _prepareColumns(self, table, data, ignoreUnknownColumns=False):
+        """Convert data for insertion into table, one column at a time (internal use only).
+        
+        Performs the same conversions as _prepareData, but numerical array columns
+        are converted in a single step rather than value by value.
+        Returns an OrderedDict of {columnName: list of values}.
+        """
+        data = TableData(data)
+        schema = self.tableSchema(table)
+        columns = collections.OrderedDict()
+        for k in data.columnNames():
+            values = data[k]
+            if k not in schema:
+                if ignoreUnknownColumns:
+                    continue
+                if k.lower() != 'rowid':
+                    raise Exception("Column '%s' not present in table '%s'" % (k, table))
+                columns[k] = values.tolist() if isinstance(values, np.ndarray) else list(values)
+                continue
+            columns[k] = self._convertColumn(table, k, schema[k], values)
+        return columns
+        
+    def _convertColumn(self, table, name, typ, values):
+        ## convert a list or array of values for storage in column *name*
+        typ = typ.lower()
+        if isinstance(values, np.ndarray) and values.ndim == 1 and values.dtype.kind in 'biuf':
+            try:
+                if typ == 'int':
+                    if values.dtype.kind == 'f' and not np.all(np.isfinite(values)):
+                        raise ValueError("non-finite values")
+                    return values.astype(np.int64).tolist()
+                elif typ == 'real':
+                    return values.astype(float).tolist()
+                elif typ not in ('blob', 'array blob', 'compressed blob', 'text'):
+                    return values.tolist()
+            except (ValueError, TypeError, OverflowError):
+                pass  ## fall back to converting each value below
+        
+        if typ in ('array blob', 'compressed blob') and isinstance(values, np.ndarray) and values.ndim > 1 and canEncodeArray(values):
+            ## one array per record (eg. from a record array with sub-array fields)
+            return [buffer(v) for v in encodeRows(values, compress=(typ == 'compressed blob'))]
+        
+        conv = self._converter(typ)
+        try:
+            return [None if v is None else conv(v) for v in values]
+        except Exception:
+            pass
+        
+        ## Some values could not be converted; store these unchanged
+        newValues = []
+        for v in values:
+            if v is None:
+                newValues.append(None)
+                continue
+            try:
+                newValues.append(conv(v))
+            except:
+                newValues.append(v)
+                print("Warning: Setting %s column %s.%s with type %s" % (typ, table, name, str(type(v))))
+        return newValues
+
     def _queryToDict(self, q):
         prof = debug.Profiler("_queryToDict", disabled=True)
+        names = self._resultNames(q)
         res = []
-        for rec in q:
-            res.append(self._readRecord(rec))
+        for rows in self._fetchRows(q):
+            for row in rows:
+                res.append(self._readRecord(row, names))
         return res
 
-    def _queryToArray(self, q):
+    def _queryToArray(self, q, schema=None):
+        """Return the results of query q as a structured array, or None if the 
+        query returned no records.
+        
+        Records are fetched in batches and converted to numpy arrays one column
+        at a time. The dtype of each column is determined by its type in *schema*
+        (a dict of {columnName: type}, usually from tableSchema()) or, for
+        columns that are not in the schema, from the values returned:
+        
+          - int columns become int64 and real columns float64 (NULL values are
+            returned as NaN in real columns)
+          - text and blob columns, and columns whose values do not fit the
+            numerical types (including int columns containing NULL), are
+            returned as object arrays. Values from BLOB columns are decoded.
+        """
         prof = debug.Profiler("_queryToArray", disabled=True)
-        recs = self._queryToDict(q)
-        prof.mark("got records")
-        if len(recs) < 1:
+        names = self._resultNames(q)
+        if schema is None:
+            schema = {}
+        dtypes = [self._columnDType(schema.get(name, None)) for name in names]
+        
+        parts = [[] for name in names]
+        nRecs = 0
+        for rows in self._fetchRows(q):
+            for i, values in enumerate(zip(*rows)):
+                parts[i].append(self._columnToArray(values, dtypes[i]))
+            nRecs += len(rows)
+        prof.mark("fetched records")
+        if nRecs == 0:
             #return np.array([])  ## need to return empty array *with correct columns*, but this is very difficult, so just return None
             return None
-        rec1 = recs[0]
-        dtype = functions.suggestRecordDType(rec1, singleRecord=True)
-        #print rec1, dtype
-        arr = np.empty(len(recs), dtype=dtype)
-        arr[0] = tuple(rec1.values())
-        for i in range(1, len(recs)):
-            arr[i] = tuple(recs[i].values())
+        
+        ## duplicate column names (eg. 'select rowid, * ...') keep their first position and last value
+        columns = collections.OrderedDict()
+        for name, colParts in zip(names, parts):
+            columns[name] = colParts[0] if len(colParts) == 1 else np.concatenate(colParts)
+        arr = np.empty(nRecs, dtype=[(str(name), col.dtype) for name, col in columns.items()])
+        for name, col in columns.items():
+            arr[str(name)] = col
         prof.mark('converted to array')
         prof.finish()
         return arr
 
-    def _readRecord(self, rec):
+    def _resultNames(self, q):
+        ## return the column names of query results
+        if q.description is None:
+            return []
+        return [d[0] for d in q.description]
+
+    def _fetchRows(self, q, batchSize=10000):
+        ## generate lists of (up to batchSize) records as tuples from query q
+        q.row_factory = None
+        while True:
+            rows = q.fetchmany(batchSize)
+            if len(rows) == 0:
+                break
+            yield rows
+
+    def _columnDType(self, typ):
+        ## return the dtype used for query results from a column of type typ
+        ## (or None if the dtype should be determined from the values)
+        typ = '' if typ is None else typ.lower()
+        if typ in ('int', 'integer'):
+            return np.int64
+        elif typ in ('real', 'float', 'double'):
+            return np.float64
+        elif typ in ('text', 'blob', 'array blob', 'compressed blob', 'object'):
+            return object
+        else:
+            return None
+
+    def _columnToArray(self, values, dtype):
+        ## convert a sequence of values from a query to an array. 
+        ## Values that do not fit dtype are returned in an object array,
+        ## with BLOB values decoded.
+        if dtype is not object:
+            try:
+                if dtype is np.float64:
+                    arr = np.array(values, dtype=dtype)
+                else:
+                    ## let numpy decide so that int columns containing other values are not truncated
+                    arr = np.array(values)
+                if arr.ndim == 1 and (arr.dtype.kind == 'f' or (arr.dtype.kind == 'i' and dtype is not np.float64)):
+                    return arr
+            except (TypeError, ValueError, OverflowError):
+                pass
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+        for i, val in enumerate(values):
+            if isinstance(val, blobTypes):
+                arr[i] = decodeBlob(val)
+        return arr
+
+    def _readRecord(self, rec, names=None):
         prof = debug.Profiler("_readRecord", disabled=True)
+        if names is None:
+            names = list(rec.keys())
         data = collections.OrderedDict()
-        names = list(rec.keys())
         for i in range(len(rec)):
             val = rec[i]
             name = names[i]
-            ## Unpickle byte arrays into their original objects.
-            ## (Hopefully they were stored as pickled data in the first place!)
-            if isinstance(val, buffer):
-                val = pickle.loads(str(val))
+            ## Decode byte arrays into their original objects.
+            ## (Hopefully they were stored as pickled data or encoded arrays in the first place!)
+            if isinstance(val, blobTypes):
+                val = decodeBlob(val)
             data[name] = val
         prof.finish()
         return data
@@ -497,25 +775,57 @@ class Transaction:
         self.name = name
         
     def __enter__(self):
+        ## an in-memory database is used by only one thread until its transaction ends
+        self.shared = self.db._sharedConnection()
+        self.shared.__enter__()
+        try:
+            self._begin()
+        except:
+            self.shared.__exit__(None, None, None)
+            raise
+
+    def _begin(self):
+        trans = self.db._transactions
         if self.name is None:
-            self.name = 'transaction%d' % len(self.db._transactions)
-        self.db('SAVEPOINT %s' % self.name)
-        self.db._transactions.append(self)
+            self.name = 'transaction%d' % len(trans)
+        self.outermost = len(trans) == 0
+        if self.outermost:
+            ## Take the write lock immediately; if another connection is writing, this
+            ## waits for it to finish. (otherwise the transaction could fail with
+            ## "database is locked" at its first write, after it has read data)
+            self.db('BEGIN IMMEDIATE')
+        else:
+            self.db('SAVEPOINT %s' % self.name)
+        trans.append(self)
 
     def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._end(exc_type)
+        finally:
+            self.shared.__exit__(None, None, None)
+
+    def _end(self, exc_type):
         if exc_type is None:
-            self.db('RELEASE SAVEPOINT %s' % self.name)
+            if self.outermost:
+                self.db('COMMIT')
+            else:
+                self.db('RELEASE SAVEPOINT %s' % self.name)
         else:
             try:
-                self.db('ROLLBACK TRANSACTION TO %s' % self.name)
+                if self.outermost:
+                    self.db('ROLLBACK')
+                else:
+                    self.db('ROLLBACK TRANSACTION TO %s' % self.name)
+                    self.db('RELEASE SAVEPOINT %s' % self.name)
                 self.db.tables = None  ## make sure we are forced to re-read the table list after the rollback.
             except Exception:
                 print("WARNING: Error occurred during transaction and rollback failed.")
                 
-        if self.db._transactions[-1] is not self:
-            print(self, self.db._transactions)
+        trans = self.db._transactions
+        if trans[-1] is not self:
+            print(self, trans)
             raise Exception('Tried to exit transaction before another nested transaction has finished.')
-        self.db._transactions.pop(-1)
+        trans.pop(-1)
 
 
 class TableData:
@@ -561,6 +871,14 @@ class TableData:
             setattr(self, fn, getattr(self, '_TableData'+fn+self.mode))
         self.copy = getattr(self, 'copy_' + self.mode)
         
+    ## (special methods are looked up on the class, so the mode-specific
+    ## methods assigned in __init__ are not used for indexing on python 3)
+    def __getitem__(self, arg):
+        return getattr(self, '_TableData__getitem__' + self.mode)(arg)
+        
+    def __setitem__(self, arg, val):
+        return getattr(self, '_TableData__setitem__' + self.mode)(arg, val)
+        
     def originalData(self):
         return self.data
     
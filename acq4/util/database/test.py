@@ -84,3 +84,208 @@ def testBatchInsert():
     
     for i, row in enumerate(db.iterSelect('t', limit=1)):
         assert tuple(row[0].values()) == tuple(data[i])
+    
+    
+def testColumnConversion():
+    """Check that columns are converted the same way for array and list input
+    """
+    db = SqliteDatabase()
+    db("create table 't' ('int' int, 'real' real, 'text' text)")
+    
+    data = np.array([(1.7, 2, 'a'), (3.2, 4, 'b')], dtype=[('int', float), ('real', int), ('text', 'U1')])
+    db.insert('t', data)
+    db.insert('t', {'int': [1.7, 3.2], 'real': [2, 4], 'text': ['a', 'b']})
+    
+    result = db.select('t')
+    assert len(result) == 4
+    for rec in result:
+        assert type(rec['int']) is int and type(rec['real']) is float
+    assert [tuple(r.values()) for r in result] == [(1, 2.0, u'a'), (3, 4.0, u'b')] * 2
+    
+    ## values that can not be converted are stored unchanged
+    db('delete from t')
+    db.insert('t', {'int': np.array([1.0, np.nan]), 'real': np.array([1, 2]), 'text': ['a', None]})
+    result = db.select('t')
+    assert result[0]['int'] == 1 and result[1]['int'] is None
+    assert result[1]['text'] is None
+    
+    
+def testArrayQuery():
+    """Check dtypes and BLOB decoding of array query results
+    """
+    db = SqliteDatabase()
+    db("create table 't' ('int' int, 'real' real, 'text' text, 'obj' blob, 'intNull' int)")
+    db.insert('t', {'int': [1, 2], 'real': [0.5, None], 'text': ['a', 'bc'], 'obj': [{'x': 1}, [1, 2]], 'intNull': [1, None]})
+    
+    arr = db.select('t', toArray=True)
+    assert arr.dtype.names == ('int', 'real', 'text', 'obj', 'intNull')
+    assert arr['int'].dtype == np.int64 and arr['real'].dtype == np.float64
+    assert np.isnan(arr['real'][1])
+    assert arr['text'].dtype == object and list(arr['intNull']) == [1, None]
+    assert arr[0]['obj'] == {'x': 1} and arr['obj'][1] == [1, 2]
+    
+    ## BLOB values are decoded however the array is used
+    arr = db.select('t', toArray=True)
+    assert type(arr) is np.ndarray
+    assert list(np.concatenate([arr, arr])['obj']) == [{'x': 1}, [1, 2]] * 2
+    assert np.asarray(arr)['obj'][0] == {'x': 1}
+    assert arr.tolist()[1][3] == [1, 2]
+    
+    assert db.select('t', where={'int': 3}, toArray=True) is None
+    
+    
+def testArrayBlobs():
+    """Check that arrays are stored in binary format and read back unchanged
+    """
+    import pickle
+    from acq4.util.database.arraycodec import isEncodedArray
+    db = SqliteDatabase()
+    db("create table 't' ('blob' blob, 'ablob' array blob, 'zblob' compressed blob)")
+    
+    arrays = [
+        np.arange(10.),
+        np.arange(12, dtype='>i2').reshape(3, 4)[:, ::2],
+        np.zeros(3, dtype=[('x', 'f4'), ('y', 'i8', (2,))]),
+        np.array(2.5),
+        np.array([1, None]),  ## object arrays are pickled
+    ]
+    for arr in arrays:
+        db('delete from t')
+        db.insert('t', blob=arr, ablob=arr, zblob=arr)
+        raw = db('select * from t', toDict=False).fetchone()
+        ## plain blob columns stay readable by older versions
+        assert not isEncodedArray(raw['blob'])
+        assert isEncodedArray(raw['ablob']) == (arr.dtype != object)
+        for rec in (db.select('t')[0], db.select('t', toArray=True)[0]):
+            for col in ('blob', 'ablob', 'zblob'):
+                assert rec[col].shape == arr.shape and np.all(rec[col] == arr)
+            ## (pickle does not always preserve byte order)
+            assert rec['ablob'].dtype == arr.dtype and rec['zblob'].dtype == arr.dtype
+    
+    ## one array per record from a sub-array field
+    db('delete from t')
+    data = np.zeros(4, dtype=[('blob', float, (5,)), ('ablob', float, (5,)), ('zblob', 'u2', (2, 3))])
+    data['blob'] = np.random.normal(size=(4, 5))
+    data['ablob'] = data['blob']
+    db.insert('t', data)
+    raw = db('select * from t', toDict=False).fetchone()
+    assert not isEncodedArray(raw['blob']) and isEncodedArray(raw['ablob'])
+    result = db.select('t', toArray=True)
+    assert np.all(np.vstack(result['blob']) == data['blob'])
+    assert np.all(np.vstack(result['ablob']) == data['ablob'])
+    assert result['zblob'][3].shape == (2, 3)
+    
+    ## previously pickled arrays are still readable
+    db('delete from t')
+    db.db.execute('insert into t (ablob) values (?)', (pickle.dumps(np.arange(3)),))
+    assert np.all(db.select('t')[0]['ablob'] == np.arange(3))
+    
+    
+def testAnalysisDatabaseArrays():
+    """Check that AnalysisDatabase tables store event waveforms and fits in binary format
+    """
+    import tempfile, shutil
+    import acq4.util.DataManager as DataManager
+    from acq4.util.database.AnalysisDatabase import AnalysisDatabase
+    from acq4.util.database.arraycodec import isEncodedArray
+    tmp = tempfile.mkdtemp()
+    try:
+        db = AnalysisDatabase(os.path.join(tmp, 'test.db'), None, baseDir=DataManager.getDirHandle(tmp))
+        data = np.zeros(4, dtype=[('time', float), ('waveform', 'f4', (50,)), ('fit', object), ('note', object)])
+        data['waveform'] = np.random.normal(size=(4, 50))
+        data['fit'] = [np.arange(3.) * i for i in range(4)]
+        data['note'] = [None, 'x', {'a': 1}, None]
+        columns = db.describeData(data)
+        assert columns == {'time': 'real', 'waveform': 'array blob', 'fit': 'array blob', 'note': 'blob'}
+        assert db.describeData({'fit': np.arange(3.)})['fit'] == 'array blob'
+        
+        db.checkTable('events', 'test', columns, create=True)
+        db.insert('events', data)
+        raw = db('select * from events', toDict=False).fetchone()
+        assert isEncodedArray(raw['waveform']) and isEncodedArray(raw['fit'])
+        result = db.select('events', toArray=True)
+        assert np.all(np.vstack(result['waveform']) == data['waveform'])
+        assert result['fit'][3].dtype == float and np.all(result['fit'][3] == data['fit'][3])
+        assert result['note'][2] == {'a': 1}
+        
+        ## tables created with plain blob columns are still accepted (and stay pickled)
+        columns['waveform'] = 'blob'
+        db.checkTable('oldEvents', 'test', columns, create=True)
+        db.checkTable('oldEvents', 'test', db.describeData(data))
+        db.insert('oldEvents', data)
+        raw = db('select * from oldEvents', toDict=False).fetchone()
+        assert not isEncodedArray(raw['waveform'])
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
+    
+    
+def testConcurrentAccess():
+    """Check that other threads can read while a write transaction is open
+    """
+    import tempfile, shutil, threading
+    path = tempfile.mkdtemp()
+    try:
+        ## write-ahead log is only used when requested, since it is stored in the file
+        db = SqliteDatabase(os.path.join(path, 'default.sqlite'))
+        assert db('PRAGMA journal_mode')[0]['journal_mode'] == 'delete'
+        db.close()
+        
+        db = SqliteDatabase(os.path.join(path, 'test.sqlite'), walMode=True)
+        assert db('PRAGMA journal_mode')[0]['journal_mode'] == 'wal'
+        db("create table 't' ('x' int)")
+        db.insert('t', x=1)
+        
+        started = threading.Event()
+        finish = threading.Event()
+        def write():
+            with db.transaction():
+                db.insert('t', x=2)
+                started.set()
+                finish.wait(5)
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            assert started.wait(5)
+            ## uncommitted changes are not visible to other connections, and reading does not wait for the writer
+            assert [r['x'] for r in db.select('t')] == [1]
+        finally:
+            finish.set()
+            thread.join()
+        assert [r['x'] for r in db.select('t')] == [1, 2]
+        
+        ## writes wait for the other thread's transaction rather than failing
+        started.clear()
+        finish.clear()
+        thread = threading.Thread(target=write)
+        thread.start()
+        assert started.wait(5)
+        threading.Timer(0.2, finish.set).start()
+        db.insert('t', x=3)
+        thread.join()
+        assert sorted([r['x'] for r in db.select('t')]) == [1, 2, 2, 3]
+        db.close()
+    finally:
+        shutil.rmtree(path)
+
+    
+def testSharedMemoryConnection():
+    """Check that threads wait for each other's transactions in an in-memory database
+    """
+    import threading, time
+    db = SqliteDatabase()
+    db("create table 't' ('x' int)")
+    started = threading.Event()
+    def write():
+        with db.transaction():
+            db.insert('t', x=1)
+            started.set()
+            time.sleep(0.2)
+            db.insert('t', x=2)
+    thread = threading.Thread(target=write)
+    thread.start()
+    assert started.wait(5)
+    ## waits for the other thread's transaction instead of joining it
+    db.insert('t', x=3)
+    thread.join()
+    assert [r['x'] for r in db.select('t')] == [1, 2, 3]
@@ -1431,6 +1431,67 @@ def stdevThresholdEvents(data, threshold=3.0):
         events['peak'][i] = peak
     return events
 
+def _reduceSegments(ufunc, data, starts, stops, dtype=None):
+    """Return ufunc.reduce(data[starts[i]:stops[i]]) for every segment i.
+    
+    Segments may overlap or be unordered, but each must contain at least one sample.
+    All segments are reduced with a single call to ufunc.reduceat.
+    """
+    n = len(data)
+    out = np.empty(len(starts), dtype=dtype or data.dtype)
+    ## reduceat only accepts indexes < len(data); segments that reach the end
+    ## of the data are reduced individually.
+    atEnd = stops >= n
+    inner = ~atEnd
+    if inner.any():
+        ind = np.empty(inner.sum() * 2, dtype=np.intp)
+        ind[0::2] = starts[inner]
+        ind[1::2] = stops[inner]
+        if ind[-1] == n:
+            ind = ind[:-1]
+        out[inner] = ufunc.reduceat(data, ind, dtype=dtype)[0::2]
+    for i in np.argwhere(atEnd)[:, 0]:
+        out[i] = ufunc.reduce(data[starts[i]:], dtype=dtype)
+    return out
+
+
+def _argSegments(data, starts, stops, values):
+    """Return the index (relative to starts[i]) of the first sample in each segment
+    data[starts[i]:stops[i]] that is equal to values[i].
+    
+    With values computed by _reduceSegments(np.maximum, ...) this is the argmax
+    of each segment. Each value must occur in its segment.
+    """
+    lengths = stops - starts
+    offsets = np.empty(len(lengths), dtype=np.intp)
+    offsets[0] = 0
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    ## indexes into data of all samples of all segments, concatenated
+    ind = np.arange(lengths.sum(), dtype=np.intp) + np.repeat(starts - offsets, lengths)
+    values = np.repeat(values, lengths)
+    match = data[ind] == values
+    if values.dtype.kind == 'f':
+        ## like argmax, select the first NaN in segments that contain NaN
+        match |= np.isnan(values) & np.isnan(data[ind])
+    match = np.flatnonzero(match)
+    return match[np.searchsorted(match, offsets)] - offsets
+
+
+def _measureSegments(data, starts, stops):
+    """For each segment data[starts[i]:stops[i]], return the sum, the peak (the
+    max if the sum is positive, otherwise the min) and the index of the peak
+    relative to starts[i].
+    """
+    if len(starts) == 0:
+        return np.empty(0), np.empty(0, dtype=data.dtype), np.empty(0, dtype=np.intp)
+    sums = _reduceSegments(np.add, data, starts, stops, dtype=np.float64)
+    maxs = _reduceSegments(np.maximum, data, starts, stops)
+    mins = _reduceSegments(np.minimum, data, starts, stops)
+    peaks = np.where(sums > 0, maxs, mins)
+    peakInds = _argSegments(data, starts, stops, peaks)
+    return sums, peaks, peakInds
+
+
 def findEvents(*args, **kargs):
     return zeroCrossingEvents(*args, **kargs)
 
@@ -1459,7 +1520,7 @@ def zeroCrossingEvents(data, minLength=3, minPeak=0.0, minSum=0.0, noiseThreshol
     
     ## find all 0 crossings
     mask = data1 > 0
-    diff = mask[1:] - mask[:-1]  ## mask is True every time the trace crosses 0 between i and i+1
+    diff = mask[1:] != mask[:-1]  ## mask is True every time the trace crosses 0 between i and i+1
     times1 = np.argwhere(diff)[:, 0]  ## index of each point immediately before crossing.
     
     times = np.empty(len(times1)+2, dtype=times1.dtype)  ## add first/last indexes to list of crossing times
@@ -1470,12 +1531,8 @@ def zeroCrossingEvents(data, minLength=3, minPeak=0.0, minSum=0.0, noiseThreshol
     
     ## select only events longer than minLength.
     ## We do this check early for performance--it eliminates the vast majority of events
-    longEvents = np.argwhere(times[1:] - times[:-1] > minLength)
-    if len(longEvents) < 1:
-        nEvents = 0
-    else:
-        longEvents = longEvents[:, 0]
-        nEvents = len(longEvents)
+    longEvents = np.argwhere(times[1:] - times[:-1] > minLength)[:, 0]
+    nEvents = len(longEvents)
     
     ## Measure sum of values within each region between crossings, combine into single array
     if xvals is None:
@@ -1483,25 +1540,26 @@ def zeroCrossingEvents(data, minLength=3, minPeak=0.0, minSum=0.0, noiseThreshol
     else:
         events = np.empty(nEvents, dtype=[('index',int),('time',float),('len', int),('sum', float),('peak', float)])  ### rows are [start, length, sum]
     #p.mark('empty %d -> %d'% (len(times), nEvents))
-    #n = 0
-    for i in range(nEvents):
-        t1 = times[longEvents[i]]+1
-        t2 = times[longEvents[i]+1]+1
-        events[i]['index'] = t1
-        events[i]['len'] = t2-t1
-        evData = data1[t1:t2]
-        events[i]['sum'] = evData.sum()
-        if events[i]['sum'] > 0:
-            peak = evData.max()
-        else:
-            peak = evData.min()
-        events[i]['peak'] = peak
+    
+    ## all regions are measured at once (see _measureSegments)
+    t1 = times[longEvents]+1
+    t2 = times[longEvents+1]+1
+    events['index'] = t1
+    events['len'] = t2-t1
+    t2 = np.minimum(t2, len(data1))  ## the last region ends one sample past the end of the data
+    nonEmpty = t2 > t1
+    events['sum'] = 0
+    events['peak'] = 0
+    if nonEmpty.any():
+        sums, peaks, peakInds = _measureSegments(data1, t1[nonEmpty], t2[nonEmpty])
+        events['sum'][nonEmpty] = sums
+        events['peak'][nonEmpty] = peaks
     #p.mark('generate event array')
     
     if xvals is not None:
         events['time'] = xvals[events['index']]
     
-    if noiseThreshold  > 0:
+    if noiseThreshold is not None and noiseThreshold > 0:
         ## Fit gaussian to peak in size histogram, use fit sigma as criteria for noise rejection
         stdev = measureNoise(data1)
         #p.mark('measureNoise')
@@ -1547,144 +1605,93 @@ def thresholdEvents(data, threshold, adjustTimes=True, baseline=0.0):
     
     ## find all threshold crossings
     masks = [(data1 > threshold).astype(np.byte), (data1 < -threshold).astype(np.byte)]
-    hits = []
+    onTimes = []
+    offTimes = []
     for mask in masks:
         diff = mask[1:] - mask[:-1]
-        onTimes = np.argwhere(diff==1)[:,0]+1
-        offTimes = np.argwhere(diff==-1)[:,0]+1
-        #print mask
-        #print diff
-        #print onTimes, offTimes
-        if len(onTimes) == 0 or len(offTimes) == 0:
+        on = np.argwhere(diff==1)[:,0]+1
+        off = np.argwhere(diff==-1)[:,0]+1
+        if len(on) == 0 or len(off) == 0:
             continue
-        if offTimes[0] < onTimes[0]:
-            offTimes = offTimes[1:]
-            if len(offTimes) == 0:
+        if off[0] < on[0]:
+            off = off[1:]
+            if len(off) == 0:
                 continue
-        if offTimes[-1] < onTimes[-1]:
-            onTimes = onTimes[:-1]
-        for i in range(len(onTimes)):
-            hits.append((onTimes[i], offTimes[i]))
-    
-    ## sort hits  ## NOTE: this can be sped up since we already know how to interleave the events..
-    hits.sort(lambda a,b: cmp(a[0], b[0]))
+        if off[-1] < on[-1]:
+            on = on[:-1]
+        onTimes.append(on)
+        offTimes.append(off)
+    
+    ## sort hits by start time
+    if len(onTimes) > 0:
+        t1 = np.concatenate(onTimes)
+        t2 = np.concatenate(offTimes)
+        order = np.argsort(t1, kind='mergesort')
+        t1 = t1[order]
+        t2 = t2[order]
+    else:
+        t1 = t2 = np.empty(0, dtype=np.intp)
     
-    nEvents = len(hits)
+    nEvents = len(t1)
     if xvals is None:
         events = np.empty(nEvents, dtype=[('index',int),('len', int),('sum', float),('peak', float),('peakIndex', int)])  ### rows are [start, length, sum]
     else:
         events = np.empty(nEvents, dtype=[('index',int),('time',float),('len', int),('sum', float),('peak', float),('peakIndex', int)])  ### rows are     
+    if nEvents == 0:
+        return events
 
-    mask = np.ones(nEvents, dtype=bool)
-    
-    ## Lots of work ahead:
-    ## 1) compute length, peak, sum for each event
-    ## 2) adjust event times if requested, then recompute parameters
-    for i in range(nEvents):
-        t1, t2 = hits[i]
-        ln = t2-t1
-        evData = data1[t1:t2]
-        sum = evData.sum()
-        if sum > 0:
-            #peak = evData.max()
-            #ind = argwhere(evData==peak)[0][0]+t1
-            peakInd = np.argmax(evData)
-        else:
-            #peak = evData.min()
-            #ind = argwhere(evData==peak)[0][0]+t1
-            peakInd = np.argmin(evData)
-        peak = evData[peakInd]
-        peakInd += t1
-            
-        #print "event %f: %d" % (xvals[t1], t1) 
-        if adjustTimes:  ## Move start and end times outward, estimating the zero-crossing point for the event
+    ## compute length, peak, sum for all events
+    ln = t2 - t1
+    sums, peaks, peakInds = _measureSegments(data1, t1, t2)
+    
+    if adjustTimes:  ## Move start and end times outward, estimating the zero-crossing point for each event
+        ## (note that the extrapolation is based on the position of the maximum, for positive and negative events)
+        maxs = _reduceSegments(np.maximum, data1, t1, t2)
+        mind = _argSegments(data1, t1, t2, maxs)
         
-            ## adjust t1 first
-            mind = np.argmax(evData)
-            pdiff = abs(peak - evData[0])
-            if pdiff == 0:
-                adj1 = 0
-            else:
-                adj1 = int(threshold * mind / pdiff)
-                adj1 = min(ln, adj1)
-            t1 -= adj1
-            #print "   adjust t1", adj1
-            
-            ## check for collisions with previous events
-            if i > 0:
-                #lt2 = events[i-1]['index'] + events[i-1]['len']
-                lt2 = hits[i-1][1]
-                if t1 < lt2:
-                    diff = lt2-t1   ## if events have collided, force them to compromise
-                    tot = adj1 + lastAdj
-                    if tot != 0:
-                        d1 = diff * float(lastAdj) / tot
-                        d2 = diff * float(adj1) / tot
-                        #events[i-1]['len'] -= (d1+1)
-                        hits[i-1] = (hits[i-1][0], hits[i-1][1]-(d1+1))
-                        t1 += d2
-                        #recompute[i-1] = True
-                        #print "  correct t1", d2, "  correct prev.", d1+1
-            #try:
-                #print "   correct t1", d2, "  correct prev.", d1+1
-            #except:
-                #pass
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ## adjust t1
+            pdiff = abs(peaks - data1[t1])
+            adj1 = np.where(pdiff == 0, 0, np.minimum(ln, threshold * mind / pdiff)).astype(int)
             
             ## adjust t2
-            mind = ln - mind
-            pdiff = abs(peak - evData[-1])
-            if pdiff == 0:
-                adj2 = 0
-            else:
-                adj2 = int(threshold * mind / pdiff)
-                adj2 = min(ln, adj2)
-            t2 += adj2
-            lastAdj = adj2
-            #print "  adjust t2", adj2
-            
-            #recompute[i] = True
-            
-        #starts.append(t1)
-        #stops.append(t2)
-        hits[i] = (t1, t2)
-        events[i]['peak'] = peak
-        #if index == 'peak':
-            #events[i]['index']=ind
-        #else:
-        events[i]['index'] = t1
-        events[i]['peakIndex'] = peakInd
-        events[i]['len'] = ln
-        events[i]['sum'] = sum
+            pdiff = abs(peaks - data1[t2-1])
+            adj2 = np.where(pdiff == 0, 0, np.minimum(ln, threshold * (ln - mind) / pdiff)).astype(int)
         
-    if adjustTimes:  ## go back and re-compute event parameters.
-        for i in range(nEvents):
-            t1, t2 = hits[i]
-            
-            ln = t2-t1
-            evData = data1[int(t1):int(t2)]
-            sum = evData.sum()
-            if len(evData) == 0:
-                mask[i] = False
-                continue
-            if sum > 0:
-                #peak = evData.max()
-                #ind = argwhere(evData==peak)[0][0]+t1
-                peakInd = np.argmax(evData)
-            else:
-                #peak = evData.min()
-                #ind = argwhere(evData==peak)[0][0]+t1
-                peakInd = np.argmin(evData)
-            peak = evData[peakInd]
-            peakInd += t1
-                
-            events[i]['peak'] = peak
-            #if index == 'peak':
-                #events[i]['index']=ind
-            #else:
-            events[i]['index'] = t1
-            events[i]['peakIndex'] = peakInd
-            events[i]['len'] = ln
-            events[i]['sum'] = sum
+        start = (t1 - adj1).astype(float)
+        stop = (t2 + adj2).astype(float)
+        
+        ## check for collisions with previous events; if events have collided, force them to compromise
+        diff = stop[:-1] - start[1:]
+        tot = adj1[1:] + adj2[:-1]
+        collide = np.argwhere((diff > 0) & (tot != 0))[:, 0]
+        d1 = diff[collide] * adj2[:-1][collide] / tot[collide]
+        d2 = diff[collide] * adj1[1:][collide] / tot[collide]
+        stop[collide] -= d1 + 1
+        start[collide+1] += d2
+        
+        ## go back and re-compute event parameters.
+        ## (events that were extended past the beginning of the data start at 0)
+        start = np.maximum(start, 0)
+        ln = np.trunc(stop - start).astype(int)
+        t1 = start.astype(int)
+        t2 = np.minimum(stop.astype(int), len(data1))
+        mask = t2 > t1
+        
+        sums = np.zeros(nEvents)
+        peaks = np.zeros(nEvents, dtype=data1.dtype)
+        peakInds = np.zeros(nEvents, dtype=np.intp)
+        sums[mask], peaks[mask], peakInds[mask] = _measureSegments(data1, t1[mask], t2[mask])
+        peakInds = (peakInds + start).astype(int)
+    else:
+        mask = np.ones(nEvents, dtype=bool)
+        peakInds += t1
+        
+    events['index'] = t1
+    events['peakIndex'] = peakInds
+    events['len'] = ln
+    events['sum'] = sums
+    events['peak'] = peaks
     
     ## remove masked events
     events = events[mask]
@@ -1692,9 +1699,6 @@ def thresholdEvents(data, threshold, adjustTimes=True, baseline=0.0):
     if xvals is not None:
         events['time'] = xvals[events['index']]
         
-    #for i in range(len(events)):
-        #print events[i]['time'], events[i]['peak']
-
     return events
 
     
@@ -1855,68 +1859,114 @@ def denoise(data, radius=2, threshold=4):
 
 
 def rollingSum(data, n):
-    d1 = data.copy()
-    d1[1:] += d1[:-1]  # integrate
-    d2 = np.empty(len(d1) - n + 1, dtype=data.dtype)
-    d2[0] = d1[n-1]  # copy first point
-    d2[1:] = d1[n:] - d1[:-n]  # subtract
+    """Return the sums of every *n* consecutive samples along the last axis of *data*."""
+    d1 = np.cumsum(data, axis=-1)  # integrate
+    d2 = np.empty(d1.shape[:-1] + (d1.shape[-1] - n + 1,), dtype=d1.dtype)
+    d2[..., 0] = d1[..., n-1]  # copy first point
+    d2[..., 1:] = d1[..., n:] - d1[..., :-n]  # subtract
     return d2
+
+
+def _fftCorrelate(data, template, blockSize=2**14):
+    """Return the 'valid' cross-correlation of *data* and *template* along the last axis:
+    
+        out[..., i] = sum(data[..., i:i+N] * template[..., :])
     
+    Leading dimensions of data and template are broadcast together. The correlation
+    is computed by FFT in blocks of *blockSize* samples (overlap-save), so the cost is
+    O(n log blockSize) and temporary arrays stay small for very long traces.
+    """
+    n = data.shape[-1]
+    N = template.shape[-1]
+    M = n - N + 1
+    ## a single FFT of the entire trace is fine if the trace is short; the circular
+    ## correlation does not wrap around for any of the first M points as long as nfft >= n
+    nfft = 2**int(np.ceil(np.log2(max(min(n, blockSize), 4*N))))
+    step = nfft - N + 1
+    fT = np.conj(np.fft.rfft(template, nfft))
+    out = np.empty(np.broadcast(data[..., :1], template[..., :1]).shape[:-1] + (M,))
+    for start in range(0, M, step):
+        seg = data[..., start:start+nfft]  # rfft pads the last block with zeros
+        corr = np.fft.irfft(np.fft.rfft(seg, nfft) * fT, nfft)
+        stop = min(start + step, M)
+        out[..., start:stop] = corr[..., :stop-start]
+    return out
+
 
 def clementsBekkers(data, template):
     """Implements Clements-bekkers algorithm: slides template across data,
     returns array of points indicating goodness of fit.
     Biophysical Journal, 73: 220-229, 1997.
+    
+    Returns (detection criterion, scale, offset) for every position of the template
+    in the data (len(data) - len(template) + 1 points).
+    
+    Either argument may also be a stack of traces or templates (the last axis is time);
+    leading dimensions are broadcast against each other. For example, data with shape
+    (nTraces, n) and template with shape (nTemplates, 1, N) give results with shape
+    (nTemplates, nTraces, n-N+1). The correlation of data and template is computed by
+    FFT, so the cost grows as n*log(n) regardless of the template length.
     """
     
     ## Strip out meta-data for faster computation
-    D = data.view(ndarray)
-    T = template.view(ndarray)
+    D = np.asarray(data.view(ndarray), dtype=np.float64)
+    T = np.asarray(template.view(ndarray), dtype=np.float64)
+    
+    ## Remove the mean of each trace. This only changes the offset of the fit, but
+    ## keeps the running sums precise in long recordings
+    mean = D.mean(axis=-1)[..., np.newaxis]
+    D = D - mean
     
     ## Prepare a bunch of arrays we'll need later
-    N = len(T)
-    sumT = T.sum()
-    sumT2 = (T**2).sum()
+    N = T.shape[-1]
+    sumT = T.sum(axis=-1)[..., np.newaxis]
+    sumT2 = (T**2).sum(axis=-1)[..., np.newaxis]
     sumD = rollingSum(D, N)
     sumD2 = rollingSum(D**2, N)
-    sumTD = correlate(D, T, mode='valid')
+    sumTD = _fftCorrelate(D, T)
     
     ## compute scale factor, offset at each location:
-    scale = (sumTD - sumT * sumD /N) / (sumT2 - sumT**2 /N)
-    offset = (sumD - scale * sumT) /N
+    covTD = sumTD - sumT * sumD / N
+    scale = covTD / (sumT2 - sumT**2 / N)
+    offset = (sumD - scale * sumT) / N
     
-    ## compute SSE at every location
-    SSE = sumD2 + scale**2 * sumT2 + N * offset**2 - 2 * (scale*sumTD + offset*sumD - scale*offset*sumT)
+    ## compute SSE at every location (the residual of the linear fit; clipped
+    ## since a near-perfect fit may come out slightly negative)
+    SSE = np.clip(sumD2 - sumD**2 / N - scale * covTD, 0, None)
     
     ## finally, compute error and detection criterion
-    error = sqrt(SSE / (N-1))
+    error = np.sqrt(SSE / (N-1))
     DC = scale / error
-    return DC, scale, offset
+    return DC, scale, offset + mean
     
 def cbTemplateMatch(data, template, threshold=3.0):
+    """Locate events in data by Clements-Bekkers template matching.
+    
+    Returns an array of (peak, dc, scale, offset) for every region where the detection
+    criterion exceeds *threshold*, where peak is the index at which the criterion
+    is largest within the region.
+    """
     dc, scale, offset = clementsBekkers(data, template)
-    mask = dc > threshold
+    mask = (dc > threshold).astype(np.byte)
     diff = mask[1:] - mask[:-1]
-    times = np.argwhere(diff==1)[:, 0]  ## every time we start OR stop a spike
+    starts = np.argwhere(diff == 1)[:, 0] + 1
+    stops = np.argwhere(diff == -1)[:, 0] + 1
     
     ## in the unlikely event that the very first or last point is matched, remove it
-    if abs(dc[0]) > threshold:
-        times = times[1:]
-    if abs(dc[-1]) > threshold:
-        times = times[:-1]
-    
-    nEvents = len(times) / 2
-    
-    result = np.empty(nEvents, dtype=[('peak', int), ('dc', float), ('scale', float), ('offset', float)])
-    for i in range(nEvents):
-        i1 = times[i*2]
-        i2 = times[(i*2)+1]
-        d = dc[i1:i2]
-        p = argmax(d)
-        result[0] = p+i1
-        result[1] = d[p]
-        result[2] = scale[p+i1]
-        result[3] = offset[p+i1]
+    if mask[0]:
+        stops = stops[1:]
+    if mask[-1]:
+        starts = starts[:-1]
+    
+    result = np.empty(len(starts), dtype=[('peak', int), ('dc', float), ('scale', float), ('offset', float)])
+    if len(starts) == 0:
+        return result
+    peaks = _reduceSegments(np.maximum, dc, starts, stops)
+    inds = starts + _argSegments(dc, starts, stops, peaks)
+    result['peak'] = inds
+    result['dc'] = peaks
+    result['scale'] = scale[inds]
+    result['offset'] = offset[inds]
     return result
 
 
@@ -8,3 +8,5 @@ from .contrast_ctrl import ContrastCtrl
 from .bg_subtract_ctrl import BgSubtractCtrl
 from .imaging_ctrl import ImagingCtrl
 from .frame import Frame
+from .frame_pool import FramePool
+from .level_estimator import LevelEstimator
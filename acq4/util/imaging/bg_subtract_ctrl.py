@@ -103,14 +103,33 @@ class BgSubtractCtrl(Qt.QWidget):
             self.backgroundFrame = x * self.backgroundFrame + (1-x) * img
         self.blurredBackgroundFrame = None
         
-    def processImage(self, data):
+    def backgroundMode(self):
+        """Return 'divide', 'subtract', or None if background subtraction is disabled.
+        """
         if self.ui.divideBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data / bg
+            return 'divide'
         elif self.ui.subtractBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data - bg
+            return 'subtract'
+        return None
+
+    def processImage(self, data):
+        mode = self.backgroundMode()
+        if mode is None:
+            return data
+        return self.removeBackground(data, mode, self.getBackgroundFrame())
+
+    @staticmethod
+    def removeBackground(data, mode, bg):
+        """Divide (mode='divide') or subtract (mode='subtract') the background
+        frame *bg* from *data*.
 
-        return data
+        This does not access the user interface, so it may be called from a
+        worker thread with the values of backgroundMode() and getBackgroundFrame().
+        """
+        if mode is None or bg is None or bg.shape != data.shape:
+            return data
+        if mode == 'divide':
+            return data / bg
+        elif mode == 'subtract':
+            return data - bg
+        raise ValueError("Unknown background subtraction mode %r" % mode)
@@ -4,6 +4,7 @@ from __future__ import division
 from acq4.util import Qt
 import numpy as np
 from .contrast_ctrl_template import Ui_Form
+from .level_estimator import LevelEstimator
 
 class ContrastCtrl(Qt.QWidget):
     """Widget for controlling contrast with rapidly updating image content.
@@ -27,6 +28,7 @@ class ContrastCtrl(Qt.QWidget):
         self.ignoreLevelChange = False
         self.alpha = 1.0
         self.lastAGCMax = None
+        self.levelEstimator = LevelEstimator()  ## see LevelEstimator.setAccuracy()
 
         ## Connect DisplayGain dock
         self.ui.histogram.sigLookupTableChanged.connect(self.levelsChanged)
@@ -79,47 +81,60 @@ class ContrastCtrl(Qt.QWidget):
         when a sudden change in the image values is expected.
         """
         self.lastMinMax = None
+        self.levelEstimator.reset()
+
+    def autoGainOptions(self):
+        """Return a dict of the current auto gain settings, or None if auto gain
+        is disabled.
+
+        The result may be passed to autoLevels() from another thread.
+        """
+        if not self.ui.btnAutoGain.isChecked():
+            return None
+        return {
+            'centerWeight': self.ui.spinAutoGainCenterWeight.value(),
+            'speed': self.ui.spinAutoGainSpeed.value(),
+        }
 
     def processImage(self, data):
         # Update auto gain for new image
         # Note that histogram is linked to image item; this is what determines
         # the final appearance of the image.
-
-        if self.ui.btnAutoGain.isChecked():
-            cw = self.ui.spinAutoGainCenterWeight.value()
-            (w, h) = data.shape
-            center = data[w//2-w//6:w//2+w//6, h//2-h//6:h//2+h//6]
-            minVal = data.min() * (1.0-cw) + center.min() * cw
-            maxVal = data.max() * (1.0-cw) + center.max() * cw
-
-            ## If there is inf/nan in the image, strip it out before computing min/max
-            if any([np.isnan(minVal), np.isinf(minVal),  np.isnan(minVal), np.isinf(minVal)]):
-                nanMask = np.isnan(data)
-                infMask = np.isinf(data)
-                valid = data[~nanMask * ~infMask]
-                minVal = valid.min() * (1.0-cw) + center.min() * cw
-                maxVal = valid.max() * (1.0-cw) + center.max() * cw
-            
-            ## Smooth min/max range to avoid noise
-            if self.lastMinMax is None:
-                minVal = minVal
-                maxVal = maxVal
-            else:
-                s = 1.0 - 1.0 / (self.ui.spinAutoGainSpeed.value()+1.0)
-                minVal = self.lastMinMax[0] * s + minVal * (1.0-s)
-                maxVal = self.lastMinMax[1] * s + maxVal * (1.0-s)
-            
-            self.lastMinMax = [minVal, maxVal]
-            
-            ## and convert fraction of previous range into new levels
-            bl = self.autoGainLevels[0] * (maxVal-minVal) + minVal
-            wl = self.autoGainLevels[1] * (maxVal-minVal) + minVal
-            
-            self.ignoreLevelChange = True
-            try:
-                self.ui.histogram.setLevels(bl, wl)
-                self.ui.histogram.setHistogramRange(minVal, maxVal, padding=0.05)
-            finally:
-                self.ignoreLevelChange = False
+        opts = self.autoGainOptions()
+        if opts is not None:
+            self.setAutoLevels(self.autoLevels(data, opts))
 
         self.imageItem.setOpacity(self.alpha)
+
+    def autoLevels(self, data, opts):
+        """Measure the range of *data* and return the (black, white) levels and
+        the (min, max) histogram range that auto gain should display.
+
+        *opts* is a dict as returned by autoGainOptions(). This method does not
+        access the user interface, so it may be called from a worker thread.
+        """
+        s = 1.0 - 1.0 / (opts['speed']+1.0)
+        minMax = self.levelEstimator.update(data, centerWeight=opts['centerWeight'], smoothing=s)
+        if minMax is None:
+            ## no finite values in the image; keep the previous levels
+            minMax = self.lastMinMax or (0.0, 1.0)
+        minVal, maxVal = minMax
+
+        self.lastMinMax = [minVal, maxVal]
+        
+        ## and convert fraction of previous range into new levels
+        bl = self.autoGainLevels[0] * (maxVal-minVal) + minVal
+        wl = self.autoGainLevels[1] * (maxVal-minVal) + minVal
+        return (bl, wl), (minVal, maxVal)
+
+    def setAutoLevels(self, levels):
+        """Display levels computed by autoLevels() in the histogram (and thus
+        apply them to the image item).
+        """
+        (bl, wl), (minVal, maxVal) = levels
+        self.ignoreLevelChange = True
+        try:
+            self.ui.histogram.setLevels(bl, wl)
+            self.ui.histogram.setHistogramRange(minVal, maxVal, padding=0.05)
+        finally:
+            self.ignoreLevelChange = False
@@ -1,6 +1,11 @@
 from __future__ import print_function
+import threading
+from collections import deque
+import numpy as np
 from acq4.util import Qt
 from acq4 import pyqtgraph as pg
+import acq4.pyqtgraph.functions as fn
+from acq4.util.Thread import Thread
 from .contrast_ctrl import ContrastCtrl
 from .bg_subtract_ctrl import BgSubtractCtrl
 from acq4.util.debug import printExc
@@ -14,6 +19,11 @@ class FrameDisplay(Qt.QObject):
     * frame rate limiting
     * contrast control widget
     * background subtraction control widget
+
+    Background subtraction, auto gain and conversion of the frame to a QImage
+    are done by a FrameProcessor worker thread. The GUI thread only collects
+    the settings from the control widgets and hands the finished image to the
+    ImageItem.
     """
     # Allow subclasses to override these:
     contrastClass = ContrastCtrl
@@ -21,7 +31,7 @@ class FrameDisplay(Qt.QObject):
 
     imageUpdated = Qt.Signal(object)  # emits frame when the image is redrawn
 
-    def __init__(self):
+    def __init__(self, maxFps=60):
         Qt.QObject.__init__(self)
 
         self._imageItem = pg.ImageItem()
@@ -30,25 +40,27 @@ class FrameDisplay(Qt.QObject):
         self.bgCtrl = self.bgSubtractClass()
         self.bgCtrl.needFrameUpdate.connect(self.updateFrame)
 
+        self.maxFps = maxFps
         self.nextFrame = None
         self._updateFrame = False
         self.currentFrame = None
         self.lastDrawTime = None
         self.displayFps = None
+        self.displayLatency = None  # time from newFrame() until the frame is handed to the ImageItem
         self.hasQuit = False
+        self._optionsChanged = True  # widget settings must be sent to the processor again
+
+        self.processor = FrameProcessor(self.contrastCtrl, self.bgCtrl)
+        self.processor.start()
 
-        ## Check for new frame updates every 16ms
-        ## Some checks may be skipped even if there is a new frame waiting to avoid drawing more than
-        ## 60fps.
+        ## Check for processed frames every 5ms; frames are drawn no faster
+        ## than maxFps.
         self.frameTimer = Qt.QTimer()
         self.frameTimer.timeout.connect(self.drawFrame)
-        self.frameTimer.start(30) ## draw frames no faster than 60Hz
+        self.frameTimer.start(5)
         #Qt.QTimer.singleShot(1, self.drawFrame)
         ## avoiding possible singleShot-induced crashes
 
-    def newFrame(self, frame):
-        self.currentFrame = frame
-
     def updateFrame(self):
         """Redisplay the current frame.
         """
@@ -78,79 +90,253 @@ class FrameDisplay(Qt.QObject):
         return self.currentFrame.getImage()
 
     def newFrame(self, frame):
-        # lf = None
-        # if self.nextFrame is not None:
-        #     lf = self.nextFrame
-        # elif self.currentFrame is not None:
-        #     lf = self.currentFrame
-        
-        ## self.nextFrame gets picked up by drawFrame() at some point
+        ## self.nextFrame gets picked up by the processor and then by drawFrame() at some point
         self.nextFrame = frame
-        
         self.bgCtrl.newFrame(frame)
+        ## collect settings at most once per timer tick, not for every camera frame
+        if self._optionsChanged:
+            self._optionsChanged = False
+            self.processor.setOptions(self.processingOptions(frame))
+        self.processor.newFrame(frame)
+
+    def processingOptions(self, frame):
+        """Collect the settings from the control widgets that are needed to
+        process *frame* for display.
+        """
+        item = self._imageItem
+        lut = item.lut
+        if callable(lut):
+            ## the lookup table depends only on the dtype of the image
+            lut = lut(np.empty((1, 1), dtype=frame.getImage().dtype))
+        bgMode = self.bgCtrl.backgroundMode()
+        return {
+            'bgMode': bgMode,
+            'background': None if bgMode is None else self.bgCtrl.getBackgroundFrame(),
+            'autoGain': self.contrastCtrl.autoGainOptions(),
+            'levels': self.contrastCtrl.getLevels(),
+            'lut': lut,
+            'axisOrder': item.axisOrder,
+            'render': not item.autoDownsample,
+        }
 
     def drawFrame(self):
         if self.hasQuit:
             return
-        #sys.stdout.write('+')
+        self._optionsChanged = True
         try:
-            
-            ## If we last drew a frame < 1/30s ago, return.
+            ## If we last drew a frame < 1/maxFps ago, return.
             t = pg.ptime.time()
-            if (self.lastDrawTime is not None) and (t - self.lastDrawTime < .03):
-                #sys.stdout.write('-')
+            if (self.lastDrawTime is not None) and (t - self.lastDrawTime < 1.0 / self.maxFps):
                 return
-            ## if there is no new frame and no controls have changed, just exit
-            if not self._updateFrame and self.nextFrame is None:
-                #sys.stdout.write('-')
-                return
-            self._updateFrame = False
-            
-            ## If there are no new frames and no previous frames, then there is nothing to draw.
-            if self.currentFrame is None and self.nextFrame is None:
-                #sys.stdout.write('-')
+
+            ## if controls have changed, reprocess the current frame with the new settings
+            if self._updateFrame:
+                self._updateFrame = False
+                frame = self.nextFrame if self.nextFrame is not None else self.currentFrame
+                if frame is not None:
+                    self.processor.setOptions(self.processingOptions(frame))
+                    self.processor.newFrame(frame)
+
+            result = self.processor.takeResult()
+            if result is None:
                 return
-            
+
             prof = pg.debug.Profiler()
             ## We will now draw a new frame (even if the frame is unchanged)
             if self.lastDrawTime is not None:
                 fps = 1.0 / (t - self.lastDrawTime)
                 self.displayFps = fps
             self.lastDrawTime = t
-            prof()
-            
-            ## Handle the next available frame, if there is one.
-            if self.nextFrame is not None:
-                self.currentFrame = self.nextFrame
+            self.currentFrame = result['frame']
+            if self.nextFrame is self.currentFrame:
                 self.nextFrame = None
-            
-            data = self.currentFrame.getImage()
-            info = self.currentFrame.info()
-            prof()
-            
-            
-            ## divide the background out of the current frame if needed
-            data = self.bgCtrl.processImage(data)
             prof()
-            
-            ## Set new levels if auto gain is enabled
-            self.contrastCtrl.processImage(data)
-            prof()
-            
-            ## update image in viewport
-            self._imageItem.updateImage(data.copy())  # using data.copy() here avoids crashes!
+
+            self.showResult(result)
             prof()
 
+            self.displayLatency = pg.ptime.time() - result['receivedTime']
             self.imageUpdated.emit(self.currentFrame)
             prof()
-            
+
             prof.finish()
-        
+
         except:
             printExc('Error while drawing new frames:')
         finally:
             pass
 
+    def showResult(self, result):
+        """Hand a frame prepared by FrameProcessor to the image item and
+        contrast controls.
+        """
+        item = self._imageItem
+        levels = result['levels']
+        if result['autoLevels'] is not None:
+            self.contrastCtrl.setAutoLevels(result['autoLevels'])
+        item.setImage(result['image'], autoLevels=False, levels=levels)
+        item.setOpacity(self.contrastCtrl.alpha)
+        ## Setting levels / histogram range above invalidates the item's
+        ## QImage; replace it with the one rendered by the processor so that
+        ## the item does not render the image again in the GUI thread.
+        if result['qimage'] is not None:
+            item.qimage = result['qimage']
+            item.update()
+
     def quit(self):
         self.imageItem = None
         self.hasQuit = True
+        self.frameTimer.stop()
+        self.processor.quit()
+        self.processor.wait()
+
+
+class FrameProcessor(Thread):
+    """Worker thread that prepares frames for display by FrameDisplay.
+
+    Only the most recent frame is kept; frames that arrive while the previous
+    frame is still being processed are skipped. For each frame, the background
+    is removed, auto gain levels are measured, and levels and lookup table are
+    applied to generate an ARGB QImage that the GUI thread can draw without
+    further processing.
+
+    Settings from the control widgets must be collected in the GUI thread and
+    passed in with setOptions() (see FrameDisplay.processingOptions).
+    """
+    def __init__(self, contrastCtrl, bgCtrl):
+        Thread.__init__(self)
+        self.contrastCtrl = contrastCtrl
+        self.bgCtrl = bgCtrl
+        self.cond = threading.Condition()
+        self.options = None
+        self.frame = None
+        self.receivedTime = None
+        self.result = None
+        self.stopThread = False
+
+        ## recent processing times, for performance monitoring
+        self.processTimes = deque(maxlen=100)
+
+        ## cache of the combined levels + LUT for integer images
+        self._effectiveLut = None
+        self._effectiveLutKey = None
+        self._effectiveLutSource = None
+
+    def setOptions(self, opts):
+        with self.cond:
+            self.options = opts
+
+    def newFrame(self, frame):
+        """Request that *frame* be processed, replacing any frame that is
+        still waiting.
+        """
+        with self.cond:
+            self.frame = frame
+            self.receivedTime = pg.ptime.time()
+            self.cond.notify()
+
+    def takeResult(self):
+        """Return the most recently processed frame (or None if no new frame
+        has been processed since the last call).
+
+        The result is a dict with keys 'frame', 'image', 'qimage', 'levels',
+        'autoLevels', and 'receivedTime'.
+        """
+        with self.cond:
+            result = self.result
+            self.result = None
+        return result
+
+    def quit(self):
+        with self.cond:
+            self.stopThread = True
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.frame is None and not self.stopThread:
+                    self.cond.wait()
+                if self.stopThread:
+                    break
+                frame = self.frame
+                opts = self.options
+                receivedTime = self.receivedTime
+                self.frame = None
+
+            try:
+                start = pg.ptime.time()
+                result = self.processFrame(frame, opts)
+                result['receivedTime'] = receivedTime
+                self.processTimes.append(pg.ptime.time() - start)
+            except:
+                printExc('Error while processing frame for display:')
+                continue
+
+            with self.cond:
+                self.result = result
+
+    def processFrame(self, frame, opts):
+        data = frame.getImage()
+        processed = self.bgCtrl.removeBackground(data, opts['bgMode'], opts['background'])
+        if processed is data:
+            ## Keep a private copy; the image item keeps this array for
+            ## histograms and re-rendering.
+            processed = data.copy()
+
+        autoLevels = None
+        if opts['autoGain'] is not None:
+            autoLevels = self.contrastCtrl.autoLevels(processed, opts['autoGain'])
+            levels = autoLevels[0]
+        else:
+            levels = opts['levels']
+
+        qimage = None
+        if opts['render']:
+            qimage = self.render(processed, levels, opts['lut'], opts['axisOrder'])
+
+        return {
+            'frame': frame,
+            'image': processed,
+            'qimage': qimage,
+            'levels': levels,
+            'autoLevels': autoLevels,
+        }
+
+    def render(self, image, levels, lut, axisOrder):
+        """Convert *image* to a QImage in the same way ImageItem.render() does.
+        """
+        if image.ndim == 3 and image.shape[-1] == 1:
+            image = image[..., 0]
+        if image.ndim != 2:
+            lut = None
+        if axisOrder == 'col-major':
+            image = image.transpose((1, 0, 2)[:image.ndim])
+
+        # if the image data is a small int, then we can combine levels + lut
+        # into a single lut for better performance
+        if levels is not None and image.dtype in (np.ubyte, np.uint16):
+            lut = self.effectiveLut(image.dtype, levels, lut)
+            levels = None
+
+        argb, alpha = fn.makeARGB(image, lut=lut, levels=levels)
+        return fn.makeQImage(argb, alpha, transpose=False)
+
+    def effectiveLut(self, dtype, levels, lut):
+        key = (dtype, tuple(levels))
+        if key != self._effectiveLutKey or lut is not self._effectiveLutSource:
+            ind = np.arange(2**(dtype.itemsize*8))
+            minlev, maxlev = levels
+            levdiff = maxlev - minlev
+            levdiff = 1 if levdiff == 0 else levdiff  # don't allow division by 0
+            if lut is None:
+                efflut = fn.rescaleData(ind, scale=255./levdiff, offset=minlev, dtype=np.ubyte)
+            else:
+                lutdtype = np.min_scalar_type(lut.shape[0]-1)
+                efflut = fn.rescaleData(ind, scale=(lut.shape[0]-1)/levdiff,
+                                        offset=minlev, dtype=lutdtype, clip=(0, lut.shape[0]-1))
+                efflut = lut[efflut]
+            self._effectiveLut = efflut
+            self._effectiveLutKey = key
+            self._effectiveLutSource = lut
+        return self._effectiveLut
@@ -0,0 +1,81 @@
+from __future__ import print_function
+import sys
+import numpy as np
+from acq4.util.Mutex import Mutex
+
+
+class FramePool(object):
+    """Fixed-size ring of preallocated image arrays that are reused for
+    successive camera frames.
+
+    Camera drivers copy each new image into an array returned by get() rather
+    than allocating a new array for every frame. The array is then wrapped by a
+    Frame without copying. A slot is handed out again only after every
+    reference to it (Frames, views, etc.) has been released; this is
+    determined from the array's reference count, so consumers do not need to
+    return frames to the pool explicitly.
+
+    If all slots are still in use, get() allocates a new array instead and
+    counts an overrun. All slots are reallocated when the requested shape or
+    dtype changes (for example, after the camera region or binning changed).
+    """
+    def __init__(self, size=16):
+        self.size = size
+        self.lock = Mutex()
+        self._slots = []
+        self._shape = None
+        self._dtype = None
+        self._next = 0
+        self._freeRefCount = None
+        self.overruns = 0
+
+    def get(self, shape, dtype):
+        """Return an array of the requested shape and dtype that is not
+        referenced anywhere else.
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        with self.lock:
+            if shape != self._shape or dtype != self._dtype:
+                self._allocate(shape, dtype)
+
+            n = len(self._slots)
+            for i in range(n):
+                j = (self._next + i) % n
+                if sys.getrefcount(self._slots[j]) == self._freeRefCount:
+                    self._next = (j + 1) % n
+                    return self._slots[j]
+
+            self.overruns += 1
+        return np.empty(shape, dtype=dtype)
+
+    def _allocate(self, shape, dtype):
+        self._slots = [np.empty(shape, dtype=dtype) for i in range(self.size)]
+        self._shape = shape
+        self._dtype = dtype
+        self._next = 0
+        if len(self._slots) > 0:
+            ## reference count of a slot that is held only by this pool
+            self._freeRefCount = sys.getrefcount(self._slots[0])
+
+    def inUse(self):
+        """Return the number of slots that are currently referenced outside of the pool."""
+        with self.lock:
+            return self._countInUse()
+
+    def _countInUse(self):
+        ## the loop variable holds one extra reference to each slot
+        return len([s for s in self._slots if sys.getrefcount(s) > self._freeRefCount + 1])
+
+    def stats(self):
+        """Return a dict describing the size and usage of the pool."""
+        with self.lock:
+            return {
+                'size': self.size,
+                'inUse': self._countInUse(),
+                'overruns': self.overruns,
+            }
+
+    def resetStats(self):
+        with self.lock:
+            self.overruns = 0
@@ -138,7 +138,11 @@ class ImagingCtrl(Qt.QWidget):
 
         queued = self.recordThread.newFrame(frame)
         if self.ui.recordStackBtn.isChecked():
-            self.ui.stackSizeLabel.setText('%d frames' % self.recordThread.stackSize)
+            rate = self.recordThread.writeThroughput
+            if rate is None:
+                self.ui.stackSizeLabel.setText('%d frames' % self.recordThread.stackSize)
+            else:
+                self.ui.stackSizeLabel.setText('%d frames (writing %0.1f MB/s)' % (self.recordThread.stackSize, rate / 1e6))
 
         self.frameDisplay.newFrame(frame)
 
@@ -0,0 +1,150 @@
+from __future__ import print_function
+from __future__ import division
+import numpy as np
+from acq4.util.Mutex import Mutex
+
+
+class LevelEstimator(object):
+    """Incrementally estimates the display range of a live image stream.
+
+    Each call to update() measures a histogram of a subsampled copy of the
+    image and blends it into an exponentially smoothed histogram; the returned
+    range is read from the quantiles of the smoothed histogram. The cost per
+    frame is proportional to the number of sampled pixels, not to the size of
+    the image.
+
+    ============== ============================================================
+    **Arguments:**
+    samples        Approximate number of pixels to sample from each image. The
+                   image is subsampled with the same stride along both axes.
+    bins           Number of histogram bins. The estimated levels are accurate
+                   to about 1/bins of the image range.
+    clip           Fraction of pixels excluded at each end of the range (so
+                   that a few hot or dead pixels do not determine the range).
+    ============== ============================================================
+    """
+    def __init__(self, samples=2**16, bins=512, clip=1e-4):
+        self.lock = Mutex()
+        self.setAccuracy(samples, bins)
+        self.clip = clip
+        self.reset()
+
+    def setAccuracy(self, samples=None, bins=None):
+        """Set the number of pixels sampled per image and the number of histogram bins.
+        """
+        with self.lock:
+            if samples is not None:
+                self.samples = samples
+            if bins is not None:
+                self.bins = bins
+            self._hist = None
+
+    def reset(self):
+        """Discard the smoothed histogram so that the next image is measured
+        without smoothing.
+        """
+        with self.lock:
+            self._hist = None
+            self._edges = None
+
+    def stride(self, shape):
+        """Return the subsampling stride used for images of the given shape.
+        """
+        size = shape[0] * shape[1]
+        return max(1, int(np.ceil((size / float(self.samples)) ** 0.5)))
+
+    def update(self, data, centerWeight=0.0, smoothing=0.0):
+        """Add a new 2D image to the histogram and return the estimated
+        (min, max) range.
+
+        *centerWeight* (0-1) weights the measurement toward the center third of
+        the image. The previous histogram is weighted by *smoothing* (0-1) when
+        the new image is added; 0 uses only the new image.
+        Returns None if the image contains no finite values.
+        """
+        with self.lock:
+            step = self.stride(data.shape)
+            sample = data[::step, ::step]
+            finite = None
+            if sample.dtype.kind == 'f':
+                finite = np.isfinite(sample)
+                valid = sample[finite]
+                if valid.size == 0:
+                    return None
+                mn, mx = valid.min(), valid.max()
+            else:
+                mn, mx = sample.min(), sample.max()
+
+            if self._hist is None:
+                self._setRange(mn, mx)
+            elif mn < self._edges[0] or mx > self._edges[-1]:
+                self._setRange(min(mn, self._edges[0]), max(mx, self._edges[-1]))
+            rng = (self._edges[0], self._edges[-1])
+
+            idx = self._binIndex(sample, finite)
+            hist = self._count(idx)
+            hist *= (1.0 - centerWeight) / hist.sum()
+            if centerWeight > 0:
+                ## center third of the image, on the same subsampling grid
+                (w, h) = data.shape
+                cx = slice(-(-(w//2-w//6) // step), -(-(w//2+w//6) // step))
+                cy = slice(-(-(h//2-h//6) // step), -(-(h//2+h//6) // step))
+                center = self._count(idx[cx, cy])
+                if center.sum() > 0:
+                    hist += center * (centerWeight / center.sum())
+
+            if self._hist is None:
+                self._hist = hist
+            else:
+                self._hist *= smoothing
+                self._hist += hist * (1.0 - smoothing)
+
+            levels = self._quantiles()
+
+            ## if the image now occupies only a small part of the histogram,
+            ## re-bin to keep the levels accurate
+            if levels[1] - levels[0] < 0.25 * (rng[1] - rng[0]):
+                self._setRange(*levels)
+
+            return levels
+
+    def _binIndex(self, sample, finite):
+        ## return the histogram bin of each sampled pixel; non-finite values
+        ## go into an extra bin at the end.
+        ## (this is several times faster than np.histogram)
+        dtype = np.float64 if sample.dtype == np.float64 else np.float32
+        x = sample.astype(dtype)
+        x -= self._edges[0]
+        x *= self.bins / (self._edges[-1] - self._edges[0])
+        if finite is not None:
+            x[~finite] = self.bins
+        idx = x.astype(np.intp)
+        np.clip(idx, 0, self.bins, out=idx)
+        return idx
+
+    def _count(self, idx):
+        return np.bincount(idx.ravel(), minlength=self.bins+1)[:self.bins].astype(float)
+
+    def _setRange(self, mn, mx):
+        ## set the histogram range to (mn, mx) plus some padding. If there
+        ## is a previous histogram, its distribution is re-binned to the new range.
+        mn = float(mn)
+        mx = float(mx)
+        pad = max((mx - mn) * 0.1, 1e-12 * max(abs(mn), abs(mx)), 1e-12)
+        edges = np.linspace(mn - pad, mx + pad, self.bins + 1)
+        if self._hist is not None and len(self._hist) == self.bins:
+            cdf = np.concatenate([[0], np.cumsum(self._hist)])
+            self._hist = np.diff(np.interp(edges, self._edges, cdf))
+        else:
+            self._hist = None
+        self._edges = edges
+
+    def _quantiles(self):
+        cdf = np.concatenate([[0], np.cumsum(self._hist)])
+        total = cdf[-1]
+        ## always clip a tiny fraction so that empty bins at either end are
+        ## not included in the range
+        q = max(self.clip, 1e-9) * total
+        mn = np.interp(q, cdf, self._edges)
+        mx = np.interp(total - q, cdf, self._edges)
+        return mn, mx
@@ -9,6 +9,7 @@ import numpy as np
 import acq4.util.ptime as ptime
 import acq4.Manager
 from acq4.util.DataManager import FileHandle, DirHandle
+from .stack_writer import StackWriter
 try:
     from acq4.filetypes.ImageFile import *
     HAVE_IMAGEFILE = True
@@ -39,6 +40,8 @@ class RecordThread(Thread):
 
         # Attributes private to worker thread:
         self.currentStack = None  # file handle of currently recorded stack
+        self.stackWriter = None  # StackWriter streaming frames to currentStack
+        self._writeThroughput = None
         self.startFrameTime = None
         self.lastFrameTime = None
         self.currentFrameNum = 0
@@ -99,6 +102,15 @@ class RecordThread(Thread):
                 self.stopRecording()
         return framesLeft
 
+    @property
+    def writeThroughput(self):
+        """The sustained rate (bytes/sec) at which frames have been written 
+        to the current (or most recent) image stack, or None if not known.
+        
+        If frames arrive faster than this, they will back up in memory.
+        """
+        return self._writeThroughput
+
     @property
     def stackSize(self):
         """The total number of frames requested for storage in the current
@@ -134,6 +146,10 @@ class RecordThread(Thread):
                 self.sigRecordingFailed.emit()
                 
             time.sleep(100e-3)
+        
+        if self.stackWriter is not None:
+            self.stackWriter.close()
+            self.stackWriter = None
 
     def handleFrames(self, frames):
         # Write as many frames into the stack as possible.
@@ -151,12 +167,18 @@ class RecordThread(Thread):
                     recFrames = []
 
                 if self.currentStack is not None:
+                    if self.stackWriter is not None:
+                        self.stackWriter.close()
+                        self.stackWriter = None
                     dur = self.lastFrameTime - self.startFrameTime
                     if dur > 0:
                         fps = (self.currentFrameNum+1) / dur
                     else:
                         fps = 0
-                    self.currentStack.setInfo({'frames': self.currentFrameNum, 'duration': dur, 'averageFPS': fps})
+                    info = {'frames': self.currentFrameNum, 'duration': dur, 'averageFPS': fps}
+                    if self._writeThroughput is not None:
+                        info['writeThroughput'] = self._writeThroughput
+                    self.currentStack.setInfo(info)
                     # self.showMessage('Finished recording %s - %d frames, %02f sec' % (self.currentStack.name(), self.currentFrameNum, dur)) 
                     self.sigRecordingFinished.emit(self.currentStack, self.currentFrameNum)
                     self.currentStack = None
@@ -191,18 +213,29 @@ class RecordThread(Thread):
             
         if len(recFrames) > 0:
             self.writeFrames(recFrames, dh)
-            self.currentFrameNum += len(recFrames)
 
     def writeFrames(self, frames, dh):
         newRec = self.currentStack is None
+        self.currentFrameNum += len(frames)
 
         if newRec:
             self.startFrameTime = frames[0][1]['time']
+            self._writeThroughput = None
+            
+        if StackWriter.isAvailable():
+            ## Stream frames into the open file
+            if newRec:
+                self.stackWriter = StackWriter.create(dh, 'video', frames[0][0], frames[0][1], self.startFrameTime)
+                self.currentStack = self.stackWriter.fileHandle
+                frames = frames[1:]
+            self.stackWriter.write(frames)
+            self._writeThroughput = self.stackWriter.throughput()
+            return
 
         times = [f[1]['time'] for f in frames]
         translations = np.array([f[1]['transform'].getTranslation() for f in frames])
         arrayInfo = [
-            {'name': 'Time', 'values': array(times) - self.startFrameTime, 'units': 's', 'translation': translations},
+            {'name': 'Time', 'values': np.array(times) - self.startFrameTime, 'units': 's', 'translation': translations},
             {'name': 'X'},
             {'name': 'Y'}
         ]
@@ -0,0 +1,129 @@
+from __future__ import print_function
+import importlib
+import numpy as np
+import acq4.util.ptime as ptime
+from acq4.util.metaarray import MetaArray
+## (the MetaArray class shadows its module in the metaarray package)
+metaarray = importlib.import_module('acq4.pyqtgraph.metaarray.MetaArray')
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class StackWriter(object):
+    """Streams image frames into a MetaArray HDF5 file.
+
+    The file is created with the first frame using MetaArray's own writer, so
+    it has the same layout as a stack written with appendAxis='Time' and can
+    be read back with MetaArray as usual. After that the file stays open and
+    each frame is written directly into the data set. The data set and the
+    Time axis values / translations are grown in blocks of *growFrames*
+    frames rather than being resized for every append, and are trimmed to the
+    number of frames actually written when the stack is closed.
+
+    Example::
+
+        writer = StackWriter.create(dirHandle, 'video', frames[0][0], frames[0][1], startTime)
+        writer.write(frames[1:])
+        ...
+        writer.close()
+    """
+    def __init__(self, fileHandle, startTime, growFrames=256):
+        self.fileHandle = fileHandle
+        self.startTime = startTime
+        self.growFrames = growFrames
+        self.file = h5py.File(fileHandle.name(), 'r+')
+        self.data = self.file['data']
+        timeInfo = self.file['info']['0']
+        self.times = timeInfo['values']
+        self.translations = timeInfo['translation']
+        self.count = self.data.shape[0]
+        self.capacity = self.count
+
+        ## bytes and time spent writing frames after the file was created
+        self.bytesWritten = 0
+        self.writeTime = 0.0
+
+    @staticmethod
+    def isAvailable():
+        """Return True if MetaArray writes HDF5 files (otherwise stacks must be
+        appended with MetaArray.write).
+        """
+        return h5py is not None and metaarray.USE_HDF5 and metaarray.HAVE_HDF5
+
+    @classmethod
+    def create(cls, dh, fileName, data, info, startTime, **kwds):
+        """Create a new stack file in *dh* containing a single frame, and return
+        a StackWriter that appends to it.
+
+        *data* and *info* are the image and info dict of the first frame; *info*
+        is also stored as the file's meta-info.
+        """
+        arr = MetaArray(data[np.newaxis, ...], info=cls.axisInfo([info], startTime))
+        fh = dh.writeFile(arr, fileName, autoIncrement=True, info=info, appendAxis='Time', appendKeys=['translation'])
+        return cls(fh, startTime, **kwds)
+
+    @staticmethod
+    def axisInfo(infos, startTime):
+        times = np.array([i['time'] for i in infos]) - startTime
+        translations = np.array([i['transform'].getTranslation() for i in infos])
+        return [
+            {'name': 'Time', 'values': times, 'units': 's', 'translation': translations},
+            {'name': 'X'},
+            {'name': 'Y'}
+        ]
+
+    def write(self, frames):
+        """Append a list of (data, info) frames to the stack."""
+        if len(frames) == 0:
+            return
+        start = ptime.time()
+        n = len(frames)
+        self._reserve(self.count + n)
+
+        for i, (data, info) in enumerate(frames):
+            data = np.ascontiguousarray(data)
+            self.data.write_direct(data, dest_sel=np.s_[self.count + i])
+            self.bytesWritten += data.nbytes
+
+        axInfo = self.axisInfo([f[1] for f in frames], self.startTime)[0]
+        self.times[self.count:self.count + n] = axInfo['values']
+        self.translations[self.count:self.count + n] = axInfo['translation']
+        self.count += n
+        self.file.flush()
+        self.writeTime += ptime.time() - start
+
+    def _reserve(self, n):
+        ## grow all data sets along the Time axis to hold at least n frames
+        if n <= self.capacity:
+            return
+        self.capacity = max(n, self.capacity + self.growFrames)
+        self._resize(self.capacity)
+
+    def _resize(self, n):
+        self.data.resize((n,) + self.data.shape[1:])
+        self.times.resize((n,) + self.times.shape[1:])
+        self.translations.resize((n,) + self.translations.shape[1:])
+
+    def throughput(self):
+        """Return the sustained write rate (bytes/sec) measured so far, or None
+        if no frames have been written since the file was created.
+
+        This is the rate at which frames can be recorded without backing up in
+        memory.
+        """
+        if self.writeTime == 0:
+            return None
+        return self.bytesWritten / self.writeTime
+
+    def close(self):
+        """Trim the data sets to the number of frames written and close the file."""
+        if self.file is None:
+            return
+        try:
+            if self.capacity > self.count:
+                self._resize(self.count)
+        finally:
+            self.file.close()
+            self.file = None
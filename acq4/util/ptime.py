@@ -29,3 +29,9 @@ if 'win' in sys.platform:
 else:
     time = unixTime
 
+
+if hasattr(systime, 'perf_counter'):
+    monotonic = systime.perf_counter
+else:
+    ## no monotonic clock available (python 2); use the default clock.
+    monotonic = time
@@ -3,6 +3,7 @@ import tempfile, shutil, atexit, os
 import acq4.util.DataManager as dm
 from acq4.util.DirTreeWidget import DirTreeWidget
 import acq4.pyqtgraph as pg
+from acq4.util.configfile import readConfigFile
 
 app = pg.mkQApp()
 
@@ -75,3 +76,58 @@ def test_datamanager():
 
 
 
+
+def test_index_journal():
+    rh = dm.getDirHandle(root)
+    d1 = rh.mkdir('journal_test')
+    fh = d1.createFile('file1', info={'a': 1})
+
+    # updates to existing entries go to the journal; .index is left untouched
+    indexText = open(d1._indexFile()).read()
+    fh.setInfo({'b': 2})
+    d1.setInfo({'c': 3})
+    assert open(d1._indexFile()).read() == indexText
+    assert os.path.isfile(d1._journalFile())
+    assert '.index.journal' not in d1.ls()
+
+    # journal is replayed when the index is reloaded from disk
+    d1._index = None
+    assert fh.info()['a'] == 1
+    assert fh.info()['b'] == 2
+    assert d1.info()['c'] == 3
+
+    d1.forget('file1')
+    assert not d1.isManaged('file1')
+
+    # compaction folds the journal back into the readable index
+    d1.indexFile('file1', info={'d': 4})
+    d1.compactIndex()
+    assert not os.path.exists(d1._journalFile())
+    index = readConfigFile(d1._indexFile())
+    assert index['file1'] == {'d': 4}
+    assert index['.']['c'] == 3
+
+    # cleanup() also leaves a readable index behind
+    d1['file1'].setInfo({'e': 5})
+    assert os.path.isfile(d1._journalFile())
+    dm.cleanup()
+    assert not os.path.exists(d1._journalFile())
+    assert readConfigFile(d1._indexFile())['file1'] == {'d': 4, 'e': 5}
+
+
+def test_ls_date_sort():
+    rh = dm.getDirHandle(root)
+    d1 = rh.mkdir('sort_test')
+    d1.createFile('b', info={'__timestamp__': 2})
+    d1.createFile('a', info={'__timestamp__': 3})
+    d1.createFile('c', info={'__timestamp__': 1})
+    assert d1.ls() == ['c', 'b', 'a']
+
+    # changing a timestamp re-sorts the cached list
+    d1['a'].setInfo({'__timestamp__': 0})
+    assert d1.ls(useCache=True) == ['a', 'c', 'b']
+
+    # added and removed children are merged into the cached order
+    d1.createFile('d', info={'__timestamp__': 1.5})
+    d1['c'].delete()
+    assert d1.ls() == ['a', 'd', 'b']
@@ -0,0 +1,178 @@
+from __future__ import print_function
+import numpy as np
+from acq4.util.functions import zeroCrossingEvents, thresholdEvents, clementsBekkers, cbTemplateMatch, \
+    expTemplate, _fftCorrelate
+
+
+def makeTrace(n=20000, nEvents=40, seed=0):
+    ## noise plus positive and negative exponential events, starting away from the ends of the trace
+    rng = np.random.RandomState(seed)
+    data = rng.normal(scale=0.3, size=n)
+    t = np.arange(300)
+    for i in range(nEvents):
+        start = rng.randint(500, n - 500)
+        amp = rng.choice([-1, 1]) * rng.uniform(2, 6)
+        data[start:start+300] += amp * (1 - np.exp(-t / 3.)) * np.exp(-t / 40.)
+    return data
+
+
+def loopZeroCrossingEvents(data, minLength=3):
+    ## reference implementation (the event loop from the original version)
+    mask = data > 0
+    times1 = np.argwhere(mask[1:] != mask[:-1])[:, 0]
+    times = np.concatenate([[0], times1, [len(data)]])
+    events = []
+    for i in np.argwhere(times[1:] - times[:-1] > minLength)[:, 0]:
+        t1 = times[i] + 1
+        t2 = times[i+1] + 1
+        evData = data[t1:t2]
+        s = evData.sum()
+        events.append((t1, t2-t1, s, evData.max() if s > 0 else evData.min()))
+    return events
+
+
+def loopThresholdEvents(data, threshold, adjustTimes=True):
+    ## reference implementation (the event loop from the original version)
+    hits = []
+    for mask in [(data > threshold).astype(np.byte), (data < -threshold).astype(np.byte)]:
+        diff = mask[1:] - mask[:-1]
+        onTimes = np.argwhere(diff == 1)[:, 0] + 1
+        offTimes = np.argwhere(diff == -1)[:, 0] + 1
+        if len(onTimes) == 0 or len(offTimes) == 0:
+            continue
+        if offTimes[0] < onTimes[0]:
+            offTimes = offTimes[1:]
+        if offTimes[-1] < onTimes[-1]:
+            onTimes = onTimes[:-1]
+        hits.extend(zip(onTimes, offTimes))
+    hits.sort(key=lambda h: h[0])
+
+    def measure(t1, t2):
+        evData = data[int(t1):int(t2)]
+        s = evData.sum()
+        peakInd = np.argmax(evData) if s > 0 else np.argmin(evData)
+        return s, evData[peakInd], int(peakInd + t1)
+
+    events = []
+    for i in range(len(hits)):
+        t1, t2 = hits[i]
+        ln = t2 - t1
+        s, peak, peakInd = measure(t1, t2)
+        if adjustTimes:
+            evData = data[t1:t2]
+            mind = np.argmax(evData)
+            pdiff = abs(peak - evData[0])
+            adj1 = 0 if pdiff == 0 else min(ln, int(threshold * mind / pdiff))
+            t1 -= adj1
+            if i > 0:
+                lt2 = hits[i-1][1]
+                if t1 < lt2:
+                    diff = lt2 - t1
+                    tot = adj1 + lastAdj
+                    if tot != 0:
+                        d1 = diff * float(lastAdj) / tot
+                        d2 = diff * float(adj1) / tot
+                        hits[i-1] = (hits[i-1][0], hits[i-1][1] - (d1+1))
+                        t1 += d2
+            mind = ln - mind
+            pdiff = abs(peak - evData[-1])
+            adj2 = 0 if pdiff == 0 else min(ln, int(threshold * mind / pdiff))
+            t2 += adj2
+            lastAdj = adj2
+        hits[i] = (t1, t2)
+        events.append((int(t1), int(ln), s, peak, peakInd))
+    if adjustTimes:
+        events = []
+        for t1, t2 in hits:
+            if int(t2) > int(t1):
+                s, peak, peakInd = measure(t1, t2)
+                events.append((int(t1), int(t2 - t1), s, peak, peakInd))
+    return events
+
+
+def checkEvents(events, expected, fields):
+    assert len(events) == len(expected)
+    for i, name in enumerate(fields):
+        assert np.allclose(events[name], [ev[i] for ev in expected], rtol=1e-10, atol=1e-10), name
+
+
+def test_zeroCrossingEvents():
+    data = makeTrace()
+    for minLength in [0, 3, 20]:
+        events = zeroCrossingEvents(data, minLength=minLength)
+        checkEvents(events, loopZeroCrossingEvents(data, minLength), ['index', 'len', 'sum', 'peak'])
+
+    ## filtering by peak and sum
+    events = zeroCrossingEvents(data, minPeak=2.0, minSum=20.0)
+    assert len(events) > 0
+    assert np.all(abs(events['peak']) > 2.0) and np.all(abs(events['sum']) > 20.0)
+
+    ## events touching both ends of the trace; no crossings at all
+    assert len(zeroCrossingEvents(np.ones(10))) == 1
+    assert len(zeroCrossingEvents(np.zeros(0))) == 0
+
+
+def test_thresholdEvents():
+    data = makeTrace()
+    for adjust in [False, True]:
+        events = thresholdEvents(data, 1.5, adjustTimes=adjust)
+        assert len(events) > 20
+        checkEvents(events, loopThresholdEvents(data, 1.5, adjust), ['index', 'len', 'sum', 'peak', 'peakIndex'])
+
+    assert len(thresholdEvents(np.zeros(100), 1.0)) == 0
+
+
+def directClementsBekkers(data, template):
+    ## reference implementation: least-squares fit of scale and offset at every position
+    N = len(template)
+    A = np.vstack([template, np.ones(N)]).T
+    n = len(data) - N + 1
+    dc, scale, offset = np.empty(n), np.empty(n), np.empty(n)
+    for i in range(n):
+        (scale[i], offset[i]), sse = np.linalg.lstsq(A, data[i:i+N], rcond=None)[:2]
+        dc[i] = scale[i] / np.sqrt(sse[0] / (N-1))
+    return dc, scale, offset
+
+
+def makeTemplate(dt=1e-4, rise=3e-4, decay=3e-3):
+    return -expTemplate(dt, rise, decay, delay=0, length=12e-3)
+
+
+def test_clementsBekkers():
+    rng = np.random.RandomState(1)
+    template = makeTemplate()
+    data = rng.normal(scale=0.1, size=3000) + 5.0
+    for t in [400, 1200, 2500]:
+        data[t:t+len(template)] += 2 * template
+
+    dc, scale, offset = clementsBekkers(data, template)
+    refDc, refScale, refOffset = directClementsBekkers(data, template)
+    assert np.allclose(dc, refDc, rtol=1e-7, atol=1e-7)
+    assert np.allclose(scale, refScale, rtol=1e-7, atol=1e-7)
+    assert np.allclose(offset, refOffset, rtol=1e-7, atol=1e-7)
+
+    ## batched traces and templates give the same results as one trace and template at a time
+    traces = np.vstack([data, data[::-1], rng.normal(size=3000)])
+    templates = np.vstack([template, makeTemplate(rise=1e-4, decay=2e-3)])
+    dc, scale, offset = clementsBekkers(traces, templates[:, np.newaxis, :])
+    assert dc.shape == (2, 3, 3000 - len(template) + 1)
+    for i in range(2):
+        for j in range(3):
+            expected = clementsBekkers(traces[j], templates[i])
+            for result, exp in zip((dc, scale, offset), expected):
+                assert np.allclose(result[i, j], exp, rtol=1e-10, atol=1e-10)
+
+    ## events are found at the correct locations
+    events = cbTemplateMatch(data, template, threshold=10.0)
+    assert list(events['peak']) == [400, 1200, 2500]
+    assert np.allclose(events['scale'], 2.0, rtol=0.1)
+
+
+def test_fftCorrelate():
+    ## the blockwise correlation agrees with direct correlation across block boundaries
+    rng = np.random.RandomState(2)
+    data = rng.normal(size=(2, 5000))
+    template = rng.normal(size=37)
+    expected = [np.correlate(d, template, mode='valid') for d in data]
+    for blockSize in [64, 1000, 2**14]:
+        assert np.allclose(_fftCorrelate(data, template, blockSize=blockSize), expected)
@@ -0,0 +1,38 @@
+from __future__ import print_function
+import numpy as np
+from acq4.util.imaging.frame_pool import FramePool
+
+
+def test_frame_pool():
+    pool = FramePool(size=2)
+    a = pool.get((4, 5), np.uint16)
+    b = pool.get((4, 5), np.uint16)
+    assert a.shape == (4, 5) and a.dtype == np.uint16
+    assert a is not b
+    assert pool.stats() == {'size': 2, 'inUse': 2, 'overruns': 0}
+
+    # all slots are referenced; a new array is allocated and counted
+    c = pool.get((4, 5), np.uint16)
+    assert c is not a and c is not b
+    assert pool.stats()['overruns'] == 1
+
+    # a view keeps its slot in use
+    view = a[1:3]
+    del a
+    d = pool.get((4, 5), np.uint16)
+    assert pool.stats()['overruns'] == 2
+
+    # slots are reused once released
+    addr = view.base.ctypes.data
+    del view
+    e = pool.get((4, 5), np.uint16)
+    assert e.ctypes.data == addr
+    assert pool.stats()['overruns'] == 2
+
+    # changing shape reallocates all slots
+    f = pool.get((2, 2), np.uint8)
+    assert f.shape == (2, 2) and f.dtype == np.uint8
+    assert pool.stats()['inUse'] == 1
+
+    pool.resetStats()
+    assert pool.stats()['overruns'] == 0
@@ -0,0 +1,54 @@
+from __future__ import print_function
+import numpy as np
+from acq4.util.imaging.level_estimator import LevelEstimator
+
+
+def test_range():
+    est = LevelEstimator(bins=1000, clip=0)
+    img = np.linspace(100, 4000, 1000*1000).reshape(1000, 1000).astype(np.uint16)
+    mn, mx = est.update(img)
+    assert abs(mn - 100) < 40
+    assert abs(mx - 4000) < 40
+
+    # hot pixels are excluded by clipping
+    est = LevelEstimator(bins=1000, clip=1e-3)
+    img = img.copy()
+    img[::200, ::200] = 60000
+    mn, mx = est.update(img)
+    assert mx < 4200
+
+    # non-finite values are ignored
+    img = np.random.normal(size=(500, 500), loc=10, scale=1)
+    img[10:20] = np.nan
+    img[30:40] = np.inf
+    mn, mx = LevelEstimator().update(img)
+    assert np.isfinite(mn) and np.isfinite(mx)
+    assert 0 < mn < mx < 20
+
+
+def test_smoothing():
+    est = LevelEstimator(bins=1000, clip=0)
+    a = np.zeros((512, 512)) + np.linspace(0, 1000, 512)
+    b = a + 5000
+    est.update(a)
+
+    # unsmoothed update follows the new image
+    mn, mx = est.update(b, smoothing=0)
+    assert abs(mn - 5000) < 20
+    assert abs(mx - 6000) < 20
+
+    # smoothed updates converge to the new image
+    est.reset()
+    est.update(a)
+    mn, mx = est.update(b, smoothing=0.5)
+    assert mn < 1000
+    assert abs(mx - 6000) < 20
+    for i in range(40):
+        mn, mx = est.update(b, smoothing=0.5)
+    assert abs(mn - 5000) < 20
+
+
+def test_stride():
+    est = LevelEstimator(samples=2**16)
+    assert est.stride((256, 256)) == 1
+    assert est.stride((2048, 2048)) == 8
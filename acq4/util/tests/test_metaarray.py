@@ -0,0 +1,81 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+from acq4.util.metaarray import MetaArray, axis
+
+
+def test_regular_axis():
+    data = np.random.normal(size=(2, 1000))
+    info = [axis('Channel', cols=[('a', 'V'), ('b', 'A')]), axis('Time', units='s', rate=1e4), {}]
+    ma = MetaArray(data, info=info)
+    t = np.linspace(0, 999e-4, 1000)
+
+    assert ma.axisHasValues('Time')
+    assert np.allclose(ma.xvals('Time'), t)
+    assert np.allclose(ma['Channel': 'b'].xvals('Time'), t)
+    assert np.allclose(ma[:, 100:500:3].xvals('Time'), t[100:500:3])
+    assert np.allclose(ma[:, [1, 5, 9]].xvals('Time'), t[[1, 5, 9]])
+    assert np.allclose(ma['Time': 0.01:0.02].xvals('Time'), t[(t >= 0.01) & (t < 0.02)])
+
+    ## values are stored explicitly in copies of the meta info
+    info = ma.infoCopy()
+    assert np.allclose(info[1]['values'], t)
+    assert 'rate' not in info[1]
+
+
+def test_value_range_copy():
+    ## indexing an in-memory array by axis value range returns a copy
+    t = np.arange(100) / 1e3
+    ma = MetaArray(np.zeros((2, 100)), info=[axis('Channel', cols=[('a',), ('b',)]), axis('Time', values=t), {}])
+    sub = ma['Time': 0.01:0.02]
+    sub[:] = 1
+    assert ma.asarray().sum() == 0
+    assert np.allclose(sub.xvals('Time'), t[(t >= 0.01) & (t < 0.02)])
+
+
+def test_lazy_hdf5(tmpdir):
+    pytest.importorskip('h5py')
+    data = np.random.normal(size=(3, 10000)).astype(np.float32)
+    t = np.arange(10000) / 1e4
+    info = [axis('Channel', cols=[('primary', 'V'), ('secondary', 'A'), ('command', 'V')]),
+            axis('Time', units='s', values=t), {'mode': 'ic'}]
+    fileName = str(tmpdir.join('lazy.ma'))
+    MetaArray(data, info=info).write(fileName)
+
+    ma = MetaArray(file=fileName, readAllData=False)
+    try:
+        assert ma._info[-1]['mode'] == 'ic'
+        assert ma.axisHasValues('Time')
+
+        sub = ma['Channel': 'primary', 'Time': 0.1:0.2]
+        mask = (t >= 0.1) & (t < 0.2)
+        assert np.all(sub.asarray() == data[0, mask])
+        assert np.allclose(sub.xvals('Time'), t[mask])
+
+        sub = ma[[2, 0], 10:20]
+        assert np.all(sub.asarray() == data[[2, 0], 10:20])
+        assert sub.listColumns('Channel') == ['command', 'primary']
+        assert np.all(ma[1, ::-7].asarray() == data[1, ::-7])
+        assert np.allclose(ma.xvals('Time'), t)
+    finally:
+        ma.close()
+
+
+def test_mmap_hdf5(tmpdir):
+    pytest.importorskip('h5py')
+    data = np.random.randint(0, 4096, size=(20, 64, 64)).astype(np.uint16)
+    info = [axis('Time', units='s', values=np.arange(20) * 0.1), axis('X'), axis('Y'), {'binning': 2}]
+    fileName = str(tmpdir.join('mappable.ma'))
+    MetaArray(data, info=info).write(fileName, mappable=True)
+
+    ma = MetaArray(file=fileName, mmap=True)
+    assert isinstance(ma.asarray(), np.memmap)
+    assert ma._info[-1]['binning'] == 2
+    assert np.all(ma[7].asarray() == data[7])
+    assert np.all(ma['Time': 0.5:0.8].asarray() == data[5:8])
+
+    ## chunked files can not be mapped
+    fileName = str(tmpdir.join('chunked.ma'))
+    MetaArray(data, info=info).write(fileName)
+    with pytest.raises(Exception):
+        MetaArray(file=fileName, mmap=True)
@@ -0,0 +1,53 @@
+from __future__ import print_function
+import time
+import pytest
+from acq4.util.StorageQueue import StorageQueue
+
+
+class FakeDirHandle(object):
+    def __init__(self, name):
+        self._name = name
+    def name(self):
+        return self._name
+
+
+def test_storage_queue():
+    sq = StorageQueue(maxSize=2, nThreads=2)
+    written = []
+    for i in range(10):
+        sq.submit(FakeDirHandle('dir%d' % (i % 3)), written.append, (i,))
+    assert sq.flush() is True
+    assert sorted(written) == list(range(10))
+    ## jobs for the same directory run in order
+    assert [i for i in written if i % 3 == 1] == [1, 4, 7]
+    sq.stop()
+
+
+def test_storage_errors():
+    sq = StorageQueue()
+    def fail():
+        raise IOError("disk full")
+    dh = FakeDirHandle('dir')
+
+    ## errors are raised from flush()
+    sq.submit(dh, fail)
+    with pytest.raises(IOError):
+        sq.flush()
+    assert sq.flush() is True
+
+    ## ..or from the next submit(), which still queues its own job
+    sq.submit(dh, fail)
+    while sq.pending() > 0:
+        time.sleep(1e-3)
+    written = []
+    with pytest.raises(IOError):
+        sq.submit(dh, written.append, (1,))
+    assert sq.flush() is True
+    assert written == [1]
+
+    ## ..or from stop(), which still stops the storage threads
+    sq.submit(dh, fail)
+    with pytest.raises(IOError):
+        sq.stop()
+    with pytest.raises(Exception):
+        sq.submit(dh, lambda: None)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for configfile.parseString: compares the literal-first parser against
+the original eval-per-line parser on a synthetic .index file.
+
+Usage:  python benchmarks/configfile_parse.py [nEntries]
+"""
+from __future__ import print_function
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from acq4.pyqtgraph import configfile, units
+from acq4.pyqtgraph.pgcollections import OrderedDict
+from acq4.util import ptime
+
+
+def makeIndex(n):
+    """Generate a synthetic index similar to those written by DirHandle for protocol sequences."""
+    index = OrderedDict()
+    index['.'] = {'__timestamp__': 1400000000.123, 'dirType': 'Protocol', 
+                  'sequenceParams': {('Clamp1', 'holding'): [-0.1 + 0.01 * i for i in range(16)]}}
+    for i in range(n):
+        index['%03d.ma' % i] = OrderedDict([
+            ('__object_type__', 'MetaArray'),
+            ('__timestamp__', 1400000000.123 + i * 0.517),
+            ('holding', -0.07 + i * 1e-3),
+            ('mode', 'IC'),
+            ('gain', 50),
+            ('params', (i, i % 16)),
+            ('position', [i * 1e-6, -i * 2e-6, 0.0]),
+        ])
+    s = configfile.genString(index)
+    ## a few hand-written unit expressions, as found in device configs
+    s += "holdingSetpoint: -65*mV\nsampleRate: 40*kHz\n"
+    return s
+
+
+def legacyEvalValue(v):
+    """The per-line evaluation done by parseString before the literal parser was added."""
+    local = units.allUnits.copy()
+    local['OrderedDict'] = OrderedDict
+    local['readConfigFile'] = configfile.readConfigFile
+    local['Point'] = configfile.Point
+    local['QtCore'] = configfile.QtCore
+    local['ColorMap'] = configfile.ColorMap
+    local['datetime'] = configfile.datetime
+    local['array'] = np.array
+    for dtype in ['int8', 'uint8', 
+                  'int16', 'uint16', 'float16',
+                  'int32', 'uint32', 'float32',
+                  'int64', 'uint64', 'float64']:
+        local[dtype] = getattr(np, dtype)
+    return eval(v, local)
+
+
+def timeParse(s, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = ptime.time()
+        data = configfile.parseString(s)[1]
+        dt = ptime.time() - start
+        best = dt if best is None else min(best, dt)
+    return best, data
+
+
+def main(n=10000):
+    s = makeIndex(n)
+    print("Synthetic index: %d entries, %d lines, %0.1f kB" % (n, s.count('\n'), len(s) / 1024.))
+    
+    fast, fastData = timeParse(s)
+    
+    evalValue = configfile.evalValue
+    configfile.evalValue = legacyEvalValue
+    try:
+        legacy, legacyData = timeParse(s)
+    finally:
+        configfile.evalValue = evalValue
+    
+    assert repr(fastData) == repr(legacyData), "Parsers disagree!"
+    print("eval per line:  %0.3f s" % legacy)
+    print("literal-first:  %0.3f s" % fast)
+    print("speedup:        %0.1fx" % (legacy / fast))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
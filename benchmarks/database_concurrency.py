@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for concurrent access to a SqliteDatabase: one thread writes batches
+of events to a synthetic events table (as an analysis module storing results
+would) while reader threads repeatedly select the events of single source files
+(as a background analysis worker would).
+
+Reports write throughput, the latency of reads and writes, and the number of
+"database is locked" errors, with the write-ahead log enabled and disabled.
+
+Usage:  python benchmarks/database_concurrency.py [duration] [nReaders]
+"""
+from __future__ import print_function
+import os, sys, shutil, tempfile, threading, time, sqlite3
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from acq4.util import ptime
+from acq4.util.database.database import SqliteDatabase
+
+columns = [
+    ('SourceFile', 'text'),
+    ('fitAmplitude', 'real'),
+    ('fitTime', 'real'),
+    ('fitRiseTau', 'real'),
+    ('fitDecayTau', 'real'),
+    ('fitFractionalError', 'real'),
+    ('index', 'int'),
+    ('waveform', 'array blob'),
+]
+
+
+def makeEvents(fileIndex, n=200):
+    data = np.empty(n, dtype=[('SourceFile', object), ('fitAmplitude', float), ('fitTime', float),
+                              ('fitRiseTau', float), ('fitDecayTau', float), ('fitFractionalError', float),
+                              ('index', int), ('waveform', np.float32, (200,))])
+    data['SourceFile'] = 'cell1/map_%03d/%03d/Clamp1.ma' % (fileIndex // 100, fileIndex % 100)
+    for name in ['fitAmplitude', 'fitTime', 'fitRiseTau', 'fitDecayTau', 'fitFractionalError']:
+        data[name] = np.random.random(n)
+    data['index'] = np.arange(n)
+    data['waveform'] = np.random.normal(size=(n, 200))
+    return data
+
+
+def run(fileName, duration, nReaders, walMode):
+    db = SqliteDatabase(fileName, walMode=walMode)
+    db.createTable('events', columns)
+    db.createIndex('events', ['SourceFile'])
+    ## start with some data to read
+    for i in range(20):
+        db.insert('events', makeEvents(i))
+    nFiles = [20]
+
+    stop = threading.Event()
+    writeTimes = []
+    readTimes = []
+    errors = []
+
+    def write():
+        while not stop.is_set():
+            data = makeEvents(nFiles[0])
+            start = ptime.time()
+            try:
+                with db.transaction():
+                    db.delete('events', where={'SourceFile': data['SourceFile'][0]})
+                    db.insert('events', data)
+                writeTimes.append(ptime.time() - start)
+                nFiles[0] += 1
+            except sqlite3.OperationalError as exc:
+                errors.append(exc)
+
+    def read():
+        while not stop.is_set():
+            i = np.random.randint(nFiles[0])
+            sourceFile = 'cell1/map_%03d/%03d/Clamp1.ma' % (i // 100, i % 100)
+            start = ptime.time()
+            try:
+                ev = db.select('events', where={'SourceFile': sourceFile}, toArray=True)
+                if ev is not None:
+                    ev['fitAmplitude'].mean()
+                readTimes.append(ptime.time() - start)
+            except sqlite3.OperationalError as exc:
+                errors.append(exc)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for i in range(nReaders)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    db.close()
+    return np.array(writeTimes), np.array(readTimes), errors
+
+
+def report(name, writeTimes, readTimes, errors, duration):
+    print("%s:" % name)
+    print("  writes:  %5d batches (%0.0f events/s)   median %0.1f ms   max %0.1f ms" % (
+        len(writeTimes), len(writeTimes) * 200 / duration, np.median(writeTimes) * 1e3, writeTimes.max() * 1e3))
+    print("  reads:   %5d selects                   median %0.1f ms   max %0.1f ms" % (
+        len(readTimes), np.median(readTimes) * 1e3, readTimes.max() * 1e3))
+    print("  'database is locked' errors: %d" % len(errors))
+
+
+def main(duration=5.0, nReaders=2):
+    path = tempfile.mkdtemp()
+    try:
+        for name, wal in [('write-ahead log', True), ('rollback journal', False)]:
+            result = run(os.path.join(path, 'events_%d.sqlite' % wal), duration, nReaders, wal)
+            report(name, *(result + (duration,)))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    nReaders = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    main(duration, nReaders)
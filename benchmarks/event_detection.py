@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for functions.zeroCrossingEvents, functions.thresholdEvents and
+functions.clementsBekkers on a synthetic multi-minute recording of spontaneous
+synaptic currents. Compares the vectorized implementations against the per-event
+loops they replaced (the reference implementations used by
+acq4/util/tests/test_events.py), and the FFT-based Clements-Bekkers fit against
+direct correlation of the template with the trace.
+
+Usage:  python benchmarks/event_detection.py [minutes] [sampleRate] [eventRate]
+"""
+from __future__ import print_function
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import scipy.ndimage, scipy.signal
+from acq4.util import functions, ptime
+from acq4.util.tests.test_events import loopZeroCrossingEvents, loopThresholdEvents
+
+
+def makeRecording(duration, rate, eventRate):
+    """Gaussian noise with negative exponential PSCs at random times (Poisson process)."""
+    n = int(duration * rate)
+    data = np.random.normal(scale=5e-12, size=n)
+    data = scipy.ndimage.gaussian_filter1d(data, 2)  ## noise is low-pass filtered by the amplifier
+    nEvents = np.random.poisson(duration * eventRate)
+    times = np.random.randint(0, n, size=nEvents)
+    amps = -np.random.lognormal(np.log(30e-12), 0.5, size=nEvents)
+    impulses = np.zeros(n)
+    np.add.at(impulses, times, amps)
+    t = np.arange(int(0.05 * rate)) / rate
+    kernel = (1 - np.exp(-t / 0.5e-3)) * np.exp(-t / 5e-3)
+    return scipy.signal.fftconvolve(impulses, kernel)[:n] + data, nEvents
+
+
+def directClementsBekkers(data, template):
+    """The previous implementation: running sums plus direct (O(n*N)) correlation."""
+    N = len(template)
+    sumT = template.sum()
+    sumT2 = (template**2).sum()
+    sumD = functions.rollingSum(data, N)
+    sumD2 = functions.rollingSum(data**2, N)
+    sumTD = np.correlate(data, template, mode='valid')
+    scale = (sumTD - sumT * sumD / N) / (sumT2 - sumT**2 / N)
+    offset = (sumD - scale * sumT) / N
+    SSE = sumD2 + scale**2 * sumT2 + N * offset**2 - 2 * (scale*sumTD + offset*sumD - scale*offset*sumT)
+    return scale / np.sqrt(SSE / (N-1)), scale, offset
+
+
+def timeit(fn, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = ptime.time()
+        result = fn()
+        dt = ptime.time() - start
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def main(minutes=5.0, rate=20e3, eventRate=10.0):
+    data, nEvents = makeRecording(minutes * 60, rate, eventRate)
+    print("%0.1f min at %0.0f kHz (%d samples), %d events" % (minutes, rate * 1e-3, len(data), nEvents))
+    threshold = 10e-12
+
+    tests = [
+        ('zeroCrossingEvents', lambda: functions.zeroCrossingEvents(data, minLength=3),
+                               lambda: loopZeroCrossingEvents(data, minLength=3)),
+        ('thresholdEvents', lambda: functions.thresholdEvents(data, threshold, adjustTimes=True),
+                            lambda: loopThresholdEvents(data, threshold, adjustTimes=True)),
+    ]
+    for name, fast, loop in tests:
+        tFast, events = timeit(fast)
+        tLoop, loopEvents = timeit(loop, repeat=1)
+        assert len(events) == len(loopEvents)
+        print("%-20s %7d events   loop: %7.3f s   vectorized: %7.3f s   (%0.0fx)" % (
+            name, len(events), tLoop, tFast, tLoop / tFast))
+
+    ## 20 ms template
+    template = -functions.expTemplate(1.0 / rate, 0.5e-3, 5e-3, delay=0, length=20e-3)
+    tFast, (dc, scale, offset) = timeit(lambda: functions.clementsBekkers(data, template))
+    tDirect, (dcDirect, scaleDirect, offsetDirect) = timeit(lambda: directClementsBekkers(data, template), repeat=1)
+    assert np.allclose(scale, scaleDirect, rtol=1e-6, atol=1e-6 * abs(scaleDirect).max())
+    events = functions.cbTemplateMatch(data, template, threshold=4.0)
+    print("%-20s %7d events   direct: %5.3f s   FFT: %7.3f s   (%0.0fx)" % (
+        'clementsBekkers', len(events), tDirect, tFast, tDirect / tFast))
+
+
+if __name__ == '__main__':
+    args = [float(a) for a in sys.argv[1:]]
+    main(*args)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for live image display, using the simulated camera from the example
+configuration (MockCamera).
+
+Frames from the camera are sent to a FrameDisplay shown in a window. Reports
+the rate at which frames are drawn, the latency from FrameDisplay.newFrame()
+until the frame is handed to the ImageItem, the time spent processing each
+frame in the FrameProcessor thread, and the longest stall of the GUI event loop
+(measured with a 1 ms timer).
+
+Usage:  python benchmarks/frame_display.py [duration] [exposure] [--bg]
+
+    --bg   enable background subtraction
+"""
+from __future__ import print_function
+import os, sys
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, path)
+
+import numpy as np
+from acq4.util import Qt, ptime
+from acq4.Manager import Manager
+from acq4.util.imaging import FrameDisplay
+import acq4.pyqtgraph as pg
+
+
+def run(app, cam, duration, exposure, bg):
+    display = FrameDisplay(maxFps=1000)
+    view = pg.GraphicsView()
+    vb = pg.ViewBox()
+    view.setCentralItem(vb)
+    vb.addItem(display.imageItem())
+    view.resize(800, 800)
+    view.show()
+
+    if bg:
+        display.bgCtrl.ui.subtractBgBtn.setChecked(True)
+
+    latency = []
+    drawTimes = []
+    display.imageUpdated.connect(lambda frame: (latency.append(display.displayLatency), drawTimes.append(ptime.time())))
+
+    ## measure responsiveness of the GUI event loop
+    gaps = []
+    lastTick = [ptime.time()]
+    def tick():
+        now = ptime.time()
+        gaps.append(now - lastTick[0])
+        lastTick[0] = now
+    timer = Qt.QTimer()
+    timer.timeout.connect(tick)
+    timer.start(1)
+
+    nFrames = [0]
+    def newFrame(frame):
+        nFrames[0] += 1
+        if bg and display.bgCtrl.backgroundFrame is None:
+            ## use the first frame as background
+            display.bgCtrl.backgroundFrame = frame.getImage().astype(np.float32)
+        display.newFrame(frame)
+    cam.sigNewFrame.connect(newFrame)
+    cam.setParam('exposure', exposure)
+    cam.start()
+    try:
+        start = ptime.time()
+        while ptime.time() < start + duration:
+            app.processEvents()
+    finally:
+        cam.stop()
+        cam.sigNewFrame.disconnect(newFrame)
+        timer.stop()
+        processTimes = list(display.processor.processTimes)
+        display.quit()
+        view.close()
+
+    return {
+        'cameraFps': nFrames[0] / duration,
+        'displayFps': (len(drawTimes) - 1) / (drawTimes[-1] - drawTimes[0]) if len(drawTimes) > 1 else 0,
+        'latency': np.array(latency),
+        'processTime': np.array(processTimes),
+        'maxGap': max(gaps) if len(gaps) > 0 else 0,
+    }
+
+
+def main(argv):
+    bg = '--bg' in argv
+    argv = [a for a in argv if a != '--bg']
+    duration = float(argv[0]) if len(argv) > 0 else 10.0
+    exposure = float(argv[1]) if len(argv) > 1 else 1e-3
+
+    app = pg.mkQApp()
+    man = Manager(configFile=os.path.join(path, 'config', 'example', 'default.cfg'), argv=['-n', '-m', 'Console'])
+    try:
+        cam = man.getDevice('Camera')
+        result = run(app, cam, duration, exposure, bg)
+    finally:
+        man.quit()
+
+    lat = result['latency']
+    print("%0.1f s, exposure %0.1f ms%s:" % (duration, exposure * 1e3, ", background subtraction" if bg else ""))
+    print("  camera frame rate:   %0.1f fps" % result['cameraFps'])
+    print("  display frame rate:  %0.1f fps" % result['displayFps'])
+    if len(lat) > 0:
+        print("  display latency:     median %0.2f ms   95%% %0.2f ms   max %0.2f ms" % (
+            np.median(lat) * 1e3, np.percentile(lat, 95) * 1e3, lat.max() * 1e3))
+    if len(result['processTime']) > 0:
+        print("  processing time:     median %0.2f ms (worker thread)" % (np.median(result['processTime']) * 1e3))
+    print("  longest GUI stall:   %0.2f ms" % (result['maxGap'] * 1e3))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
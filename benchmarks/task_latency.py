@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for Manager.Task completion latency, using the simulated DAQ and
+patch clamp from the example configuration (MockNIDAQ + MockClamp).
+
+For each run, reports the time between the end of the requested task duration
+and Task.execute() returning, and the CPU time consumed while waiting. Run
+with --poll to compare against polling every device (the behavior before
+DeviceTask.notifyDone() was introduced).
+
+Usage:  python benchmarks/task_latency.py [--poll] [nRuns] [duration]
+"""
+from __future__ import print_function
+import os, sys
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, path)
+
+import numpy as np
+from acq4.util import ptime
+from acq4.Manager import Manager
+import acq4.pyqtgraph as pg
+
+
+def cpuTime():
+    ## user + system time of this process (time.process_time is not available in python 2)
+    t = os.times()
+    return t[0] + t[1]
+
+
+def run(man, nRuns, duration, rate=20e3):
+    numPts = int(duration * rate)
+    cmd = {
+        'protocol': {'duration': duration},
+        'DAQ': {'rate': rate, 'numPts': numPts},
+        'Clamp1': {'mode': 'ic', 'command': np.zeros(numPts), 'holding': 0.0},
+    }
+
+    latency = []
+    cpu = []
+    for i in range(nRuns):
+        task = man.createTask(cmd)
+        cpuStart = cpuTime()
+        task.execute(block=False)
+        while not task.isDone():
+            task.waitForCompletion()
+        latency.append(ptime.time() - (task.startTime + duration))
+        cpu.append(cpuTime() - cpuStart)
+        task.getResult()
+    return np.array(latency), np.array(cpu)
+
+
+def main(argv):
+    poll = '--poll' in argv
+    argv = [a for a in argv if a != '--poll']
+    nRuns = int(argv[0]) if len(argv) > 0 else 50
+    duration = float(argv[1]) if len(argv) > 1 else 0.1
+
+    app = pg.mkQApp()
+    man = Manager(configFile=os.path.join(path, 'config', 'example', 'default.cfg'), argv=['-n', '-m', 'Console'])
+
+    if poll:
+        import acq4.devices.NiDAQ.nidaq as nidaq
+        nidaq.Task.notifiesDone = False
+
+    try:
+        latency, cpu = run(man, nRuns, duration)
+    finally:
+        man.quit()
+
+    print("%s, %d runs of %0.0f ms:" % ("polling" if poll else "notification", nRuns, duration * 1e3))
+    print("  latency after duration:  median %0.2f ms   95%% %0.2f ms   max %0.2f ms" % (
+        np.median(latency) * 1e3, np.percentile(latency, 95) * 1e3, latency.max() * 1e3))
+    print("  CPU time per run:        mean %0.2f ms" % (cpu.mean() * 1e3))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
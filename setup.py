@@ -195,6 +195,7 @@ setup(
         'scipy',
         'h5py',
         'pillow',
+        'futures; python_version < "3"',
         ],
     scripts = scripts,
     **setupOpts